@@ -1,50 +1,39 @@
 # -*- coding: utf-8 -*-
 import os
 import sys
-import pandas as pd
 import re
 import time
 import logging
 import threading
 import collections
+import random
+import json
+import hashlib
+import sqlite3
+import unicodedata
+import concurrent.futures
+import math
 from flask_cors import CORS
 
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, Response, request, jsonify, stream_with_context
 
-from chromadb.config import DEFAULT_TENANT, DEFAULT_DATABASE, Settings
-from chromadb import PersistentClient
-from chromadb.utils import embedding_functions
 import google.generativeai as genai
+from google.generativeai import client as genai_client
 from google.generativeai.types.safety_types import HarmCategory, HarmBlockThreshold
+from google.api_core import exceptions as google_exceptions
+
+import metrics
+from jobs import JOB_RUNNING, JOB_DONE, JOB_FAILED, DreamQueueFull, normalize_dream_text, open_job_backend
+from ruya_index import (
+    MODEL_CONFIG, CHROMA_DB_BASE_PATH, EXCEL_FILE_PATH,
+    collection_db_path, collection_distance_space, hnsw_metadata, load_excel_to_chromadb, load_existing_chromadb, load_numpy_index,
+    load_embedding_function, check_embedding_backend, EMBEDDING_BACKEND, LexicalIndex
+)
 
 # --- Yapılandırma ve Başlangıç Ayarları ---
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-CHROMA_DB_BASE_PATH = os.getenv('CHROMA_DB_PATH', './chroma_db_data')
-EXCEL_FILE_PATH = os.getenv('EXCEL_FILE_PATH', './data/son_guncellenmis_dosya.xlsx')
-os.makedirs(CHROMA_DB_BASE_PATH, exist_ok=True)
-os.makedirs(os.path.dirname(EXCEL_FILE_PATH), exist_ok=True)
-
-MODEL_CONFIG = {
-    "DistilUSE": {
-        "model_name": "distiluse-base-multilingual-cased-v1",
-        "collection_name": "RuyaTabirleri_distiluse"
-    },
-    "BERT-Turkish": {
-        "model_name": "emrecan/bert-base-turkish-cased-mean-nli-stsb-tr",
-        "collection_name": "RuyaTabirleri_bert_turkish"
-    },
-    "PubMedBERT": {
-        "model_name": "NeuML/pubmedbert-base-embeddings",
-        "collection_name": "RuyaTabirleri_pubmed"
-    },
-    "GIST": {
-        "model_name": "avsolatorio/GIST-small-Embedding-v0",
-        "collection_name": "RuyaTabirleri_gist"
-    }
-}
-
 safety_settings = {
     HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
     HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_ONLY_HIGH,
@@ -52,113 +41,254 @@ safety_settings = {
     HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
 }
 
-# --- Yardımcı Fonksiyonlar (Değişiklik Yok) ---
-def create_chroma_client(collection_name, embedding_function, chroma_db_path):
-    chroma_client = PersistentClient(
-        path=chroma_db_path,
-        settings=Settings(),
-        tenant=DEFAULT_TENANT,
-        database=DEFAULT_DATABASE
-    )
-    full_collection_name = f"{collection_name}"
-    chroma_collection = chroma_client.get_or_create_collection(
-        name=full_collection_name,
-        embedding_function=embedding_function
-    )
-    logging.info(f"ChromaDB istemcisi ve koleksiyon '{full_collection_name}' hazırlandı/yüklendi. Path: {chroma_db_path}")
-    return chroma_client, chroma_collection
-
-def load_excel_to_chromadb(collection_name, sentence_transformer_model, chroma_db_path, file_path, batch_size=4000):
-    logging.info(f"Excel dosyasından '{file_path}' ChromaDB'ye '{collection_name}' yükleniyor (batch_size={batch_size})....")
-    try:
-        df = pd.read_excel(file_path)
-        if 'Rüya' not in df.columns or 'Yorum' not in df.columns:
-            raise ValueError("Excel dosyasında 'Rüya' ve 'Yorum' sütunları olmalı.")
+# --- Sorgu Embedding Katmanı ---
+def normalize_query_text(text):
+    # Önbellek anahtarı için: Unicode NFC ve boşluk sadeleştirme. Büyük/küçük harf korunur (cased modeller için anlamlı).
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+class LRUCache:
+    """Boyutu sınırlı, thread-safe LRU önbelleği; name, istatistiklerde (/health, metrikler) önbelleği ayırt eder."""
+
+    def __init__(self, name, capacity=10000):
+        self.name = name
+        self.capacity = capacity
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+class EmbeddingCache(LRUCache):
+    """(model, normalize edilmiş metin) anahtarlı, boyutu sınırlı LRU sorgu embedding önbelleği."""
+
+    def __init__(self, capacity=10000):
+        super().__init__("embedding", capacity=capacity)
+
+class QueryEmbedder:
+    """Bir embedding modeli için sorgu metinlerini önbellekten veya toplu (batch) olarak embed eder.
+
+    Önbellekte olmayan metinler kısa bir pencere (batch_window sn) boyunca biriktirilir ve
+    eşzamanlı isteklerden gelenlerle birlikte tek bir embedding_function çağrısıyla işlenir.
+    """
 
-        ruyalar = df['Rüya'].tolist()
-        yorumlar = df['Yorum'].tolist()
-        ids_orig = [str(i) for i in range(len(ruyalar))]
-        metadatas_orig = [{'yorum': yorum} for yorum in yorumlar]
+    def __init__(self, model_key, embedding_function, cache, batch_window=0.005, max_batch_size=256):
+        self.model_key = model_key
+        self.embedding_function = embedding_function
+        self.cache = cache
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.batches = 0
+        self._pending = collections.OrderedDict() # { normalize_metin: Future }
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name=f"embedder-{model_key}", daemon=True)
+        self._thread.start()
+
+    def embed(self, texts):
+        normalized = [normalize_query_text(t) for t in texts]
+        vectors = [None] * len(normalized)
+        waiting = {}
+        for i, text in enumerate(normalized):
+            cached = self.cache.get((self.model_key, text))
+            if cached is not None:
+                vectors[i] = cached
+            else:
+                waiting.setdefault(text, []).append(i)
+        if waiting:
+            futures = {}
+            with self._cond:
+                if self._closed:
+                    # Kapatıldıktan sonra eklenen metin hiçbir batch'e girmez; beklemek yerine hemen hata verilir.
+                    raise RuntimeError(f"{self.model_key} modeli bellekten boşaltıldı; sorgu embed edilemedi.")
+                for text in waiting:
+                    future = self._pending.get(text)
+                    if future is None:
+                        future = concurrent.futures.Future()
+                        self._pending[text] = future
+                    futures[text] = future
+                self._cond.notify()
+            for text, indices in waiting.items():
+                vector = futures[text].result()
+                for i in indices:
+                    vectors[i] = vector
+        return vectors
+
+    def close(self):
+        # Yeni sorgu kabul edilmez; bekleyen sorgular işlenip batch thread'i sonlanana kadar beklenir
+        # (model bellekten boşaltılırken, model bırakılmadan önce).
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._closed)
+                if not self._pending:
+                    return
+            # Aynı anda gelen diğer isteklerin de bu batch'e katılabilmesi için kısa bir süre beklenir.
+            if self.batch_window > 0:
+                time.sleep(self.batch_window)
+            with self._cond:
+                batch = []
+                while self._pending and len(batch) < self.max_batch_size:
+                    batch.append(self._pending.popitem(last=False))
+            texts = [text for text, _ in batch]
+            try:
+                embeddings = self.embedding_function(texts)
+                self.batches += 1
+                for (text, future), vector in zip(batch, embeddings):
+                    self.cache.put((self.model_key, text), vector)
+                    future.set_result(vector)
+                if len(embeddings) != len(batch):
+                    raise RuntimeError(f"{len(batch)} metin için {len(embeddings)} embedding döndü.")
+            except Exception as e:
+                logging.error(f"{self.model_key} için sorgu embedding hesaplanırken hata: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
 
-        embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
-            model_name=sentence_transformer_model
-        )
-        chroma_client, chroma_collection = create_chroma_client(
-            collection_name, embedding_function, chroma_db_path
-        )
 
-        current_count = chroma_collection.count()
-        total_docs = len(ruyalar)
-
-        if current_count < total_docs or True: # Force update or check for updates
-            logging.info(f"'{collection_name}' koleksiyonuna {total_docs} öğe {batch_size} boyutlu batch'ler halinde ekleniyor/güncelleniyor...")
-            for i in range(0, total_docs, batch_size):
-                batch_end = min(i + batch_size, total_docs)
-                batch_ids = ids_orig[i:batch_end]
-                batch_documents = ruyalar[i:batch_end]
-                batch_metadatas = metadatas_orig[i:batch_end]
-                if not batch_documents:
-                    continue
-                logging.info(f"  Batch {i // batch_size + 1}: {len(batch_documents)} öğe ekleniyor (ID'ler {batch_ids[0]}...{batch_ids[-1]})")
-                chroma_collection.upsert(
-                    ids=batch_ids,
-                    documents=batch_documents,
-                    metadatas=batch_metadatas
-                )
-                logging.info(f"  Batch {i // batch_size + 1} tamamlandı.")
-            logging.info(f"Koleksiyona toplam {total_docs} rüya-yorum çifti eklendi/güncellendi.")
+def retrieve_docs_batch(chroma_collection, queries, n_results=5, embedder=None):
+    # Tüm sorgular tek bir Chroma çağrısıyla gönderilir; sonuç her sorgu için tek sorguluk Chroma yanıtı biçimindedir.
+    # embedder verilirse sorgu vektörleri önbellekli/toplu embedding katmanından alınır.
+    if not queries:
+        return []
+    try:
+        if embedder is not None:
+            results = chroma_collection.query(
+                query_embeddings=embedder.embed(queries),
+                n_results=n_results,
+                include=['documents', 'metadatas', 'distances']
+            )
         else:
-            logging.info(f"'{collection_name}' koleksiyonu zaten güncel ({current_count} öğe).")
-
-        final_count = chroma_collection.count()
-        logging.info(f"'{collection_name}' koleksiyonunda toplam {final_count} öğe var.")
-        if final_count != total_docs and (current_count < total_docs or True):
-            logging.warning(f"DİKKAT: Eklenen öğe sayısı ({final_count}) Excel'deki öğe sayısıyla ({total_docs}) eşleşmiyor!")
-        return chroma_client, chroma_collection
-    except FileNotFoundError:
-        logging.error(f"Excel dosyası bulunamadı: {file_path}")
-        raise
+            results = chroma_collection.query(
+                query_texts=list(queries),
+                n_results=n_results,
+                include=['documents', 'metadatas', 'distances']
+            )
+        return [
+            {
+                'documents': [results['documents'][i]],
+                'metadatas': [results['metadatas'][i]],
+                'distances': [results['distances'][i]]
+            }
+            for i in range(len(queries))
+        ]
     except Exception as e:
-        logging.error(f"Excel yüklenirken hata oluştu: {e}")
+        # Hata yutulmaz: boş sonuç "tabir bulunamadı" yorumuna dönüşüp önbelleğe yazılabilirdi.
+        logging.error(f"ChromaDB toplu sorgusu sırasında hata: {e}")
         raise
 
-def load_existing_chromadb(collection_name, sentence_transformer_model, chroma_db_path):
-    logging.info(f"Mevcut ChromaDB koleksiyonu '{collection_name}' yükleniyor...")
-    embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
-        model_name=sentence_transformer_model
-    )
-    chroma_client, chroma_collection = create_chroma_client(
-        collection_name, embedding_function, chroma_db_path
-    )
-    count = chroma_collection.count()
-    if count == 0:
-        logging.warning(f"UYARI: Koleksiyon '{collection_name}' boş! Excel yüklemesi denenmeli.")
-    logging.info(f"Mevcut koleksiyon '{collection_name}' yüklendi: {count} öğe.")
-    return chroma_client, chroma_collection
+def lexical_search(queries, n_results=5):
+    # Sorgu -> BM25 başlık eşleşmeleri; sözcüksel indeks yoksa veya kapalıysa boş döner.
+    if lexical_index is None or RETRIEVAL_MODE != "hybrid":
+        return {}
+    return {q: lexical_index.search(q, n_results) for q in queries}
+
+def is_lexical_short_circuit(hits):
+    # Yalnızca kelimeleri birebir aynı başlıkta vektör araması atlanır; kökleri tutan başlık yeterli değildir.
+    return bool(hits) and hits[0]["exact"] and hits[0]["match"] >= LEXICAL_SHORT_CIRCUIT_MATCH
+
+def fuse_results(results, lexical_hits, k=None):
+    # Vektör ve BM25 sıralamaları Reciprocal Rank Fusion ile birleştirilir; (rüya, yorum, mesafe) döner.
+    # Yalnızca sözcüksel listede bulunan sonucun vektör mesafesi bilinmediğinden mesafe None olur.
+    k = HYBRID_RRF_K if k is None else k
+    candidates = {}
+    if results and results['documents'] and results['documents'][0]:
+        for rank, (doc, metadata, dist) in enumerate(zip(results['documents'][0], results['metadatas'][0], results['distances'][0])):
+            key = (doc, (metadata or {}).get('yorum', 'Yorum bulunamadı.'))
+            entry = candidates.setdefault(key, {"score": 0.0, "distance": dist, "rank": rank})
+            entry["score"] += 1.0 / (k + rank + 1)
+    for rank, hit in enumerate(lexical_hits or []):
+        entry = candidates.setdefault((hit["ruya"], hit["yorum"]), {"score": 0.0, "distance": None, "rank": len(candidates)})
+        entry["score"] += LEXICAL_FUSION_WEIGHT / (k + rank + 1)
+    if not candidates:
+        return "Uygun rüya bulunamadı", "Yorum bulunamadı.", float('inf')
+    (ruya, yorum), best = max(candidates.items(), key=lambda item: (item[1]["score"], -item[1]["rank"]))
+    return ruya, yorum, best["distance"]
+
+def distance_to_similarity(distance, space):
+    # Modeller arasında karşılaştırılabilir 0-1 benzerlik. Koleksiyonlar kosinüs uzayındadır (eskiler için
+    # ruya_index.py --migrate-space); kare L2 yalnızca birim vektörlerde (d = 2 - 2*kosinüs) anlamlıdır.
+    if distance is None:
+        return None
+    if space in ("cosine", "ip"):
+        similarity = 1.0 - distance
+    else:
+        similarity = 1.0 - distance / 2.0
+    return max(0.0, min(1.0, similarity))
 
-def retrieve_docs(chroma_collection, query, n_results=5):
-    try:
-        results = chroma_collection.query(
-            query_texts=[query],
-            n_results=n_results,
-            include=['documents', 'metadatas', 'distances']
-        )
-        return results
-    except Exception as e:
-        logging.error(f"ChromaDB sorgusu sırasında hata: {e}")
-        return {'documents': [[]], 'metadatas': [[]], 'distances': [[]]}
+class StatelessChat:
+    """send_message arayüzünü koruyarak her çağrıyı geçmişsiz, bağımsız bir generate_content isteği olarak gönderir.
+
+    Sistem talimatı modele system_instruction olarak verilir; böylece isteklerin boyutu sabit kalır ve
+    farklı kullanıcıların rüyaları birbirinin bağlamına karışmaz.
+    """
 
-def filter_relevant_result(docs, metadatas, distances):
-    if docs and docs[0]:
-        return docs[0][0], metadatas[0][0].get('yorum', 'Yorum bulunamadı.'), distances[0][0]
-    return "Uygun rüya bulunamadı", "Yorum bulunamadı.", float('inf')
+    def __init__(self, model):
+        self.model = model
+
+    def send_message(self, content, **kwargs):
+        return self.model.generate_content(content, **kwargs)
+
+# "stateless": her çağrı bağımsız (varsayılan); "chat": eski davranış, anahtar başına sürekli büyüyen tek sohbet oturumu
+LLM_SESSION_MODE = os.getenv('LLM_SESSION_MODE', 'stateless').lower()
+
+# genai.configure süreç geneli bir ayardır ve google-generativeai (0.8.x, requirements.txt'de sabitlendi)
+# GenerativeModel'e istemci vermenin desteklenen bir yolunu sunmaz; model istemcisini ilk çağrıda o an
+# yapılandırılmış anahtarla kendisi oluşturur. Anahtar başına modeller bu yüzden yapılandırma ile birlikte
+# tek bir kilit altında ve istemcileri hemen bağlanarak kurulur.
+genai_configure_lock = threading.Lock()
+
+def build_genai_model(model_name, api_key, **model_kwargs):
+    with genai_configure_lock:
+        genai.configure(api_key=api_key)
+        model = genai.GenerativeModel(model_name, **model_kwargs)
+        # GenerativeModel'in ilk çağrıda yaptığı bağlamayı öne alır; aksi halde son yapılandırılan anahtar kullanılırdı.
+        model._client = genai_client.get_default_generative_client()
+    return model
 
 def build_chatbot(system_prompt, api_key):
     try:
-        genai.configure(api_key=api_key)
         model_name_to_use = 'learnlm-2.0-flash-experimental' # Orijinal dosyadan gelen
         logging.info(f"Gemini modeli olarak '{model_name_to_use}' kullanılıyor.")
-        model = genai.GenerativeModel(model_name_to_use, safety_settings=safety_settings)
+        if LLM_SESSION_MODE != "chat":
+            model = build_genai_model(model_name_to_use, api_key, safety_settings=safety_settings, system_instruction=system_prompt)
+            logging.info(f"Gemini ({model_name_to_use}) geçmişsiz (stateless) modda hazırlandı.")
+            return StatelessChat(model)
+        model = build_genai_model(model_name_to_use, api_key, safety_settings=safety_settings)
         chat = model.start_chat()
         chat.send_message(system_prompt)
         logging.info(f"Gemini Chatbot ({model_name_to_use}) başarıyla oluşturuldu.")
@@ -167,26 +297,332 @@ def build_chatbot(system_prompt, api_key):
         logging.error(f"Gemini Chatbot oluşturulurken hata: {e}")
         return None
 
-REQUEST_DELAY = 1.0
+# LLM çağrıları arasında sabit bekleme artık gerekmiyor; hız sınırı API anahtarı başına TokenBucket ile uygulanır.
+REQUEST_DELAY = float(os.getenv('REQUEST_DELAY', '0'))
+
+class TokenBucket:
+    """Dakikadaki istek sınırını (RPM) uygulayan, thread-safe token bucket.
+
+    acquire() yalnızca bucket gerçekten boşsa bekler. penalize() sunucudan gelen 429/Retry-After
+    sinyalinden sonra verilen süre boyunca yeni çağrıları durdurur.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(capacity if capacity else max(1, rate_per_minute))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if now >= self._blocked_until and self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = max(self._blocked_until - now, (1.0 - self._tokens) / self.rate if self.rate > 0 else 1.0)
+            time.sleep(wait)
+
+    def wait_estimate(self):
+        # acquire() çağrılsaydı ne kadar bekleneceği (sn); bucket'ı değiştirmez.
+        with self._lock:
+            now = time.monotonic()
+            tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            if now >= self._blocked_until and tokens >= 1.0:
+                return 0.0
+            return max(self._blocked_until - now, (1.0 - tokens) / self.rate if self.rate > 0 else 1.0)
+
+    def penalize(self, seconds):
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+def is_rate_limit_error(error):
+    # Yalnızca hata türüne/HTTP durumuna bakılır; mesajda "429" veya "quota" geçmesi hız sınırı sayılmaz.
+    if isinstance(error, (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)):
+        return True
+    return getattr(error, "code", None) == 429
+
+def retry_after_seconds(error):
+    # Gemini 429 hatalarındaki "retry_delay { seconds: N }" veya "retry in Ns" ipucunu okur.
+    match = re.search(r"retry_delay\s*\{\s*seconds:\s*(\d+)", str(error)) or re.search(r"retry in ([\d.]+)\s*s", str(error), re.IGNORECASE)
+    return float(match.group(1)) if match else None
+
+class RateLimitedChat:
+    """Tek bir API anahtarının chat oturumunu o anahtarın TokenBucket'ı üzerinden çağırır ve metriklerini tutar.
+
+    Hata yeniden denenmez; yeniden deneme ve geri çekilme ScheduledChat'te, başka bir anahtarla yapılır.
+    """
+
+    def __init__(self, chat, limiter, api_key_label="", chat_kind=""):
+        self.chat = chat
+        self.limiter = limiter
+        # Metrik etiketleri; akış (stream) çağrılarında süre ilk yanıta kadar ölçülür.
+        self.request_seconds = LLM_REQUEST_SECONDS.labels(api_key_label, chat_kind)
+        self.metric_labels = (api_key_label, chat_kind)
+
+    def send_message(self, content, **kwargs):
+        self.limiter.acquire()
+        started = time.perf_counter()
+        try:
+            response = self.chat.send_message(content, **kwargs)
+        except Exception as e:
+            LLM_ERRORS.labels(*self.metric_labels, "rate_limit" if is_rate_limit_error(e) else "error").inc()
+            raise
+        self.request_seconds.observe(time.perf_counter() - started)
+        return response
+
+def is_request_error(error):
+    # İsteğin kendisinden kaynaklanan (400) hatalar anahtarın sağlığına yazılmaz ve başka anahtarla denenmez.
+    return isinstance(error, google_exceptions.InvalidArgument)
+
+KEY_CLOSED = "closed" # Anahtar kullanımda
+KEY_OPEN = "open" # Devre kesici açık; bekleme süresi dolunca arka planda yoklanır
+KEY_PROBING = "probing" # Yoklama sürüyor
+
+class ApiKeyState:
+    """Tek bir API anahtarının chatbotları, yükü ve sağlık durumu; ApiKeyScheduler'ın kilidi altında güncellenir."""
+
+    def __init__(self, index, api_key, limiter):
+        self.index = index
+        self.label = str(index + 1)
+        self.api_key = api_key
+        self.limiter = limiter
+        self.chats = {} # Tür ("interpretation" / "rewrite") -> RateLimitedChat
+        self.in_flight = 0
+        self.latency = None # Başarılı çağrıların üstel hareketli ortalaması (sn)
+        self.outcomes = collections.deque() # (monotonic zaman, "ok" | "rate_limit" | "error")
+        self.state = KEY_CLOSED
+        self.consecutive_failures = 0
+        self.cooldown = 0.0
+        self.open_until = 0.0
+        self.last_error = None
+
+class ApiKeyScheduler:
+    """LLM çağrılarını API anahtarları arasında yük ve sağlık durumuna göre dağıtır.
+
+    Her çağrı, devre kesicisi kapalı anahtarlar içinden beklenen gecikmesi en düşük olana gider. Beklenen
+    gecikme; hız sınırı beklemesi, süren çağrı sayısı, son gecikme ortalaması ve son window saniyedeki
+    hata oranından hesaplanır. Art arda failure_threshold hata veren anahtarın devresi açılır. Bekleme süresi
+    (cooldown, her başarısız yoklamada ikiye katlanır) dolan anahtarlar arka planda yoklanıp geri alınır.
+    """
+
+    def __init__(self, api_keys, limiters, failure_threshold=3, cooldown=30.0, max_cooldown=600.0, window=60.0, latency_alpha=0.2):
+        self.keys = [ApiKeyState(i, api_key, limiter) for i, (api_key, limiter) in enumerate(zip(api_keys, limiters))]
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.window = window
+        self.latency_alpha = latency_alpha
+        self._lock = threading.Lock()
+
+    def _trim(self, key, now):
+        while key.outcomes and now - key.outcomes[0][0] > self.window:
+            key.outcomes.popleft()
+
+    def _error_rate(self, key, now):
+        self._trim(key, now)
+        if not key.outcomes:
+            return 0.0
+        return sum(1 for _, outcome in key.outcomes if outcome != "ok") / len(key.outcomes)
+
+    def _expected_seconds(self, key, now):
+        latency = key.latency if key.latency is not None else 1.0
+        return key.limiter.wait_estimate() + latency * (key.in_flight + 1) / max(0.1, 1.0 - self._error_rate(key, now))
+
+    def acquire(self, kind, exclude=()):
+        # En uygun anahtarı seçip süren çağrı sayısını artırır; kullanılabilir anahtar yoksa None döner.
+        with self._lock:
+            now = time.monotonic()
+            candidates = [key for key in self.keys if key.state == KEY_CLOSED and kind in key.chats and key.index not in exclude]
+            if not candidates:
+                return None
+            key = min(candidates, key=lambda candidate: self._expected_seconds(candidate, now))
+            key.in_flight += 1
+            return key
+
+    def release(self, key, outcome, latency=None, error=None):
+        with self._lock:
+            now = time.monotonic()
+            key.in_flight = max(0, key.in_flight - 1)
+            key.outcomes.append((now, outcome))
+            self._trim(key, now)
+            if outcome == "ok":
+                key.consecutive_failures = 0
+                if latency is not None:
+                    key.latency = latency if key.latency is None else (1 - self.latency_alpha) * key.latency + self.latency_alpha * latency
+            elif outcome == "error":
+                key.consecutive_failures += 1
+                key.last_error = str(error)[:200] if error is not None else None
+                if key.state == KEY_CLOSED and key.consecutive_failures >= self.failure_threshold:
+                    self._open(key, now)
+
+    def _open(self, key, now):
+        key.cooldown = min(self.max_cooldown, key.cooldown * 2 if key.cooldown else self.base_cooldown)
+        key.state = KEY_OPEN
+        key.open_until = now + key.cooldown
+        logging.warning(f"API anahtarı {key.label} devre dışı bırakıldı ({key.cooldown:g} sn sonra yoklanacak). Son hata: {key.last_error}")
+
+    def mark_unavailable(self, key, reason):
+        # Chatbotları oluşturulamayan anahtar; arka plan yoklamasıyla yeniden denenir.
+        with self._lock:
+            key.last_error = reason
+            self._open(key, time.monotonic())
+
+    def due_for_probe(self):
+        with self._lock:
+            now = time.monotonic()
+            due = [key for key in self.keys if key.state == KEY_OPEN and now >= key.open_until]
+            for key in due:
+                key.state = KEY_PROBING
+            return due
+
+    def probe_result(self, key, ok, error=None):
+        with self._lock:
+            if ok:
+                key.state = KEY_CLOSED
+                key.consecutive_failures = 0
+                key.cooldown = 0.0
+                key.outcomes.clear()
+                logging.info(f"API anahtarı {key.label} yoklamayı geçti, yeniden kullanımda.")
+            else:
+                key.last_error = str(error)[:200] if error is not None else key.last_error
+                self._open(key, time.monotonic())
+
+    def available_count(self):
+        with self._lock:
+            return sum(1 for key in self.keys if key.state == KEY_CLOSED and key.chats)
+
+    def snapshot(self):
+        with self._lock:
+            now = time.monotonic()
+            return [
+                {
+                    "api_key": key.label,
+                    "state": key.state,
+                    "in_flight": key.in_flight,
+                    "latency_ms": round(key.latency * 1000.0, 1) if key.latency is not None else None,
+                    "error_rate": round(self._error_rate(key, now), 3),
+                    "calls_in_window": len(key.outcomes),
+                    "retry_in_seconds": round(max(0.0, key.open_until - now), 1) if key.state == KEY_OPEN else 0.0,
+                    "last_error": key.last_error
+                }
+                for key in self.keys
+            ]
+
+class ScheduledChat:
+    """send_message arayüzünü koruyarak her çağrıyı ApiKeyScheduler'ın o an seçtiği anahtarla gönderir.
+
+    Hız sınırına takılan veya hata veren çağrı, max_retries kez, henüz denenmemiş bir anahtarla yeniden
+    denenir. Akış (stream) çağrılarında anahtar, akış bitene kadar meşgul sayılır.
+    """
+
+    def __init__(self, scheduler, kind, max_retries=3, base_backoff=2.0):
+        self.scheduler = scheduler
+        self.kind = kind
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+
+    def send_message(self, content, **kwargs):
+        attempt = 0
+        tried = set()
+        while True:
+            key = self.scheduler.acquire(self.kind, exclude=tried)
+            if key is None and tried:
+                # Tüm anahtarlar denendi; hız sınırı beklemesi en kısa olan yeniden seçilir.
+                tried.clear()
+                key = self.scheduler.acquire(self.kind)
+            if key is None:
+                raise RuntimeError("Kullanılabilir API anahtarı yok (tümünün devre kesicisi açık).")
+            started = time.perf_counter()
+            try:
+                response = key.chats[self.kind].send_message(content, **kwargs)
+            except Exception as e:
+                if is_request_error(e):
+                    self.scheduler.release(key, "ok")
+                    raise
+                rate_limited = is_rate_limit_error(e)
+                if rate_limited:
+                    key.limiter.penalize(retry_after_seconds(e) or self.base_backoff * (2 ** attempt) * (1 + random.random() * 0.25))
+                self.scheduler.release(key, "rate_limit" if rate_limited else "error", error=e)
+                if attempt >= self.max_retries:
+                    raise
+                logging.warning(f"API anahtarı {key.label} ile çağrı başarısız ({'hız sınırı' if rate_limited else e}); başka bir anahtarla yeniden denenecek (deneme {attempt + 1}/{self.max_retries}).")
+                tried.add(key.index)
+                attempt += 1
+                continue
+            latency = time.perf_counter() - started
+            if kwargs.get("stream"):
+                return self._track_stream(key, response, latency)
+            self.scheduler.release(key, "ok", latency)
+            return response
+
+    def _track_stream(self, key, response, latency):
+        outcome, error = "ok", None
+        try:
+            for chunk in response:
+                yield chunk
+        except Exception as e:
+            outcome, error = ("rate_limit" if is_rate_limit_error(e) else "error"), e
+            raise
+        finally:
+            self.scheduler.release(key, outcome, latency if outcome == "ok" else None, error)
+
+class LLMStreamInterrupted(RuntimeError):
+    """Akış yanıtın ortasında kesildi; o ana kadar alınan kısmi metin sonuç olarak kullanılmamalıdır."""
+
+def llm_error_message(error):
+    if is_rate_limit_error(error):
+        return "API kullanım limiti aşıldı. Lütfen daha sonra tekrar deneyin."
+    return f"Model ile iletişimde hata oluştu: {error}"
+
+def request_llm_answer(prompt, context, chat, delay=REQUEST_DELAY, on_chunk=None):
+    # generate_llm_answer gibidir ama hatayı metne çevirmez; çağıran yanıtın eksiksiz gelip gelmediğini bilir.
+    # on_chunk verilirse yanıt akış (stream) olarak alınır ve biriken metin her parçada on_chunk'a iletilir.
+    if chat is None:
+        raise RuntimeError("LLM Chatbot başlatılamadı.")
+    full_prompt = f"{prompt}\n\n{context}".strip()
+    if on_chunk is None:
+        response = chat.send_message(full_prompt)
+        if delay > 0:
+            time.sleep(delay)
+        return response.text
+    received = []
+    try:
+        response = chat.send_message(full_prompt, stream=True)
+        for chunk in response:
+            text = chunk.text
+            if text:
+                received.append(text)
+                on_chunk("".join(received))
+    except Exception as e:
+        if received:
+            # Yarım yanıt tamamlanmış gibi dönerse iş 'done' olur ve önbelleğe yazılır; iş başarısız sayılmalı.
+            logging.error(f"LLM yanıtı alınırken hata: {e}")
+            raise LLMStreamInterrupted(f"Yanıt akışı {len(''.join(received))} karakterden sonra kesildi: {e}") from e
+        raise
+    if delay > 0:
+        time.sleep(delay)
+    return "".join(received)
 
-def generate_llm_answer(prompt, context, chat, delay=REQUEST_DELAY):
+def generate_llm_answer(prompt, context, chat, delay=REQUEST_DELAY, on_chunk=None):
+    # Hata durumunda kullanıcıya gösterilebilecek bir mesaj döner; yalnızca yarıda kesilen akış hata fırlatır.
     if chat is None:
         logging.error("LLM Chatbot başlatılamadığı için yanıt üretilemiyor.")
         return "Chatbot hatası nedeniyle yorum yapılamadı."
     try:
-        full_prompt = f"{prompt}\n\n{context}".strip()
-        response = chat.send_message(full_prompt)
-        time.sleep(delay)
-        return response.text
+        return request_llm_answer(prompt, context, chat, delay, on_chunk)
+    except LLMStreamInterrupted:
+        raise
     except Exception as e:
         logging.error(f"LLM yanıtı alınırken hata: {e}")
-        if "RateLimitError" in str(e):
-             return "API kullanım limiti aşıldı. Lütfen daha sonra tekrar deneyin."
-        return f"Model ile iletişimde hata oluştu: {e}"
+        return llm_error_message(e)
 
-def generate_queries(rewrite_chat, query, delay=REQUEST_DELAY):
-    rewrite_prompt = f"""Rüyada geçen **anahtar unsurları** (nesneler, varlıklar -insan, hayvan, mitolojik figür vb.-, yerler, olaylar, duygular) ve bu unsurlarla ilişkili **eylemleri/durumları** (görmek, yapmak, olmak, hissetmek vb.) belirle. Bu metni analiz ederek, her bir unsur için uygun sorgular üret. Her sorgu, "Rüyada [Nesne/Varlık] [Eylem]" formatında olmalı ve ayrı bir satırda yazılmalıdır. Ayrıca, tanımlayıcı özellikleri içeren KULLANICININ RÜYASINA UYGUN varyantlarını da ekle. Yanıtlarını sadece sorgular listesi olarak, her satıra bir sorgu gelecek şekilde ver. Açıklama yapma, sadece sorguları üret: {query}"""
-    rewritten_query_text = generate_llm_answer(rewrite_prompt, "", rewrite_chat, delay)
+def parse_rewritten_queries(rewritten_query_text):
     queries = []
     for line in rewritten_query_text.split('\n'):
         line = line.strip()
@@ -195,26 +631,196 @@ def generate_queries(rewrite_chat, query, delay=REQUEST_DELAY):
              if line.lower().startswith("rüyada"):
                  if len(line.split()) > 2:
                     queries.append(line)
-    if not queries:
-        logging.warning(f"Yeniden yazma modeli sorgu üretemedi. Orijinal metin sorgu olarak kullanılıyor: '{query}'")
-        queries.append(f"Rüyada {query}")
-    logging.info(f"Üretilen Rüya Sorguları: {queries}")
     return queries
 
-def generate_model_answer(interpretation_chat, chroma_collection, model_display_name, query, queries, n_results=5, delay=REQUEST_DELAY):
+def local_queries(query):
+    # 'Rüya' başlıklarından kurulan sözlükle LLM'siz sorgu üretimi; sözcüksel indeks yoksa boş döner.
+    if lexical_index is None:
+        return []
+    return lexical_index.extract_queries(query, max_queries=LOCAL_REWRITE_MAX_QUERIES)
+
+def llm_rewrite(rewrite_chat, query, delay=REQUEST_DELAY):
+    rewrite_prompt = f"""Rüyada geçen **anahtar unsurları** (nesneler, varlıklar -insan, hayvan, mitolojik figür vb.-, yerler, olaylar, duygular) ve bu unsurlarla ilişkili **eylemleri/durumları** (görmek, yapmak, olmak, hissetmek vb.) belirle. Bu metni analiz ederek, her bir unsur için uygun sorgular üret. Her sorgu, "Rüyada [Nesne/Varlık] [Eylem]" formatında olmalı ve ayrı bir satırda yazılmalıdır. Ayrıca, tanımlayıcı özellikleri içeren KULLANICININ RÜYASINA UYGUN varyantlarını da ekle. Yanıtlarını sadece sorgular listesi olarak, her satıra bir sorgu gelecek şekilde ver. Açıklama yapma, sadece sorguları üret: {query}"""
+    queries = parse_rewritten_queries(generate_llm_answer(rewrite_prompt, "", rewrite_chat, delay))
+    if queries:
+        # Yalnızca LLM'in gerçekten ürettiği sorgular önbelleğe alınır; zaman aşımına uğrayan çağrılar da geç gelse önbelleği doldurur.
+        rewrite_cache.put(normalize_dream_text(query), tuple(queries))
+    return queries
+
+def generate_queries(rewrite_chat, query, delay=REQUEST_DELAY):
+    # Sıra: önbellek -> (kısa rüyalarda) yerel sözlük -> LLM (QUERY_REWRITE_TIMEOUT ile) -> yerel sözlük -> "Rüyada {query}".
+    cached = rewrite_cache.get(normalize_dream_text(query))
+    if cached is not None:
+        REWRITE_PATHS.labels("cache").inc()
+        logging.info(f"Sorgular önbellekten alındı: {list(cached)}")
+        return list(cached)
+
+    queries = []
+    if QUERY_REWRITE_MODE == "local" or (QUERY_REWRITE_MODE == "auto" and len(query.split()) <= LOCAL_REWRITE_MAX_WORDS):
+        queries = local_queries(query)
+        if queries:
+            REWRITE_PATHS.labels("local").inc()
+            logging.info(f"Sorgular yerel sözlükle üretildi: {queries}")
+            return queries
+
+    if QUERY_REWRITE_MODE != "local":
+        future = rewrite_executor.submit(llm_rewrite, rewrite_chat, query, delay)
+        try:
+            queries = future.result(timeout=QUERY_REWRITE_TIMEOUT if QUERY_REWRITE_TIMEOUT > 0 else None)
+        except concurrent.futures.TimeoutError:
+            logging.warning(f"Sorgu üretimi {QUERY_REWRITE_TIMEOUT:g} sn içinde tamamlanmadı, yerel sözlüğe geçiliyor.")
+        except Exception as e:
+            logging.error(f"Sorgu üretimi sırasında hata: {e}")
+        if queries:
+            REWRITE_PATHS.labels("llm").inc()
+            logging.info(f"Üretilen Rüya Sorguları: {queries}")
+            return queries
+        queries = local_queries(query)
+        if queries:
+            REWRITE_PATHS.labels("local_fallback").inc()
+            logging.warning(f"LLM sorgu üretemedi; yerel sözlükle üretilen sorgular kullanılıyor: {queries}")
+            return queries
+
+    REWRITE_PATHS.labels("original").inc()
+    logging.warning(f"Yeniden yazma modeli sorgu üretemedi. Orijinal metin sorgu olarak kullanılıyor: '{query}'")
+    return [f"Rüyada {query}"]
+
+def generate_model_answer(interpretation_chat, chroma_collection, model_display_name, query, queries, n_results=5, delay=REQUEST_DELAY, lexical_hits=None, embedder=None):
     query_results = []
+    lexical_hits = lexical_hits or {}
     logging.info(f"--- {model_display_name} için Yorumlar Aranıyor ---")
+    space = collection_distance_space(chroma_collection)
+    dense_queries = [q for q in queries if not is_lexical_short_circuit(lexical_hits.get(q))]
+    batch_results = dict(zip(dense_queries, retrieve_docs_batch(chroma_collection, dense_queries, n_results, embedder=embedder)))
     for q in queries:
-        results = retrieve_docs(chroma_collection, q, n_results)
-        if results and results['documents'] and results['documents'][0]:
-             ruya, yorum, dist = filter_relevant_result(results['documents'], results['metadatas'], results['distances'])
-             logging.info(f" Sorgu: '{q}' -> Bulunan Rüya: '{ruya[:50]}...', Mesafe: {dist:.4f}")
-             query_results.append({"query": q, "ruya": ruya, "yorum": yorum})
+        hits = lexical_hits.get(q)
+        if q not in batch_results:
+             logging.info(f" Sorgu: '{q}' -> Başlık eşleşmesi: '{hits[0]['ruya'][:50]}...' (vektör araması atlandı)")
+             query_results.append({"query": q, "ruya": hits[0]["ruya"], "yorum": hits[0]["yorum"], "similarity": hits[0]["match"]})
+             continue
+        results = batch_results[q]
+        if (results and results['documents'] and results['documents'][0]) or hits:
+             ruya, yorum, dist = fuse_results(results, hits)
+             if dist is not None:
+                 similarity = distance_to_similarity(dist, space)
+                 dist_text = f"{dist:.4f}"
+             else:
+                 similarity = next((hit["match"] for hit in hits if hit["ruya"] == ruya and hit["yorum"] == yorum), 0.0)
+                 dist_text = "yok (yalnızca BM25)"
+             logging.info(f" Sorgu: '{q}' -> Bulunan Rüya: '{ruya[:50]}...', Mesafe: {dist_text}")
+             query_results.append({"query": q, "ruya": ruya, "yorum": yorum, "similarity": similarity})
         else:
              logging.warning(f" Sorgu: '{q}' -> {model_display_name} için uygun rüya bulunamadı.")
              query_results.append({"query": q, "ruya": None, "yorum": None})
     return query_results
 
+def retrieve_all_models(interpretation_chat, chroma_collections_map, model_names_list, query, queries, delay=REQUEST_DELAY, lexical_hits=None):
+    # Her embedding modeli için arama retrieval_executor üzerinde eşzamanlı çalıştırılır.
+    # (sonuçlar, aranamayan_modeller) döner; aranamayan modellerin sonuçları boş kabul edilir.
+    def timed_model_answer(model_name, coll, embedder):
+        started = time.perf_counter()
+        answer = generate_model_answer(interpretation_chat, coll, model_name, query, queries, delay=delay, lexical_hits=lexical_hits, embedder=embedder)
+        return answer, time.perf_counter() - started
+
+    futures = {}
+    all_interpretations = {}
+    failed_models = []
+    for model_name in model_names_list:
+        # Koleksiyon ve embedding katmanı birlikte alınır; model arada boşaltılırsa ikisi de aynı anda kaybolur.
+        with model_resources_lock:
+            coll = chroma_collections_map.get(model_name)
+            embedder = query_embedders.get(model_name)
+            if coll:
+                model_last_used[model_name] = time.monotonic()
+        if coll:
+            futures[model_name] = retrieval_executor.submit(timed_model_answer, model_name, coll, embedder)
+        else:
+            logging.warning(f"{model_name} için ChromaDB koleksiyonu bulunamadı.")
+            all_interpretations[model_name] = [{"query": q_text, "ruya": None, "yorum": None} for q_text in queries]
+            failed_models.append(model_name)
+
+    for model_name, future in futures.items():
+        try:
+            all_interpretations[model_name], elapsed = future.result()
+            MODEL_SEARCH_SECONDS.labels(model_name).observe(elapsed)
+            logging.info(f"[Süre] {model_name} araması: {elapsed:.3f} sn ({len(queries)} sorgu)")
+        except Exception as e:
+            logging.error(f"{model_name} araması sırasında hata: {e}")
+            all_interpretations[model_name] = [{"query": q_text, "ruya": None, "yorum": None} for q_text in queries]
+            failed_models.append(model_name)
+    return all_interpretations, failed_models
+
+def load_cross_encoder():
+    global cross_encoder
+    if not RERANK_CROSS_ENCODER:
+        return
+    started = time.perf_counter()
+    try:
+        from sentence_transformers import CrossEncoder
+        cross_encoder = CrossEncoder(RERANK_CROSS_ENCODER, device="cpu")
+        logging.info(f"Cross-encoder ({RERANK_CROSS_ENCODER}) {time.perf_counter() - started:.1f} sn'de yüklendi.")
+    except Exception as e:
+        logging.error(f"Cross-encoder yüklenemedi, yalnızca mesafe ve model uyumu kullanılacak: {e}")
+
+def cross_encoder_scores(pairs):
+    # (sorgu, rüya başlığı) çiftleri için 0-1 alaka puanları; model logit döndürüyorsa sigmoid uygulanır.
+    if cross_encoder is None or not pairs:
+        return {}
+    try:
+        with cross_encoder_lock:
+            raw_scores = cross_encoder.predict(list(pairs))
+        scores = [float(score) for score in raw_scores]
+        if any(score < 0.0 or score > 1.0 for score in scores):
+            scores = [1.0 / (1.0 + math.exp(-score)) for score in scores]
+        return dict(zip(pairs, scores))
+    except Exception as e:
+        logging.error(f"Cross-encoder puanlaması sırasında hata: {e}")
+        return {}
+
+def rerank_models(query_interpretations, model_names):
+    """Her sorgu için en uygun modeli LLM'e sormadan seçer; select_best_model ile aynı
+    {sorgu_no: model_indeksi veya -1} biçimini döner.
+
+    Aynı rüyayı bulan modeller birlikte değerlendirilir. Puan, alaka (cross-encoder varsa onun puanı,
+    yoksa destekleyen modellerin en yüksek benzerliği) ile o rüyayı bulan model oranının
+    RERANK_AGREEMENT_WEIGHT ağırlıklı ortalamasıdır. Puanı RERANK_MIN_SCORE altında kalan sorgular 'Yok' sayılır.
+    """
+    candidates_by_query = []
+    pairs = set()
+    for qi in query_interpretations:
+        candidates = {}
+        for model_idx, model_name in enumerate(model_names):
+            model_data = qi["models"].get(model_name)
+            if model_data and model_data.get('ruya') and model_data.get('yorum'):
+                key = (model_data['ruya'], model_data['yorum'])
+                candidates.setdefault(key, []).append((model_idx, model_data.get('similarity')))
+                pairs.add((qi['query'], model_data['ruya']))
+        candidates_by_query.append(candidates)
+    relevance_scores = cross_encoder_scores(sorted(pairs))
+
+    selections = {}
+    for query_number, (qi, candidates) in enumerate(zip(query_interpretations, candidates_by_query), start=1):
+        best = None
+        for (ruya, _), supporters in candidates.items():
+            similarities = [similarity for _, similarity in supporters if similarity is not None]
+            relevance = relevance_scores.get((qi['query'], ruya), max(similarities, default=0.0))
+            agreement = len(supporters) / len(model_names)
+            score = (1 - RERANK_AGREEMENT_WEIGHT) * relevance + RERANK_AGREEMENT_WEIGHT * agreement
+            model_idx = max(supporters, key=lambda item: -1.0 if item[1] is None else item[1])[0]
+            if best is None or score > best[0]:
+                best = (score, model_idx)
+        if best is None:
+            selections[query_number] = -1
+            logging.warning(f"Sorgu {query_number} için hiçbir model geçerli yorum bulamadı.")
+        elif best[0] < RERANK_MIN_SCORE:
+            selections[query_number] = -1
+            logging.info(f"Sorgu {query_number} için en iyi puan ({best[0]:.3f}) eşiğin ({RERANK_MIN_SCORE}) altında, sorgu atlanıyor.")
+        else:
+            selections[query_number] = best[1]
+            logging.info(f"Sorgu {query_number}: {model_names[best[1]]} seçildi (puan: {best[0]:.3f}).")
+    logging.info(f"Model Seçimleri (yerel, indeks bazlı, -1=yok): {selections}")
+    return selections
+
 # DEĞİŞİKLİK BURADA: original_user_query parametresi eklendi ve prompt güncellendi.
 def select_best_model(selection_chat, query_interpretations, model_names, original_user_query, delay=REQUEST_DELAY):
     if not query_interpretations:
@@ -354,10 +960,12 @@ def select_best_model(selection_chat, query_interpretations, model_names, origin
     return selections
 
 
-def generate_user_friendly_output(query, best_responses, interpretation_chat, delay=REQUEST_DELAY):
+def generate_user_friendly_output(query, best_responses, interpretation_chat, delay=REQUEST_DELAY, on_partial=None):
+    # on_partial verilirse unsur bazlı tabirler genel yorumdan önce yayınlanır, genel yorum da parça parça iletilir.
+    # (metin, genel_yorum_tam_mı) döner; genel yorum üretilemediyse ikinci değer False olur.
     if not best_responses:
         logging.info("generate_user_friendly_output: best_responses boş, uygun yorum bulunamadı mesajı üretiliyor.")
-        return "Rüyanızla ilgili maalesef uygun bir tabir bulunamadı."
+        return "Rüyanızla ilgili maalesef uygun bir tabir bulunamadı.", False
 
     output_parts = []
     yorum_gruplari = {}
@@ -378,7 +986,10 @@ def generate_user_friendly_output(query, best_responses, interpretation_chat, de
     if not yorum_gruplari:
         logging.warning("generate_user_friendly_output: Yorum grupları boş, genel yorum üretilemiyor.")
         final_output_message += "\n\n**Rüyanızın Genel Yorumu**:\nUygun tabirler bulunamadığı için genel bir yorum yapılamamaktadır."
-        return final_output_message.strip()
+        return final_output_message.strip(), False
+
+    if on_partial is not None:
+        on_partial(final_output_message)
 
     unique_yorum_texts = list(yorum_gruplari.keys())
     context_for_general_comment = "\n".join([f"- {yorum_text}" for yorum_text in unique_yorum_texts])
@@ -390,15 +1001,34 @@ Bulunan Tabirler:
 
 Rüyanın Genel Yorumu:"""
     logging.info(f"Genel yorum için LLM'e gönderilecek prompt: {general_prompt[:500]}...")
-    general_comment = generate_llm_answer(general_prompt, "", interpretation_chat, delay)
-    final_output_message += f"\n\n**Rüyanızın Genel Yorumu**:\n{general_comment}"
-    return final_output_message.strip()
+    general_heading = f"{final_output_message}\n\n**Rüyanızın Genel Yorumu**:\n"
+    on_chunk = (lambda streamed: on_partial(general_heading + streamed)) if on_partial is not None else None
+    complete = False
+    if interpretation_chat is None:
+        logging.error("LLM Chatbot başlatılamadığı için genel yorum üretilemiyor.")
+        general_comment = "Chatbot hatası nedeniyle yorum yapılamadı."
+    else:
+        try:
+            general_comment = request_llm_answer(general_prompt, "", interpretation_chat, delay, on_chunk=on_chunk)
+            complete = True
+        except LLMStreamInterrupted:
+            raise
+        except Exception as e:
+            logging.error(f"Genel yorum alınırken hata: {e}")
+            general_comment = llm_error_message(e)
+    final_output_message = general_heading + general_comment
+    return final_output_message.strip(), complete
 
 # --- get_interpretation FONKSİYONU DEĞİŞMİYOR, SADECE ARKA PLAN THREAD'İ TARAFINDAN ÇAĞRILACAK ---
 # Bu fonksiyon artık doğrudan HTTP isteğiyle tetiklenmeyecek, kuyruktan alınıp işlenecek.
-def get_interpretation_for_queue(query, interpretation_chat, rewrite_chat, chroma_collections_map, model_names_list, delay=REQUEST_DELAY):
+def get_interpretation_for_queue(query, interpretation_chat, rewrite_chat, chroma_collections_map, model_names_list, delay=REQUEST_DELAY, on_partial=None):
+    # (yorum, tam_mı) döner. Yalnızca hiçbir model araması hata vermemiş, en az bir tabir seçilmiş ve genel yorum
+    # eksiksiz alınmışsa yorum tamdır; geçici bir arka uç hatasından doğan eksik yorum önbelleğe yazılmamalıdır.
     logging.info(f"Kuyruktan rüya yorumlama isteği işleniyor: '{query}'")
+    pipeline_started = time.perf_counter()
+    stage_started = pipeline_started
     queries = generate_queries(rewrite_chat, query, delay)
+    rewrite_elapsed = time.perf_counter() - stage_started
     if not queries:
         logging.warning("Hiçbir sorgu üretilemedi. Orijinal rüya sorgu olarak kullanılıyor.")
         queries = [f"Rüyada {query}"]
@@ -407,14 +1037,25 @@ def get_interpretation_for_queue(query, interpretation_chat, rewrite_chat, chrom
         logging.info(f"  Sorgu {i+1}: {q_text}")
     logging.info("------------------------------")
 
-    all_interpretations = {}
-    for model_name in model_names_list:
-        coll = chroma_collections_map.get(model_name)
-        if coll:
-            all_interpretations[model_name] = generate_model_answer(interpretation_chat, coll, model_name, query, queries, delay=delay)
-        else:
-            logging.warning(f"{model_name} için ChromaDB koleksiyonu bulunamadı.")
-            all_interpretations[model_name] = [{"query": q_text, "ruya": None, "yorum": None} for q_text in queries]
+    stage_started = time.perf_counter()
+    lexical_hits = lexical_search(queries)
+    short_circuited = sum(1 for q in queries if is_lexical_short_circuit(lexical_hits.get(q)))
+    RETRIEVAL_QUERIES.labels("lexical").inc(short_circuited)
+    RETRIEVAL_QUERIES.labels("vector").inc(len(queries) - short_circuited)
+    if short_circuited:
+        logging.info(f"{short_circuited}/{len(queries)} sorgu başlık eşleşmesiyle vektör araması olmadan karşılandı.")
+    primary_models, reserve_models = choose_ensemble(model_names_list, chroma_collections_map)
+    reload_unloaded_models(primary_models)
+    all_interpretations, failed_models = retrieve_all_models(interpretation_chat, chroma_collections_map, primary_models, query, queries, delay, lexical_hits=lexical_hits)
+    if reserve_models and needs_escalation(all_interpretations, queries):
+        logging.info(f"Birincil modellerin ({', '.join(primary_models)}) sonuçları zayıf; yedek modeller de sorgulanıyor: {', '.join(reserve_models)}")
+        reload_unloaded_models(reserve_models)
+        reserve_interpretations, reserve_failed = retrieve_all_models(interpretation_chat, chroma_collections_map, reserve_models, query, queries, delay, lexical_hits=lexical_hits)
+        all_interpretations.update(reserve_interpretations)
+        failed_models.extend(reserve_failed)
+    # Seçim indeksleri yalnızca sorgulanan modeller üzerinden ve MODEL_CONFIG sırasıyla verilir.
+    model_names_list = [model_name for model_name in model_names_list if model_name in all_interpretations]
+    retrieval_elapsed = time.perf_counter() - stage_started
 
     query_interpretations_structured = []
     for i, q_text in enumerate(queries):
@@ -425,7 +1066,8 @@ def get_interpretation_for_queue(query, interpretation_chat, rewrite_chat, chrom
                 if model_result_for_query['query'] == q_text:
                     d["models"][model_name] = {
                         "ruya": model_result_for_query.get('ruya'),
-                        "yorum": model_result_for_query.get('yorum')
+                        "yorum": model_result_for_query.get('yorum'),
+                        "similarity": model_result_for_query.get('similarity')
                     }
                 else:
                     logging.warning(f"Sorgu eşleşme sorunu: Beklenen '{q_text}', bulunan '{model_result_for_query['query']}' ({model_name}, index {i})")
@@ -438,13 +1080,19 @@ def get_interpretation_for_queue(query, interpretation_chat, rewrite_chat, chrom
                 d["models"][model_name] = {"ruya": None, "yorum": None}
         query_interpretations_structured.append(d)
 
-    # DEĞİŞİKLİK BURADA: original_user_query parametresi select_best_model'a iletiliyor
-    selections_by_llm = select_best_model(interpretation_chat, query_interpretations_structured, model_names_list, query, delay)
+    stage_started = time.perf_counter()
+    if MODEL_SELECTION_MODE == "llm":
+        # DEĞİŞİKLİK BURADA: original_user_query parametresi select_best_model'a iletiliyor
+        selections = select_best_model(interpretation_chat, query_interpretations_structured, model_names_list, query, delay)
+    else:
+        selections = rerank_models(query_interpretations_structured, model_names_list)
+    selection_elapsed = time.perf_counter() - stage_started
+    model_stats.record(query_interpretations_structured, selections, model_names_list)
 
-    logging.info(f"--- LLM Tarafından Yapılan Model Seçimleri (Sorgu Bazlı) ---")
-    if not selections_by_llm: logging.info("  LLM tarafından herhangi bir seçim yapılmadı veya alınamadı.")
+    logging.info(f"--- Model Seçimleri (Sorgu Bazlı, mod: {MODEL_SELECTION_MODE}) ---")
+    if not selections: logging.info("  Herhangi bir seçim yapılmadı veya alınamadı.")
     else:
-        for query_idx_plus_1, model_idx in selections_by_llm.items():
+        for query_idx_plus_1, model_idx in selections.items():
             query_index = query_idx_plus_1 - 1
             if 0 <= query_index < len(query_interpretations_structured):
                 original_query_text = query_interpretations_structured[query_index]['query']
@@ -457,21 +1105,21 @@ def get_interpretation_for_queue(query, interpretation_chat, rewrite_chat, chrom
                     logging.info(f"    -> Bu modelin bulduğu rüya: '{retrieved_ruya[:100]}...'")
                 elif model_idx == -1:
                     logging.info(f"  Sorgu {query_idx_plus_1} ('{original_query_text}'):")
-                    logging.info(f"    -> LLM bu sorgu için uygun model BULAMADIĞINI belirtti.")
+                    logging.info(f"    -> Seçici bu sorgu için uygun model BULAMADIĞINI belirtti.")
                 else:
                     logging.warning(f"  Sorgu {query_idx_plus_1} ('{original_query_text}'):")
-                    logging.warning(f"    -> LLM tarafından geçersiz model indeksi ({model_idx}) döndü.")
+                    logging.warning(f"    -> Seçici geçersiz model indeksi ({model_idx}) döndürdü.")
             else: logging.warning(f"  Seçimlerde geçersiz sorgu indeksi ({query_idx_plus_1}) bulundu.")
     logging.info("---------------------------------------------------------")
 
     best_responses = {}
-    for query_index_plus_1, model_index in selections_by_llm.items():
+    for query_index_plus_1, model_index in selections.items():
         query_index = query_index_plus_1 - 1
         if query_index < 0 or query_index >= len(query_interpretations_structured):
-            logging.warning(f"Geçersiz sorgu indeksi {query_index} (selections_by_llm'den) atlandı.")
+            logging.warning(f"Geçersiz sorgu indeksi {query_index} (seçimlerden) atlandı.")
             continue
         original_query_text = query_interpretations_structured[query_index]['query']
-        if model_index != -1: # Sadece LLM'in 'Yok' demediği durumları dahil et
+        if model_index != -1: # Sadece seçicinin 'Yok' demediği durumları dahil et
             if model_index < len(model_names_list):
                 selected_model_name = model_names_list[model_index]
                 model_result = query_interpretations_structured[query_index]['models'].get(selected_model_name)
@@ -480,14 +1128,14 @@ def get_interpretation_for_queue(query, interpretation_chat, rewrite_chat, chrom
                     yorum = model_result['yorum']
                     best_responses[original_query_text] = (selected_model_name, ruya, yorum)
                 else:
-                    logging.warning(f"LLM'in seçtiği model ({selected_model_name}), '{original_query_text}' sorgusu için geçerli rüya/yorum içermiyor. Bu sorgu için alternatif aranıyor...")
+                    logging.warning(f"Seçilen model ({selected_model_name}), '{original_query_text}' sorgusu için geçerli rüya/yorum içermiyor. Bu sorgu için alternatif aranıyor...")
                     # LLM'in seçtiği model boş döndüyse burada bir fallback mantığı düşünebiliriz
                     # Örneğin, LLM'e yeniden sordurabilir veya diğer modellerden ilk geçerliyi alabiliriz.
                     # Şu anki haliyle, geçerli yorum bulamayanları best_responses'a eklemez.
             else:
-                logging.warning(f"LLM tarafından '{original_query_text}' sorgusu için geçersiz model indeksi ({model_index}) döndü. Bu sorgu atlanıyor.")
+                logging.warning(f"Seçici '{original_query_text}' sorgusu için geçersiz model indeksi ({model_index}) döndürdü. Bu sorgu atlanıyor.")
         else:
-            logging.info(f"LLM, '{original_query_text}' sorgusu için uygun bir model bulunmadığını belirtti. Bu sorgu için yorum üretilmeyecek.")
+            logging.info(f"Seçici, '{original_query_text}' sorgusu için uygun bir model bulunmadığını belirtti. Bu sorgu için yorum üretilmeyecek.")
 
 
     logging.info(f"--- Yorum Üretiminde Kullanılacak Nihai Seçimler ({len(best_responses)} adet) ---")
@@ -499,14 +1147,260 @@ def get_interpretation_for_queue(query, interpretation_chat, rewrite_chat, chrom
             query_counter += 1
     logging.info("-----------------------------------------------------------------")
 
-    final_output = generate_user_friendly_output(query, best_responses, interpretation_chat, delay)
+    stage_started = time.perf_counter()
+    final_output, output_complete = generate_user_friendly_output(query, best_responses, interpretation_chat, delay, on_partial=on_partial)
+    complete = output_complete and bool(best_responses) and not failed_models
+    if not complete:
+        logging.warning(
+            f"Yorum eksik (aranamayan modeller: {failed_models or 'yok'}, seçilen tabir: {len(best_responses)}, "
+            f"genel yorum tam: {output_complete}); önbelleğe yazılmayacak."
+        )
+    output_elapsed = time.perf_counter() - stage_started
+    total_elapsed = time.perf_counter() - pipeline_started
+    for stage, elapsed in (("rewrite", rewrite_elapsed), ("retrieval", retrieval_elapsed), ("selection", selection_elapsed), ("output", output_elapsed), ("total", total_elapsed)):
+        STAGE_SECONDS.labels(stage).observe(elapsed)
     logging.info(f"Yorumlama tamamlandı. Sonuç uzunluğu: {len(final_output)}")
-    return final_output
+    logging.info(
+        f"[Süre] Sorgu üretimi: {rewrite_elapsed:.3f} sn, Arama: {retrieval_elapsed:.3f} sn, "
+        f"Model seçimi: {selection_elapsed:.3f} sn, Genel yorum: {output_elapsed:.3f} sn, "
+        f"Toplam: {total_elapsed:.3f} sn"
+    )
+    return final_output, complete
+
+
+# --- Model Seçim İstatistikleri ---
+class ModelSelectionStats:
+    """Her embedding modelinin kaç sorguda sonuç döndürdüğünü ve kaçında seçildiğini tutar.
+
+    Seçilen rüyayı bulan tüm modeller kazanmış sayılır. Sayaçlar path verilmişse JSON olarak
+    saklanır; böylece sunucu yeniden başladığında kazanma oranları kaybolmaz.
+    """
+
+    def __init__(self, path=None, save_interval=60.0):
+        self.path = path
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        self._stats = {}
+        self.selections = 0
+        self._last_saved = time.monotonic()
+        if path and os.path.exists(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    data = json.load(f)
+                self._stats = {name: {"queries": int(v.get("queries", 0)), "wins": int(v.get("wins", 0))} for name, v in data.get("models", {}).items()}
+                self.selections = int(data.get("selections", 0))
+            except (OSError, ValueError, AttributeError) as e:
+                logging.warning(f"Model seçim istatistikleri okunamadı ({path}), sıfırdan başlanıyor: {e}")
+
+    def record(self, query_interpretations, selections, model_names):
+        with self._lock:
+            for query_number, qi in enumerate(query_interpretations, start=1):
+                model_idx = selections.get(query_number, -1)
+                chosen = qi["models"].get(model_names[model_idx]) if 0 <= model_idx < len(model_names) else None
+                for model_name in model_names:
+                    model_data = qi["models"].get(model_name)
+                    if not (model_data and model_data.get('ruya')):
+                        continue
+                    entry = self._stats.setdefault(model_name, {"queries": 0, "wins": 0})
+                    entry["queries"] += 1
+                    if chosen and model_data.get('ruya') == chosen.get('ruya'):
+                        entry["wins"] += 1
+                if chosen:
+                    self.selections += 1
+            should_save = self.path and time.monotonic() - self._last_saved >= self.save_interval
+        if should_save:
+            self.save()
+
+    def win_rate(self, model_name):
+        with self._lock:
+            entry = self._stats.get(model_name)
+            return entry["wins"] / entry["queries"] if entry and entry["queries"] else 0.0
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "selections": self.selections,
+                "models": {
+                    name: dict(entry, win_rate=round(entry["wins"] / entry["queries"], 4) if entry["queries"] else 0.0)
+                    for name, entry in self._stats.items()
+                }
+            }
+
+    def save(self):
+        if not self.path:
+            return
+        data = self.snapshot()
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+            with self._lock:
+                self._last_saved = time.monotonic()
+        except OSError as e:
+            logging.error(f"Model seçim istatistikleri kaydedilemedi: {e}")
+
+def choose_ensemble(model_names, chroma_collections_map):
+    """Bu rüyada sorgulanacak modelleri (birincil, yedek) olarak döner.
+
+    ENSEMBLE_MODE=adaptive iken yeterli seçim birikmişse yalnızca kazanma oranı en yüksek
+    ENSEMBLE_TOP_K model birincildir; istatistiklerin güncel kalması için isteklerin
+    ENSEMBLE_EXPLORE_RATE kadarında yüklü tüm modeller sorgulanır. Boşaltılmış modeller de sıralamaya
+    girer; seçildiklerinde reload_unloaded_models ile yeniden yüklenirler.
+    """
+    if ENSEMBLE_MODE != "adaptive":
+        return list(model_names), []
+    loaded = [name for name in model_names if chroma_collections_map.get(name) is not None]
+    if model_stats.selections < ENSEMBLE_MIN_SELECTIONS or random.random() < ENSEMBLE_EXPLORE_RATE:
+        return loaded, []
+    with status_lock:
+        unloaded = [name for name in model_names if component_status["models"].get(name) == "unloaded"]
+    ranked = sorted(loaded + unloaded, key=model_stats.win_rate, reverse=True)
+    return ranked[:ENSEMBLE_TOP_K], ranked[ENSEMBLE_TOP_K:]
+
+def needs_escalation(all_interpretations, queries):
+    # Herhangi bir sorguda birincil modellerin en iyi benzerliği zayıfsa yedek modeller de sorgulanır.
+    for i in range(len(queries)):
+        best = max(
+            ((results[i].get('similarity') or 0.0) for results in all_interpretations.values() if i < len(results) and results[i].get('ruya')),
+            default=0.0
+        )
+        if best < ENSEMBLE_WEAK_SIMILARITY:
+            return True
+    return False
+
+def unload_idle_models():
+    # Birincil küme dışında kalıp ENSEMBLE_UNLOAD_AFTER sn boyunca sorgulanmayan modeller bellekten boşaltılır.
+    if ENSEMBLE_MODE != "adaptive" or ENSEMBLE_UNLOAD_AFTER <= 0 or model_stats.selections < ENSEMBLE_MIN_SELECTIONS:
+        return
+    with model_resources_lock:
+        loaded = [name for name in model_names_global if chroma_collections.get(name) is not None]
+        last_used = {name: model_last_used.get(name) for name in loaded}
+    keep = set(sorted(loaded, key=model_stats.win_rate, reverse=True)[:ENSEMBLE_TOP_K])
+    now = time.monotonic()
+    for model_name in loaded:
+        if model_name in keep or now - (last_used[model_name] or now) < ENSEMBLE_UNLOAD_AFTER:
+            continue
+        with model_load_locks[model_name]:
+            with model_resources_lock:
+                if chroma_collections.get(model_name) is None:
+                    continue # Başka bir işçi az önce boşalttı.
+                chroma_collections[model_name] = None
+                embedder = query_embedders.pop(model_name, None)
+            set_model_status(model_name, "unloaded")
+            if embedder is not None:
+                # Bekleyen sorgular bitince model ve Chroma'nın önbelleğindeki kopyası bırakılır.
+                embedder.close()
+                release = getattr(embedder.embedding_function, "release", None)
+                if release is not None:
+                    release()
+        logging.info(f"{model_name} modeli {ENSEMBLE_UNLOAD_AFTER:.0f} sn'dir kullanılmadığı için bellekten boşaltıldı (kazanma oranı: {model_stats.win_rate(model_name):.3f}).")
+
+
+def reload_unloaded_models(model_names):
+    # Boşaltılmış bir model birincil kümeye girdiğinde ya da yedeklere başvurulduğunda yeniden yüklenir.
+    for model_name in model_names:
+        with status_lock:
+            status = component_status["models"].get(model_name)
+        if status not in ("unloaded", "loading"):
+            continue
+        # Başka bir işçi aynı modeli yüklüyorsa bitmesi beklenir.
+        with model_load_locks[model_name]:
+            with status_lock:
+                status = component_status["models"].get(model_name)
+            if status != "unloaded":
+                continue
+            logging.info(f"{model_name} modeli yeniden sorgulanacağı için tekrar yükleniyor.")
+            load_model_resources(model_name, MODEL_CONFIG[model_name])
+            with model_resources_lock:
+                model_last_used[model_name] = time.monotonic()
+
+# --- Yorum Önbelleği ---
+def dream_cache_key(text):
+    return hashlib.sha256(normalize_dream_text(text).encode("utf-8")).hexdigest()
+
+class InterpretationCache:
+    """Normalize edilmiş rüya metninin özetiyle anahtarlanan, diskte (SQLite) tutulan yorum önbelleği.
+
+    Kayıtlar ttl saniye sonra geçersiz olur; kayıt sayısı max_entries'i aşarsa en uzun süredir
+    kullanılmayanlar silinir.
+    """
+
+    def __init__(self, path, ttl=30 * 24 * 3600, max_entries=10000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS interpretations ("
+            " key TEXT PRIMARY KEY, dream TEXT NOT NULL, interpretation TEXT NOT NULL,"
+            " created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_interpretations_last_access ON interpretations(last_access)")
+        self._conn.commit()
+
+    def get(self, dream_text):
+        key = dream_cache_key(dream_text)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT interpretation, created_at FROM interpretations WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (self.ttl > 0 and now - row[1] > self.ttl):
+                if row is not None:
+                    self._conn.execute("DELETE FROM interpretations WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE interpretations SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, dream_text, interpretation):
+        key = dream_cache_key(dream_text)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO interpretations (key, dream, interpretation, created_at, last_access)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, dream_text, interpretation, now, now)
+            )
+            if self.ttl > 0:
+                self._conn.execute("DELETE FROM interpretations WHERE created_at < ?", (now - self.ttl,))
+            if self.max_entries > 0:
+                self._conn.execute(
+                    "DELETE FROM interpretations WHERE key IN ("
+                    " SELECT key FROM interpretations ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM interpretations").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "size": size,
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
 
 
 # --- Global Değişkenler ve Başlatma ---
-app = Flask(__name__)
-CORS(app) # CORS'u tüm route'lar için etkinleştir
+# Uç noktalar bu blueprint'e tanımlanır; Flask uygulaması create_app() ile oluşturulur.
+api = Blueprint('api', __name__)
 
 API_KEYS = [key for key in [
     os.environ.get('GOOGLE_API_KEY_1'),
@@ -514,115 +1408,516 @@ API_KEYS = [key for key in [
     os.environ.get('GOOGLE_API_KEY_3'),
     os.environ.get('GOOGLE_API_KEY_4')
 ] if key]
-if not API_KEYS:
-    raise ValueError("Hiçbir Google API Anahtarı bulunamadı. Lütfen GOOGLE_API_KEY_x çevre değişkenlerini ayarlayın.")
-logging.info(f"{len(API_KEYS)} adet Google API anahtarı yüklendi.")
 
-chroma_collections = {}
-user_chats = [] # Bu artık chatbotları tutacak
+# API anahtarı başına dakikalık istek sınırı; aynı anahtarı kullanan tüm işçiler aynı bucket'ı paylaşır
+LLM_RPM_PER_KEY = float(os.getenv('LLM_RPM_PER_KEY', '15'))
+LLM_BURST_PER_KEY = int(os.getenv('LLM_BURST_PER_KEY', '5'))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '3'))
+rate_limiters = [TokenBucket(LLM_RPM_PER_KEY, capacity=LLM_BURST_PER_KEY) for _ in API_KEYS]
+# Her LLM çağrısı o an en uygun anahtara gider; art arda LLM_BREAKER_FAILURES hata veren anahtar devre dışı kalır
+LLM_BREAKER_FAILURES = int(os.getenv('LLM_BREAKER_FAILURES', '3'))
+LLM_BREAKER_COOLDOWN = float(os.getenv('LLM_BREAKER_COOLDOWN', '30')) # İlk yoklamaya kadar bekleme (sn); her başarısız yoklamada ikiye katlanır
+LLM_BREAKER_MAX_COOLDOWN = float(os.getenv('LLM_BREAKER_MAX_COOLDOWN', '600'))
+LLM_HEALTH_WINDOW = float(os.getenv('LLM_HEALTH_WINDOW', '60')) # Hata oranının hesaplandığı pencere (sn)
+LLM_PROBE_INTERVAL = float(os.getenv('LLM_PROBE_INTERVAL', '5')) # Yoklama zamanı gelen anahtarların kontrol aralığı (sn)
+llm_scheduler = ApiKeyScheduler(
+    API_KEYS, rate_limiters, failure_threshold=LLM_BREAKER_FAILURES, cooldown=LLM_BREAKER_COOLDOWN,
+    max_cooldown=LLM_BREAKER_MAX_COOLDOWN, window=LLM_HEALTH_WINDOW
+)
+# Tüm işçilerin paylaştığı, anahtar seçimini çağrı başına yapan chat nesneleri
+llm_chats = {
+    "interpretation_chat": ScheduledChat(llm_scheduler, "interpretation", max_retries=LLM_MAX_RETRIES),
+    "rewrite_chat": ScheduledChat(llm_scheduler, "rewrite", max_retries=LLM_MAX_RETRIES)
+}
+
+chroma_collections = {} # Model adı -> arama arka ucu (Chroma koleksiyonu veya NumpyIndex)
+# "chroma": sorgular Chroma üzerinden; "numpy": Chroma koleksiyonundan aktarılan bellek eşlemeli gömülü indeks üzerinden
+RETRIEVAL_BACKEND = os.getenv('RETRIEVAL_BACKEND', 'chroma').lower()
+NUMPY_INDEX_DTYPE = os.getenv('NUMPY_INDEX_DTYPE', 'float16')
+# Model başına aramaları eşzamanlı çalıştıran ortak havuz (tüm işçiler paylaşır)
+# "hybrid": BM25 başlık araması + vektör araması (RRF ile birleştirilir); "dense": yalnızca vektör araması
+RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'hybrid').lower()
+LEXICAL_SHORT_CIRCUIT_MATCH = float(os.getenv('LEXICAL_SHORT_CIRCUIT_MATCH', '0.9')) # 1'den büyük değer kısa devreyi kapatır
+LEXICAL_FUSION_WEIGHT = float(os.getenv('LEXICAL_FUSION_WEIGHT', '1.0'))
+HYBRID_RRF_K = int(os.getenv('HYBRID_RRF_K', '60'))
+lexical_index = None # Tüm modellerin paylaştığı 'Rüya' başlığı BM25 indeksi
+# "auto": kısa rüyalarda yerel sözlük, diğerlerinde LLM (başarısız/yavaşsa yerel sözlük); "llm": her zaman önce LLM; "local": LLM hiç kullanılmaz
+QUERY_REWRITE_MODE = os.getenv('QUERY_REWRITE_MODE', 'auto').lower()
+LOCAL_REWRITE_MAX_WORDS = int(os.getenv('LOCAL_REWRITE_MAX_WORDS', '8')) # "auto" modunda yerel sözlüğün birincil olduğu en fazla kelime sayısı
+LOCAL_REWRITE_MAX_QUERIES = int(os.getenv('LOCAL_REWRITE_MAX_QUERIES', '6'))
+QUERY_REWRITE_TIMEOUT = float(os.getenv('QUERY_REWRITE_TIMEOUT', '15')) # sn; 0 = sınırsız
+QUERY_REWRITE_CACHE_SIZE = int(os.getenv('QUERY_REWRITE_CACHE_SIZE', '5000'))
+rewrite_cache = LRUCache("rewrite", capacity=QUERY_REWRITE_CACHE_SIZE) # Normalize rüya metni -> LLM'in ürettiği sorgular
+rewrite_executor = concurrent.futures.ThreadPoolExecutor(max_workers=int(os.getenv('QUERY_REWRITE_THREADS', '8')), thread_name_prefix="rewrite")
+# "local": model seçimi mesafe, model uyumu ve (varsa) cross-encoder ile yerelde; "llm": eski Gemini seçicisi
+MODEL_SELECTION_MODE = os.getenv('MODEL_SELECTION_MODE', 'local').lower()
+RERANK_MIN_SCORE = float(os.getenv('RERANK_MIN_SCORE', '0.3')) # Bu puanın altındaki sorgular yorumlamaya alınmaz
+RERANK_AGREEMENT_WEIGHT = float(os.getenv('RERANK_AGREEMENT_WEIGHT', '0.3'))
+RERANK_CROSS_ENCODER = os.getenv('RERANK_CROSS_ENCODER', '') # Örn. "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"; boş = kapalı
+cross_encoder = None
+cross_encoder_lock = threading.Lock()
+# "adaptive": kazanma oranı en yüksek ENSEMBLE_TOP_K model sorgulanır, sonuç zayıfsa diğerlerine başvurulur; "all": her rüyada tüm modeller
+ENSEMBLE_MODE = os.getenv('ENSEMBLE_MODE', 'adaptive').lower()
+ENSEMBLE_TOP_K = int(os.getenv('ENSEMBLE_TOP_K', '2'))
+ENSEMBLE_MIN_SELECTIONS = int(os.getenv('ENSEMBLE_MIN_SELECTIONS', '200')) # Bu kadar seçim birikene dek tüm modeller sorgulanır
+ENSEMBLE_WEAK_SIMILARITY = float(os.getenv('ENSEMBLE_WEAK_SIMILARITY', '0.5'))
+ENSEMBLE_EXPLORE_RATE = float(os.getenv('ENSEMBLE_EXPLORE_RATE', '0.05'))
+ENSEMBLE_UNLOAD_AFTER = float(os.getenv('ENSEMBLE_UNLOAD_AFTER', '1800')) # sn; 0 = modeller boşaltılmaz
+ENSEMBLE_UNLOAD_CHECK_INTERVAL = float(os.getenv('ENSEMBLE_UNLOAD_CHECK_INTERVAL', '60')) # sn
+MODEL_STATS_PATH = os.getenv('MODEL_STATS_PATH', './cache/model_stats.json')
+model_stats = ModelSelectionStats(MODEL_STATS_PATH or None)
+model_last_used = {} # Model adı -> son sorgulanma zamanı (monotonic)
+RETRIEVAL_THREADS = int(os.getenv('RETRIEVAL_THREADS', str(len(MODEL_CONFIG) * 2)))
+retrieval_executor = concurrent.futures.ThreadPoolExecutor(max_workers=RETRIEVAL_THREADS, thread_name_prefix="retrieval")
+# Sorgu embedding önbelleği ve model başına toplu embedding katmanı
+EMBEDDING_CACHE_SIZE = int(os.getenv('EMBEDDING_CACHE_SIZE', '10000'))
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv('EMBEDDING_BATCH_WINDOW_MS', '5'))
+embedding_cache = EmbeddingCache(capacity=EMBEDDING_CACHE_SIZE)
+query_embedders = {}
+model_resources_lock = threading.Lock() # chroma_collections ve query_embedders girdileri birlikte değişir
+model_load_locks = {model_key: threading.Lock() for model_key in MODEL_CONFIG} # Aynı model iki kez yüklenmez/boşaltılmaz
 model_names_global = list(MODEL_CONFIG.keys()) # Embedding modellerinin isimleri
-user_id_counter = 0 # Chatbot rotasyonu için
-user_id_lock = threading.Lock()
+
+# Paralel işçi sayısı; 0 = her API anahtarı için bir işçi
+DREAM_WORKER_COUNT = int(os.getenv('DREAM_WORKER_COUNT', '0'))
+processing_threads = []
 
 # Rüya işleme kuyruğu ve işlenmiş sonuçlar için
-dream_queue = collections.deque()
-processed_interpretations = {} # { "orijinal_ruya_metni": "yorum_sonucu" }
-queue_lock = threading.Lock()
-processed_lock = threading.Lock()
-stop_event = threading.Event() # Arka plan thread'ini durdurmak için
+DREAM_QUEUE_MAXSIZE = int(os.getenv('DREAM_QUEUE_MAXSIZE', '100')) # 0 = sınırsız
+DREAM_QUEUE_RETRY_AFTER = int(os.getenv('DREAM_QUEUE_RETRY_AFTER', '30')) # Kuyruk doluyken istemciye önerilen bekleme (sn)
+# İstemcinin gönderebileceği 'oncelik' aralığı; küçük değer önce işlenir, aralık dışı değerler sınıra çekilir
+DREAM_PRIORITY_MIN = int(os.getenv('DREAM_PRIORITY_MIN', '0'))
+DREAM_PRIORITY_MAX = int(os.getenv('DREAM_PRIORITY_MAX', '9'))
+# /check_interpretations isteğinde kabul edilen en fazla job_id sayısı
+CHECK_INTERPRETATIONS_MAX_IDS = int(os.getenv('CHECK_INTERPRETATIONS_MAX_IDS', '50'))
+# İş durumları; biten işlerin sonuçları JOB_RESULT_TTL saniye boyunca /jobs/<id> üzerinden alınabilir
+JOB_RESULT_TTL = int(os.getenv('JOB_RESULT_TTL', '3600'))
+# İş deposu ve kuyruk: "memory" (tek süreç), "sqlite:///./cache/jobs.sqlite3" veya "redis://host:6379/0"
+JOB_STORE_URL = os.getenv('JOB_STORE_URL', 'memory')
+JOB_STORE_POLL_INTERVAL = float(os.getenv('JOB_STORE_POLL_INTERVAL', '0.2')) # Paylaşılan depoda bekleme yoklama aralığı (sn)
+job_store, dream_queue = open_job_backend( # Kuyruk iş kimliklerini taşır
+    JOB_STORE_URL, result_ttl=JOB_RESULT_TTL, maxsize=DREAM_QUEUE_MAXSIZE, poll_interval=JOB_STORE_POLL_INTERVAL
+)
+# Paylaşılan depoda işçi süreci çökerse işleri sahipsiz kalmasın diye çalışan işlerin kirası JOB_HEARTBEAT_INTERVAL
+# saniyede bir yenilenir; JOB_LEASE_TIMEOUT saniye yenilenmeyen iş yeniden kuyruğa alınır, JOB_MAX_ATTEMPTS
+# kez başlatılmış iş ise başarısız sayılır.
+JOB_LEASE_TIMEOUT = float(os.getenv('JOB_LEASE_TIMEOUT', '120'))
+JOB_HEARTBEAT_INTERVAL = float(os.getenv('JOB_HEARTBEAT_INTERVAL', '15'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+JOB_FAILED_MESSAGE = "Rüyanız işlenirken bir hata oluştu. Lütfen daha sonra tekrar deneyin."
+# Akan genel yorum iş deposuna en fazla bu aralıkla (ms) yazılır; her parçada yazmak paylaşılan depoyu kilitler.
+JOB_PARTIAL_PUBLISH_INTERVAL = float(os.getenv('JOB_PARTIAL_PUBLISH_INTERVAL_MS', '250')) / 1000.0
+leased_jobs = set() # Bu süreçteki işçilerin o anda çalıştırdığı iş kimlikleri
+leased_jobs_lock = threading.Lock()
+# "all": HTTP sunucusu ve işçiler aynı süreçte; "api": yalnızca HTTP (modeller yüklenmez);
+# "worker": yalnızca işçiler (python app.py --role worker). api/worker paylaşılan bir JOB_STORE_URL gerektirir.
+PROCESS_ROLE = os.getenv('PROCESS_ROLE', 'all').lower()
+JOB_LONG_POLL_MAX_WAIT = float(os.getenv('JOB_LONG_POLL_MAX_WAIT', '60')) # /jobs/<id>?wait= için üst sınır (sn)
+SSE_HEARTBEAT_SECONDS = float(os.getenv('SSE_HEARTBEAT_SECONDS', '15'))
+# Tamamlanmış yorumların kalıcı önbelleği; INTERPRETATION_CACHE_PATH boş bırakılırsa kapalıdır
+INTERPRETATION_CACHE_PATH = os.getenv('INTERPRETATION_CACHE_PATH', './cache/interpretations.sqlite3')
+INTERPRETATION_CACHE_TTL = int(os.getenv('INTERPRETATION_CACHE_TTL', str(30 * 24 * 3600)))
+INTERPRETATION_CACHE_MAX_ENTRIES = int(os.getenv('INTERPRETATION_CACHE_MAX_ENTRIES', '10000'))
+interpretation_cache = None # create_app() içinde açılır
+# Prometheus metrikleri (/metrics)
+metrics_registry = metrics.Registry()
+STAGE_SECONDS = metrics_registry.histogram("ruya_stage_duration_seconds", "Rüya yorumlama aşamalarının süresi.", ["stage"])
+MODEL_SEARCH_SECONDS = metrics_registry.histogram("ruya_model_search_duration_seconds", "Embedding modeli başına arama süresi.", ["model"])
+LLM_REQUEST_SECONDS = metrics_registry.histogram("ruya_llm_request_duration_seconds", "Başarılı Gemini çağrılarının süresi (akışta ilk yanıta kadar).", ["api_key", "chat"])
+LLM_ERRORS = metrics_registry.counter("ruya_llm_errors_total", "Gemini çağrı hataları (rate_limit = 429/kota).", ["api_key", "chat", "kind"])
+QUEUE_WAIT_SECONDS = metrics_registry.histogram("ruya_queue_wait_seconds", "İşin kuyrukta işçiye alınana kadar beklediği süre.", buckets=metrics.DEFAULT_BUCKETS + (120.0, 300.0, 600.0))
+JOBS_TOTAL = metrics_registry.counter("ruya_jobs_total", "Gönderilen rüyaların sonuçları.", ["outcome"])
+REWRITE_PATHS = metrics_registry.counter("ruya_query_rewrite_total", "Sorguların nasıl üretildiği (cache, local, llm, local_fallback, original).", ["path"])
+RETRIEVAL_QUERIES = metrics_registry.counter("ruya_retrieval_queries_total", "Arama sorguları (lexical = başlık eşleşmesiyle vektör araması atlandı).", ["path"])
+WORKERS_BUSY = metrics_registry.gauge("ruya_workers_busy", "O anda rüya işleyen işçi sayısı.")
+WORKERS_BUSY.set(0)
+WORKER_BUSY_SECONDS = metrics_registry.counter("ruya_worker_busy_seconds_total", "İşçilerin rüya işleyerek geçirdiği toplam süre.", ["worker"])
+metrics_registry.gauge("ruya_workers", "Çalışan işçi thread sayısı.", callback=lambda: len([t for t in processing_threads if t.is_alive()]))
+metrics_registry.gauge("ruya_llm_key_in_flight", "API anahtarı başına süren Gemini çağrısı.", ["api_key"], callback=lambda: {(key["api_key"],): key["in_flight"] for key in llm_scheduler.snapshot()})
+metrics_registry.gauge("ruya_llm_key_available", "API anahtarının kullanımda olup olmadığı (1) veya devre kesicisinin açık olduğu (0).", ["api_key"], callback=lambda: {(key["api_key"],): 1 if key["state"] == KEY_CLOSED else 0 for key in llm_scheduler.snapshot()})
+metrics_registry.gauge("ruya_queue_size", "Kuyrukta bekleyen iş sayısı.", callback=lambda: len(dream_queue))
+metrics_registry.gauge("ruya_jobs", "Durumlarına göre takip edilen işler.", ["status"], callback=lambda: {(status,): count for status, count in job_store.counts().items()})
+metrics_registry.counter(
+    "ruya_cache_lookups_total", "Önbellek isabet/ıskalama sayıları.", ["cache", "result"],
+    callback=lambda: {
+        (name, result): stats[result]
+        for name, stats in (
+            (embedding_cache.name, embedding_cache.stats()), (rewrite_cache.name, rewrite_cache.stats()),
+            ("interpretation", interpretation_cache.stats() if interpretation_cache is not None else None)
+        )
+        if stats is not None
+        for result in ("hits", "misses")
+    }
+)
+
+stop_event = threading.Event() # Arka plan işçilerini durdurmak için
+
+# Bileşenlerin hazır olma durumu (/health): "pending", "loading", "ready" veya "failed"
+WARMUP_THREADS = int(os.getenv('WARMUP_THREADS', '2')) # Aynı anda yüklenecek embedding modeli sayısı
+component_status = {"chatbots": "pending", "lexical": "pending", "models": {model_key: "pending" for model_key in MODEL_CONFIG}}
+status_lock = threading.Lock()
+models_ready = threading.Event() # Tüm modellerin yüklenmesi denendiğinde set edilir
+background_started = False
+
+def set_model_status(model_key, status):
+    with status_lock:
+        component_status["models"][model_key] = status
+
+def load_model_resources(model_key, config):
+    set_model_status(model_key, "loading")
+    chroma_db_path_for_model = collection_db_path(config)
+    os.makedirs(chroma_db_path_for_model, exist_ok=True)
+    started = time.perf_counter()
+    try:
+        # EMBEDDING_BACKEND'e göre FP32 PyTorch, int8 veya ONNX Runtime modeli yüklenir.
+        embedding_function = load_embedding_function(config)
+        if os.path.exists(EXCEL_FILE_PATH):
+            # Excel değişmediyse manifest kontrolüyle hemen döner; değiştiyse yalnızca farklar işlenir.
+            _, collection = load_excel_to_chromadb(
+                config['collection_name'], config['model_name'], chroma_db_path_for_model, EXCEL_FILE_PATH,
+                embedding_function=embedding_function, collection_metadata=hnsw_metadata(config)
+            )
+        else:
+            _, collection = load_existing_chromadb(
+                config['collection_name'], config['model_name'], chroma_db_path_for_model,
+                embedding_function=embedding_function, collection_metadata=hnsw_metadata(config)
+            )
+        if RETRIEVAL_BACKEND == "numpy":
+            collection = load_numpy_index(config, collection, embedding_function, dtype=NUMPY_INDEX_DTYPE)
+        embedder = QueryEmbedder(
+            model_key, embedding_function, embedding_cache,
+            batch_window=EMBEDDING_BATCH_WINDOW_MS / 1000.0
+        )
+        with model_resources_lock:
+            query_embedders[model_key] = embedder
+            chroma_collections[model_key] = collection
+        set_model_status(model_key, "ready")
+        logging.info(f"{model_key} modeli ve koleksiyonu {time.perf_counter() - started:.1f} sn'de hazırlandı.")
+    except Exception as e:
+        logging.error(f"{model_key} için ChromaDB yüklenirken/oluşturulurken hata: {e}")
+        with model_resources_lock:
+            chroma_collections[model_key] = None
+        set_model_status(model_key, "failed")
+
+def load_lexical_index():
+    global lexical_index
+    # Sözlük hem hibrit arama hem de yerel sorgu üretimi için kullanılır.
+    if RETRIEVAL_MODE != "hybrid" and QUERY_REWRITE_MODE == "llm":
+        with status_lock:
+            component_status["lexical"] = "disabled"
+        return
+    with status_lock:
+        component_status["lexical"] = "loading"
+    started = time.perf_counter()
+    try:
+        if os.path.exists(EXCEL_FILE_PATH):
+            index = LexicalIndex.from_excel(EXCEL_FILE_PATH)
+        else:
+            collection = next((c for c in chroma_collections.values() if c is not None and hasattr(c, 'get')), None)
+            if collection is None:
+                raise RuntimeError("Sözcüksel indeks için ne Excel dosyası ne de Chroma koleksiyonu mevcut.")
+            index = LexicalIndex.from_collection(collection)
+        lexical_index = index
+        with status_lock:
+            component_status["lexical"] = "ready"
+        logging.info(f"Sözcüksel indeks {len(index)} başlıkla {time.perf_counter() - started:.1f} sn'de hazırlandı.")
+    except Exception as e:
+        logging.error(f"Sözcüksel indeks oluşturulamadı, yalnızca vektör araması kullanılacak: {e}")
+        with status_lock:
+            component_status["lexical"] = "failed"
+
+CHAT_SYSTEM_PROMPTS = {
+    "interpretation": """Sen bir İslami rüya tabiri uzmanısın. Sana verilen rüya ve ilgili bulunan tabirlere dayanarak rüyanın genel bir yorumunu yapacaksın. Yalnızca sağlanan tabir bilgilerini kullan, dışarıdan bilgi ekleme. Eğer bir unsur için yorum yoksa veya tabirler çelişkili ise bunu belirt. Yanıtlarını Türkçe, doğal, akıcı ve saygılı bir üslupla ver.""",
+    "rewrite": """Sen bir yardımcı asistansın. Görevin, kullanıcının verdiği rüya metnini analiz ederek, rüyada görülen ana unsurları belirlemek ve bu unsurlar için sorgular üretmektir. Her bir unsur için, 'Rüyada [Nesne/Varlık] [Eylem]' formatında birden fazla doğal sorgu oluşturmalısın. Ayrıca, bu sorguların tanımlayıcı özellikler içeren KULLANICININ RÜYASINA UYGUN varyantlarını da üretmelisin. Yanıtlarını sadece sorgular listesi olarak, her satıra bir sorgu gelecek şekilde ver. Açıklama yapma, sadece sorguları üret."""
+}
+LLM_PROBE_PROMPT = "Rüyada su görmek" # Devre dışı kalan anahtarı yoklamak için gönderilen kısa istek
+
+def build_api_key_chats(key):
+    # Anahtarın eksik chatbotlarını oluşturur; hepsi hazırsa True döner. Yeniden deneme ScheduledChat'te
+    # başka anahtarla yapılır.
+    for kind, system_prompt in CHAT_SYSTEM_PROMPTS.items():
+        if kind in key.chats:
+            continue
+        chatbot = build_chatbot(system_prompt, key.api_key)
+        if chatbot is None:
+            return False
+        key.chats[kind] = RateLimitedChat(chatbot, key.limiter, api_key_label=key.label, chat_kind=kind)
+    return True
+
+def build_llm_clients():
+    with status_lock:
+        component_status["chatbots"] = "loading"
+    for key in llm_scheduler.keys:
+        logging.info(f"API anahtarı {key.label} için chatbotlar oluşturuluyor...")
+        if build_api_key_chats(key):
+            logging.info(f"API anahtarı {key.label} için chatbotlar başarıyla oluşturuldu.")
+        else:
+            logging.error(f"API anahtarı {key.label} için chatbotlar oluşturulamadı; anahtar arka planda yeniden denenecek.")
+            llm_scheduler.mark_unavailable(key, "Chatbot oluşturulamadı")
+    with status_lock:
+        component_status["chatbots"] = "ready" if llm_scheduler.available_count() else "failed"
+    threading.Thread(target=monitor_api_keys, name="api-key-monitor", daemon=True).start()
+    if not llm_scheduler.available_count():
+        logging.error("Hiçbir kullanılabilir chatbot oluşturulamadı; rüyalar bir anahtar yoklamayı geçene kadar kuyrukta bekleyecek.")
+
+def probe_api_key(key):
+    # Eksik chatbotları oluşturup kısa bir istekle anahtarın yeniden çalışıp çalışmadığını dener.
+    if not build_api_key_chats(key):
+        return False, "Chatbot oluşturulamadı"
+    try:
+        key.chats["rewrite"].send_message(LLM_PROBE_PROMPT)
+        return True, None
+    except Exception as e:
+        return False, e
+
+def monitor_api_keys():
+    # Devre kesicisi açık anahtarlar bekleme süreleri dolunca arka planda yoklanır ve geçerlerse geri alınır.
+    while not stop_event.wait(LLM_PROBE_INTERVAL):
+        for key in llm_scheduler.due_for_probe():
+            ok, error = probe_api_key(key)
+            llm_scheduler.probe_result(key, ok, error)
 
 def initialize_resources():
-    global chroma_collections, user_chats
+    # Arka planda çalışır: önce chatbotlar ve işçiler hazırlanır (kuyruk hemen kabul etmeye başlar),
+    # ardından embedding modelleri ve koleksiyonlar WARMUP_THREADS kadar paralel yüklenir.
     logging.info("Kaynaklar başlatılıyor...")
+    os.makedirs(CHROMA_DB_BASE_PATH, exist_ok=True)
     if not os.path.exists(EXCEL_FILE_PATH):
          logging.error(f"Excel dosyası bulunamadı: {EXCEL_FILE_PATH}. Yükleme yapılamaz.")
+    try:
+        build_llm_clients()
+        start_workers()
+    except Exception as e:
+        logging.error(f"Chatbotlar başlatılamadı: {e}")
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, WARMUP_THREADS), thread_name_prefix="warmup") as executor:
+        list(executor.map(lambda item: load_model_resources(*item), MODEL_CONFIG.items()))
+    load_lexical_index()
+    if MODEL_SELECTION_MODE == "local":
+        load_cross_encoder()
+    models_ready.set()
+    logging.info("Kaynakların başlatılması tamamlandı.")
+
+def readiness():
+    if PROCESS_ROLE == "api":
+        # Modeller ve chatbotlar ayrı işçi süreçlerinde yüklenir; bu süreç yalnızca kuyruğa iş ekler.
+        return "healthy", {}
+    with status_lock:
+        models = dict(component_status["models"])
+        chatbots = component_status["chatbots"]
+        lexical = component_status["lexical"]
+    available_keys = llm_scheduler.available_count()
+    if chatbots in ("ready", "failed"):
+        # Anahtarlar devre dışı kalıp yoklamayla geri gelebildiğinden durum anlık olarak hesaplanır.
+        chatbots = "ready" if available_keys else "failed"
+    if chatbots == "failed" or (models and all(status == "failed" for status in models.values())):
+        overall = "unhealthy"
+    elif chatbots != "ready" or lexical in ("pending", "loading") or any(status in ("pending", "loading") for status in models.values()):
+        overall = "warming_up"
+    elif lexical == "failed" or any(status == "failed" for status in models.values()) or available_keys < len(llm_scheduler.keys):
+        overall = "degraded"
+    else:
+        overall = "healthy"
+    return overall, {"chatbots": chatbots, "lexical": lexical, "models": models}
+
+def start_background_tasks():
+    global background_started
+    with status_lock:
+        if background_started:
+            return
+        background_started = True
+    threading.Thread(target=initialize_resources, name="warmup", daemon=True).start()
+
+def check_process_role():
+    if PROCESS_ROLE not in ("all", "api", "worker"):
+        raise ValueError(f"Geçersiz PROCESS_ROLE: {PROCESS_ROLE} (all, api veya worker olmalı).")
+    if PROCESS_ROLE != "all" and not job_store.shared:
+        raise ValueError(f"PROCESS_ROLE={PROCESS_ROLE} için süreçler arası paylaşılan bir JOB_STORE_URL (sqlite:/// veya redis://) gerekli.")
+
+def open_interpretation_cache():
+    global interpretation_cache
+    if interpretation_cache is None and INTERPRETATION_CACHE_PATH:
+        interpretation_cache = InterpretationCache(
+            INTERPRETATION_CACHE_PATH, ttl=INTERPRETATION_CACHE_TTL, max_entries=INTERPRETATION_CACHE_MAX_ENTRIES
+        )
 
-    for model_key, config in MODEL_CONFIG.items():
-        chroma_db_path_for_model = os.path.join(CHROMA_DB_BASE_PATH, config['collection_name'])
-        os.makedirs(chroma_db_path_for_model, exist_ok=True)
+def create_app(start_background=True):
+    """Flask uygulamasını oluşturur. Ağır kaynaklar (embedding modelleri, Gemini) içe aktarma sırasında değil,
+    start_background=True ise arka planda yüklenir; bu sırada sunucu rüyaları kabul edip kuyruğa alır.
+    PROCESS_ROLE=api iken kaynaklar hiç yüklenmez; rüyaları ayrı işçi süreçleri (run_worker) işler."""
+    check_process_role()
+    start_background = start_background and PROCESS_ROLE == "all"
+    if start_background and not API_KEYS:
+        raise ValueError("Hiçbir Google API Anahtarı bulunamadı. Lütfen GOOGLE_API_KEY_x çevre değişkenlerini ayarlayın.")
+    if start_background:
+        check_embedding_backend()
+    logging.info(f"{len(API_KEYS)} adet Google API anahtarı yüklendi.")
+    flask_app = Flask(__name__)
+    CORS(flask_app) # CORS'u tüm route'lar için etkinleştir
+    flask_app.register_blueprint(api)
+    open_interpretation_cache()
+    if start_background:
+        start_background_tasks()
+    return flask_app
+
+def run_worker():
+    # HTTP sunucusu olmadan yalnızca modelleri yükleyip paylaşılan kuyruktaki rüyaları işler.
+    check_process_role()
+    if not API_KEYS:
+        raise ValueError("Hiçbir Google API Anahtarı bulunamadı. Lütfen GOOGLE_API_KEY_x çevre değişkenlerini ayarlayın.")
+    check_embedding_backend()
+    logging.info(f"İşçi süreci başlatılıyor ({len(API_KEYS)} API anahtarı, iş deposu: {JOB_STORE_URL.split(':')[0]}).")
+    open_interpretation_cache()
+    start_background_tasks()
+    try:
+        while not stop_event.wait(1.0):
+            pass
+    except KeyboardInterrupt:
+        logging.info("İşçi süreci durduruluyor...")
+    finally:
+        stop_workers(timeout=10)
+        logging.info("İşçi süreci kapatıldı.")
+
+# Rüya işleme kuyruğu için işçi (worker) thread fonksiyonu.
+# İşçiler anahtarlara bağlı değildir; her LLM çağrısı llm_scheduler üzerinden o an en uygun anahtara gider.
+class PartialPublisher:
+    """Kısmi yorumları en fazla interval saniyede bir yayınlar; araya düşenlerden yalnızca sonuncusu tutulur
+    ve flush() ile yazılır. Tek bir işçi thread'i tarafından kullanılır."""
+
+    def __init__(self, publish, interval):
+        self.publish = publish
+        self.interval = interval
+        self._last = None
+        self._pending = None
+
+    def __call__(self, text):
+        now = time.monotonic()
+        if self._last is not None and now - self._last < self.interval:
+            self._pending = text
+            return
+        self._pending = None
+        self._last = now
+        self.publish(text)
+
+    def flush(self):
+        if self._pending is not None:
+            text, self._pending = self._pending, None
+            self._last = time.monotonic()
+            self.publish(text)
+
+def process_dream_queue(worker_index):
+    logging.info(f"Rüya işleme işçisi {worker_index + 1} başlatıldı.")
+    # Modeller yüklenirken gelen rüyalar kuyrukta bekler; işçi ısınma bitince tüketmeye başlar.
+    while not stop_event.is_set() and not models_ready.wait(1.0):
+        pass
+    while not stop_event.is_set():
         try:
-            _, collection = load_existing_chromadb(
-                config['collection_name'], config['model_name'], chroma_db_path_for_model
-            )
-            if collection.count() == 0 and os.path.exists(EXCEL_FILE_PATH):
-                 logging.info(f"'{config['collection_name']}' koleksiyonu boş, Excel'den yükleniyor...")
-                 _, collection = load_excel_to_chromadb(
-                    config['collection_name'], config['model_name'], chroma_db_path_for_model, EXCEL_FILE_PATH
-                 )
-            chroma_collections[model_key] = collection
+            if not llm_scheduler.available_count():
+                # Tüm anahtarlar devre dışıyken iş alınmaz; rüyalar bir anahtar yoklamayı geçene kadar kuyrukta bekler.
+                stop_event.wait(1.0)
+                continue
+            # Kuyruk boşken koşul değişkeninde beklenir; submit_dream yeni iş eklediğinde işçi hemen uyanır.
+            # Alınan iş aynı adımda çalışıyor olarak işaretlenir; kirası maintain_job_leases ile yenilenir.
+            job = dream_queue.get(timeout=1.0)
+            if job is None:
+                continue
+            job_id = job["job_id"]
+            with leased_jobs_lock:
+                leased_jobs.add(job_id)
+            QUEUE_WAIT_SECONDS.observe(max(0.0, job["started_at"] - job["created_at"]))
+            busy_started = time.perf_counter()
+            WORKERS_BUSY.inc()
+            dream_to_process = job["ruya"]
+            logging.info(f"İşçi {worker_index + 1}: Kuyruktan '{dream_to_process}' rüyası işlenmek üzere alındı (İş: {job_id}).")
+
+            publish_partial = PartialPublisher(lambda partial_text: job_store.update_partial(job_id, partial_text), JOB_PARTIAL_PUBLISH_INTERVAL)
+            try:
+                interpretation_result, complete = get_interpretation_for_queue(
+                    dream_to_process,
+                    llm_chats["interpretation_chat"],
+                    llm_chats["rewrite_chat"],
+                    chroma_collections,
+                    model_names_global,
+                    delay=REQUEST_DELAY,
+                    on_partial=publish_partial
+                )
+                publish_partial.flush()
+                job_store.mark_done(job_id, interpretation_result)
+                if interpretation_cache is not None and complete:
+                    interpretation_cache.put(dream_to_process, interpretation_result)
+                JOBS_TOTAL.labels("done").inc()
+                logging.info(f"İşçi {worker_index + 1}: '{dream_to_process}' rüyası başarıyla yorumlandı (İş: {job_id}).")
+            except Exception as e:
+                logging.error(f"İşçi {worker_index + 1}: '{dream_to_process}' rüyası işlenirken hata oluştu: {e}")
+                job_store.mark_failed(job_id, JOB_FAILED_MESSAGE)
+                JOBS_TOTAL.labels("failed").inc()
+            finally:
+                with leased_jobs_lock:
+                    leased_jobs.discard(job_id)
+                WORKERS_BUSY.dec()
+                WORKER_BUSY_SECONDS.labels(str(worker_index + 1)).inc(time.perf_counter() - busy_started)
         except Exception as e:
-            logging.error(f"{model_key} için ChromaDB yüklenirken/oluşturulurken hata: {e}")
-            chroma_collections[model_key] = None
+            logging.error(f"İşçi {worker_index + 1}: Rüya işleme thread'inde beklenmedik hata: {e}")
+            stop_event.wait(1)
+    logging.info(f"Rüya işleme işçisi {worker_index + 1} durduruldu.")
 
-    system_prompt = """Sen bir İslami rüya tabiri uzmanısın. Sana verilen rüya ve ilgili bulunan tabirlere dayanarak rüyanın genel bir yorumunu yapacaksın. Yalnızca sağlanan tabir bilgilerini kullan, dışarıdan bilgi ekleme. Eğer bir unsur için yorum yoksa veya tabirler çelişkili ise bunu belirt. Yanıtlarını Türkçe, doğal, akıcı ve saygılı bir üslupla ver."""
-    rewrite_system_prompt = """Sen bir yardımcı asistansın. Görevin, kullanıcının verdiği rüya metnini analiz ederek, rüyada görülen ana unsurları belirlemek ve bu unsurlar için sorgular üretmektir. Her bir unsur için, 'Rüyada [Nesne/Varlık] [Eylem]' formatında birden fazla doğal sorgu oluşturmalısın. Ayrıca, bu sorguların tanımlayıcı özellikler içeren KULLANICININ RÜYASINA UYGUN varyantlarını da üretmelisin. Yanıtlarını sadece sorgular listesi olarak, her satıra bir sorgu gelecek şekilde ver. Açıklama yapma, sadece sorguları üret."""
-
-    for i in range(len(API_KEYS)):
-        api_key = API_KEYS[i]
-        logging.info(f"Chatbot {i+1} oluşturuluyor (API Key {i+1} ile)...")
-        interpretation_chatbot = build_chatbot(system_prompt, api_key)
-        rewrite_chatbot = build_chatbot(rewrite_system_prompt, api_key)
-        if interpretation_chatbot and rewrite_chatbot:
-             user_chats.append({
-                 "interpretation_chat": interpretation_chatbot,
-                 "rewrite_chat": rewrite_chatbot,
-                 "api_key_index": i
-             })
-             logging.info(f"Chatbot çifti {i+1} başarıyla oluşturuldu.")
-        else:
-             logging.error(f"Chatbot çifti {i+1} oluşturulamadı (API Key {i+1}). Bu anahtar atlanacak.")
-    if not user_chats:
-         raise RuntimeError("Hiçbir kullanılabilir chatbot oluşturulamadı. API anahtarlarını veya bağlantıyı kontrol edin.")
-    logging.info("Tüm kaynaklar başarıyla başlatıldı.")
-
-# Rüya işleme kuyruğu için arka plan thread fonksiyonu
-def process_dream_queue():
-    global user_id_counter
-    logging.info("Rüya işleme arka plan thread'i başlatıldı.")
-    while not stop_event.is_set():
+def maintain_job_leases():
+    # Bu süreçteki işlerin kirasını yeniler ve çöken süreçlerden kalan işleri kurtarır.
+    while not stop_event.wait(JOB_HEARTBEAT_INTERVAL):
         try:
-            dream_to_process = None
-            with queue_lock:
-                if dream_queue:
-                    dream_to_process = dream_queue.popleft()
-
-            if dream_to_process:
-                logging.info(f"Kuyruktan '{dream_to_process}' rüyası işlenmek üzere alındı.")
-
-                with user_id_lock:
-                    current_user_index = user_id_counter % len(user_chats)
-                    selected_chat_pair = user_chats[current_user_index]
-                    user_id_counter += 1
-
-                logging.info(f"'{dream_to_process}' rüyası için Chatbot Seti {current_user_index + 1} kullanılıyor.")
-
-                try:
-                    interpretation_result = get_interpretation_for_queue(
-                        dream_to_process,
-                        selected_chat_pair["interpretation_chat"],
-                        selected_chat_pair["rewrite_chat"],
-                        chroma_collections,
-                        model_names_global,
-                        delay=REQUEST_DELAY
-                    )
-                    with processed_lock:
-                        processed_interpretations[dream_to_process] = interpretation_result
-                    logging.info(f"'{dream_to_process}' rüyası başarıyla yorumlandı ve sonuçlara eklendi.")
-                except Exception as e:
-                    logging.error(f"'{dream_to_process}' rüyası işlenirken hata oluştu: {e}")
-                    with processed_lock:
-                        processed_interpretations[dream_to_process] = "Rüyanız işlenirken bir hata oluştu. Lütfen daha sonra tekrar deneyin."
+            with leased_jobs_lock:
+                job_ids = list(leased_jobs)
+            job_store.heartbeat(job_ids)
+            requeued, failed = dream_queue.recover_stale(JOB_LEASE_TIMEOUT, JOB_MAX_ATTEMPTS, JOB_FAILED_MESSAGE)
+            if requeued:
+                logging.warning(f"Kirası dolan {len(requeued)} iş yeniden kuyruğa alındı: {requeued}")
+            if failed:
+                JOBS_TOTAL.labels("failed").inc(len(failed))
+                logging.error(f"{JOB_MAX_ATTEMPTS} kez başlatılıp tamamlanamayan {len(failed)} iş başarısız sayıldı: {failed}")
+        except Exception as e:
+            logging.error(f"İş kiraları yenilenirken hata: {e}")
 
-            else:
-                time.sleep(5)
+def maintain_models():
+    # Boşta kalan modeller işçi döngüsünde değil, tek bir bakım thread'inde boşaltılır.
+    while not stop_event.wait(ENSEMBLE_UNLOAD_CHECK_INTERVAL):
+        try:
+            unload_idle_models()
         except Exception as e:
-            logging.error(f"Rüya işleme thread'inde beklenmedik hata: {e}")
-            time.sleep(10)
-    logging.info("Rüya işleme arka plan thread'i durduruldu.")
+            logging.error(f"Boştaki modeller boşaltılırken hata: {e}")
+
+def start_workers():
+    # DREAM_WORKER_COUNT verilmezse (veya 0 ise) API anahtarı sayısı kadar işçi başlatılır.
+    worker_count = DREAM_WORKER_COUNT if DREAM_WORKER_COUNT > 0 else max(1, len(API_KEYS))
+    for worker_index in range(worker_count):
+        thread = threading.Thread(
+            target=process_dream_queue,
+            args=(worker_index,),
+            name=f"dream-worker-{worker_index + 1}",
+            daemon=True
+        )
+        thread.start()
+        processing_threads.append(thread)
+    if job_store.shared:
+        threading.Thread(target=maintain_job_leases, name="job-leases", daemon=True).start()
+    if ENSEMBLE_MODE == "adaptive" and ENSEMBLE_UNLOAD_AFTER > 0:
+        threading.Thread(target=maintain_models, name="model-unload", daemon=True).start()
+    logging.info(f"{worker_count} adet rüya işleme işçisi başlatıldı ({llm_scheduler.available_count()}/{len(API_KEYS)} API anahtarı kullanılabilir).")
+
+def stop_workers(timeout=10):
+    stop_event.set()
+    dream_queue.close()
+    retrieval_executor.shutdown(wait=False)
+    rewrite_executor.shutdown(wait=False)
+    model_stats.save()
+    deadline = time.monotonic() + timeout
+    for thread in processing_threads:
+        thread.join(timeout=max(0.0, deadline - time.monotonic()))
+        if thread.is_alive():
+            logging.warning(f"{thread.name} zamanında durmadı.")
 
 
 # --- API Endpoint'leri ---
-@app.route('/submit_dream', methods=['POST'])
+@api.route('/submit_dream', methods=['POST'])
 def submit_dream():
     if not request.is_json:
         return jsonify({"error": "İstek JSON formatında olmalı"}), 400
@@ -632,41 +1927,161 @@ def submit_dream():
     if not dream_text or not isinstance(dream_text, str) or len(dream_text.strip()) == 0:
         return jsonify({"error": "'ruya' anahtarı eksik, boş veya geçersiz bir metin"}), 400
 
-    with queue_lock:
-        if dream_text in dream_queue or dream_text in processed_interpretations:
-            logging.info(f"Rüya '{dream_text[:50]}...' zaten kuyrukta veya işlenmiş. Tekrar eklenmiyor.")
-            return jsonify({"message": "Rüyanız başarıyla alındı ve işlenmek üzere sıraya eklendi."}), 200
-
-        dream_queue.append(dream_text)
-    logging.info(f"Rüya '{dream_text[:50]}...' kuyruğa eklendi. Kuyruk boyutu: {len(dream_queue)}")
-    return jsonify({"message": "Rüyanız başarıyla alındı ve işlenmek üzere sıraya eklendi."}), 200
+    priority = data.get('oncelik', DREAM_PRIORITY_MIN)
+    if not isinstance(priority, int) or isinstance(priority, bool):
+        return jsonify({"error": "'oncelik' bir tam sayı olmalı"}), 400
+    # İstemci kuyruğun önüne geçemez; yalnızca varsayılan ile DREAM_PRIORITY_MAX arasında daha geride kalmayı seçebilir.
+    priority = min(max(priority, DREAM_PRIORITY_MIN), DREAM_PRIORITY_MAX)
+
+    cached_interpretation = interpretation_cache.get(dream_text) if interpretation_cache is not None else None
+    if cached_interpretation is not None:
+        # Önbellekten yanıtlanan rüya kuyruğa girmez; hazır sonuçla biten bir iş kaydı oluşturulur.
+        job = job_store.create(dream_text, status=JOB_DONE, result=cached_interpretation)
+        JOBS_TOTAL.labels("cache_hit").inc()
+        logging.info(f"Rüya '{dream_text[:50]}...' yorum önbelleğinden yanıtlandı (İş: {job['job_id']}).")
+        return jsonify({
+            "message": "Rüyanız daha önce yorumlanmış, sonuç hazır.",
+            "job_id": job["job_id"],
+            "status": job["status"],
+            "ruya": dream_text,
+            "yorum": cached_interpretation
+        }), 200
+
+    # Aynı (normalize) rüya kuyrukta veya işleniyorsa yeni iş açılmaz; istek o işe bağlanır ve sonucu paylaşır.
+    # Kontrol, iş kaydı ve kuyruk kaydı tek işlemdir; paylaşılan depoda farklı süreçlerden gelen istekler de birleşir.
+    try:
+        job, created = dream_queue.submit(dream_text, priority=priority)
+    except DreamQueueFull:
+        JOBS_TOTAL.labels("rejected").inc()
+        logging.warning(f"Kuyruk dolu ({DREAM_QUEUE_MAXSIZE}). Rüya '{dream_text[:50]}...' reddedildi.")
+        response = jsonify({
+            "error": "Sunucu şu anda çok yoğun. Lütfen biraz sonra tekrar deneyin.",
+            "retry_after": DREAM_QUEUE_RETRY_AFTER
+        })
+        response.headers['Retry-After'] = str(DREAM_QUEUE_RETRY_AFTER)
+        return response, 503
+    if not created:
+        JOBS_TOTAL.labels("deduplicated").inc()
+        logging.info(f"Rüya '{dream_text[:50]}...' zaten {'işleniyor' if job['status'] == JOB_RUNNING else 'kuyrukta'}; istek mevcut işe bağlandı (İş: {job['job_id']}, abone: {job['subscribers']}).")
+        return jsonify({
+            "message": "Aynı rüya şu anda yorumlanıyor; sonucu bu iş üzerinden alabilirsiniz.",
+            "job_id": job["job_id"],
+            "status": job["status"],
+            "coalesced": True
+        }), 202
+
+    JOBS_TOTAL.labels("queued").inc()
+    logging.info(f"Rüya '{dream_text[:50]}...' kuyruğa eklendi (İş: {job['job_id']}). Kuyruk boyutu: {len(dream_queue)}")
+    return jsonify({
+        "message": "Rüyanız başarıyla alındı ve işlenmek üzere sıraya eklendi.",
+        "job_id": job["job_id"],
+        "status": job["status"]
+    }), 202
+
+def job_response(job):
+    return {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "ruya": job["ruya"],
+        "yorum": job["yorum"],
+        "partial": job["partial"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"]
+    }
 
-@app.route('/check_interpretations', methods=['GET'])
-def check_interpretations():
-    results_to_send = []
-    with processed_lock:
-        if not processed_interpretations:
-            return jsonify([]), 200
+@api.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    # ?wait=<sn> verilirse (long-poll) iş bitene veya süre dolana kadar yanıt bekletilir.
+    try:
+        wait_seconds = min(max(float(request.args.get('wait', 0)), 0.0), JOB_LONG_POLL_MAX_WAIT)
+    except ValueError:
+        return jsonify({"error": "'wait' bir sayı olmalı"}), 400
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({"error": "İş bulunamadı veya süresi doldu"}), 404
+    if wait_seconds > 0 and job["status"] not in (JOB_DONE, JOB_FAILED):
+        deadline = time.monotonic() + wait_seconds
+        while job is not None and job["status"] not in (JOB_DONE, JOB_FAILED):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            job = job_store.wait_for_change(job_id, job["version"], timeout=remaining)
+        if job is None:
+            return jsonify({"error": "İş bulunamadı veya süresi doldu"}), 404
+    return jsonify(job_response(job)), 200
+
+@api.route('/jobs/<job_id>/events', methods=['GET'])
+def stream_job_events(job_id):
+    # Server-Sent Events: durum değişiklikleri 'status', kısmi sonuç güncellemeleri 'partial' olayı olarak
+    # gönderilir; iş bitince akış kapanır.
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({"error": "İş bulunamadı veya süresi doldu"}), 404
+
+    def generate(job):
+        last_version = 0
+        last_status = None
+        while job is not None:
+            if job["version"] > last_version:
+                last_version = job["version"]
+                event = "status" if job["status"] != last_status else "partial"
+                last_status = job["status"]
+                yield f"event: {event}\ndata: {json.dumps(job_response(job), ensure_ascii=False)}\n\n"
+                if job["status"] in (JOB_DONE, JOB_FAILED):
+                    return
+            else:
+                yield ": ping\n\n" # Bağlantıyı canlı tutmak için
+            job = job_store.wait_for_change(job_id, last_version, timeout=SSE_HEARTBEAT_SECONDS)
 
-        for dream, interpretation in list(processed_interpretations.items()):
-            results_to_send.append({"ruya": dream, "yorum": interpretation})
-            del processed_interpretations[dream]
+    return Response(
+        stream_with_context(generate(job)),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-    logging.info(f"{len(results_to_send)} adet işlenmiş yorum istemciye gönderiliyor.")
+@api.route('/check_interpretations', methods=['GET'])
+def check_interpretations():
+    # Eski istemciler için korunmuştur; yalnızca job_id parametreleriyle verilen işlerin sonuçları döner.
+    # Parametresiz istek diğer kullanıcıların sonuçlarını da tüketeceği için reddedilir.
+    job_ids = [job_id for job_id in request.args.getlist('job_id') if job_id]
+    if not job_ids:
+        return jsonify({"error": "En az bir 'job_id' parametresi gerekli"}), 400
+    if len(job_ids) > CHECK_INTERPRETATIONS_MAX_IDS:
+        return jsonify({"error": f"En fazla {CHECK_INTERPRETATIONS_MAX_IDS} 'job_id' gönderilebilir"}), 400
+    results_to_send = [
+        {"job_id": job["job_id"], "ruya": job["ruya"], "yorum": job["yorum"] if job["status"] == JOB_DONE else job["error"]}
+        for job in job_store.take_undelivered(job_ids)
+    ]
+    if results_to_send:
+        logging.info(f"{len(results_to_send)} adet işlenmiş yorum istemciye gönderiliyor.")
     return jsonify(results_to_send), 200
 
-@app.route('/health', methods=['GET'])
+@api.route('/health', methods=['GET'])
 def health_check():
     try:
+        overall, components = readiness()
         status = {
-            "status": "healthy",
+            "status": overall,
             "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "components": components,
+            "retrieval_backend": RETRIEVAL_BACKEND,
+            "embedding_backend": EMBEDDING_BACKEND,
+            "process_role": PROCESS_ROLE,
+            "job_store": JOB_STORE_URL.split(':')[0],
             "queue_size": len(dream_queue),
-            "processed_count": len(processed_interpretations),
+            "jobs": job_store.counts(),
             "active_models": len([m for m in chroma_collections.values() if m is not None]),
-            "active_chatbots": len(user_chats)
+            "active_chatbots": llm_scheduler.available_count(),
+            "api_keys": llm_scheduler.snapshot(),
+            "active_workers": len([t for t in processing_threads if t.is_alive()]),
+            "embedding_cache": embedding_cache.stats(),
+            "rewrite_cache": rewrite_cache.stats(),
+            "interpretation_cache": interpretation_cache.stats() if interpretation_cache is not None else None,
+            "ensemble_mode": ENSEMBLE_MODE
         }
-        return jsonify(status), 200
+        return jsonify(status), 503 if overall == "unhealthy" else 200
     except Exception as e:
         logging.error(f"Health check sırasında hata: {e}")
         return jsonify({
@@ -675,21 +2090,40 @@ def health_check():
             "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
         }), 500
 
-# Flask uygulamasını çalıştırmadan önce kaynakları başlat ve arka plan thread'ini başlat
-initialize_resources()
-
-processing_thread = threading.Thread(target=process_dream_queue, daemon=True)
-processing_thread.start()
+@api.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics_registry.render(), content_type=metrics.CONTENT_TYPE)
+
+@api.route('/stats/models', methods=['GET'])
+def model_selection_stats():
+    # Modellerin kazanma oranları ve mevcut topluluk politikası (inceleme için).
+    primary_models, reserve_models = choose_ensemble(model_names_global, chroma_collections)
+    with status_lock:
+        model_status = dict(component_status["models"])
+    return jsonify({
+        "ensemble_mode": ENSEMBLE_MODE,
+        "top_k": ENSEMBLE_TOP_K,
+        "min_selections": ENSEMBLE_MIN_SELECTIONS,
+        "primary_models": primary_models,
+        "reserve_models": reserve_models,
+        "model_status": model_status,
+        **model_stats.snapshot()
+    })
 
 if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Rüya yorumlama sunucusu.")
+    parser.add_argument("--role", choices=("all", "api", "worker"), default=PROCESS_ROLE, help="Süreç rolü (PROCESS_ROLE yerine).")
+    PROCESS_ROLE = parser.parse_args().role
+    if PROCESS_ROLE == "worker":
+        run_worker()
+        sys.exit(0)
+    app = create_app()
     try:
         app.run(host='0.0.0.0', port=5000, debug=False)
     except KeyboardInterrupt:
         logging.info("Uygulama durduruluyor...")
     finally:
-        logging.info("Arka plan thread'inin durması bekleniyor...")
-        stop_event.set()
-        processing_thread.join(timeout=10)
-        if processing_thread.is_alive():
-            logging.warning("Arka plan thread'i zamanında durmadı.")
-        logging.info("Uygulama tamamen kapatıldı.")
\ No newline at end of file
+        logging.info("Arka plan işçilerinin durması bekleniyor...")
+        stop_workers(timeout=10)
+        logging.info("Uygulama tamamen kapatıldı.")
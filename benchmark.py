@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+"""Gemini anahtarı ve gerçek embedding modelleri olmadan uçtan uca verim ölçümü.
+
+Gemini çağrıları ayarlanabilir gecikmeli sahte bir chatbot ile, SentenceTransformer modelleri
+karakter üçlülerini (trigram) hash'leyen sahte bir embedding fonksiyonu ile değiştirilir. Kuyruk,
+işçiler, Chroma araması, model seçimi ve yanıt biçimlendirme gerçek kod yolundan geçer.
+Eşzamanlı istemciler /submit_dream ile rüya gönderip /jobs/<id>?wait= ile sonucu bekler.
+
+    python benchmark.py                                  # sentetik derlem, 8 istemci, 200 rüya
+    python benchmark.py --clients 32 --dreams 1000 --llm-latency 0.4
+    python benchmark.py --excel ./data/son_guncellenmis_dosya.xlsx --json sonuc.json
+    python benchmark.py --max-p95 5.0                    # p95 bu değeri aşarsa çıkış kodu 1
+"""
+import os
+import sys
+import json
+import time
+import math
+import random
+import hashlib
+import logging
+import argparse
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+from openpyxl import Workbook
+
+NOUNS = [
+    "yılan", "köpek", "kedi", "at", "inek", "balık", "kuş", "aslan", "deve", "arı",
+    "ev", "ağaç", "deniz", "dağ", "su", "ateş", "yağmur", "kar", "cami", "köprü",
+    "altın", "para", "ekmek", "elma", "üzüm", "bal", "süt", "gül", "yüzük", "ayakkabı",
+    "anne", "baba", "bebek", "ölü", "gelin", "asker", "öğretmen", "doktor", "hırsız", "kral",
+]
+VERBS = ["görmek", "yemek", "içmek", "almak", "kaybetmek", "bulmak", "öldürmek", "sevmek", "kovalamak", "konuşmak"]
+
+
+def build_synthetic_corpus(path, size):
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(["Rüya", "Yorum"])
+    rng = random.Random(0)
+    for i in range(size):
+        noun, verb = NOUNS[i % len(NOUNS)], VERBS[(i // len(NOUNS)) % len(VERBS)]
+        suffix = f" ({i // (len(NOUNS) * len(VERBS))})" if i >= len(NOUNS) * len(VERBS) else ""
+        yorum = f"Rüyada {noun} {verb}, " + " ".join(rng.choice(NOUNS) for _ in range(30)) + " ile yorumlanır."
+        sheet.append([f"Rüyada {noun.capitalize()} {verb.capitalize()}{suffix}", yorum])
+    workbook.save(path)
+
+
+def make_dreams(count, unique_ratio, seed=1):
+    rng = random.Random(seed)
+    pool_size = max(1, int(count * unique_ratio))
+    pool = [
+        f"Rüyamda {rng.choice(NOUNS)} {rng.choice(VERBS)} istedim, sonra {rng.choice(NOUNS)} ve {rng.choice(NOUNS)} gördüm. ({i})"
+        for i in range(pool_size)
+    ]
+    return [pool[i % pool_size] for i in range(count)]
+
+
+class FakeEmbeddingFunction:
+    """Karakter trigramlarını sabit boyutlu vektöre hash'leyen, deterministik sahte embedding.
+
+    Vektörler gerçek modellerdeki gibi normalize edilmez; böylece mesafe uzayı/benzerlik dönüşümündeki
+    hatalar ölçümde gizlenmez.
+    """
+
+    def __init__(self, model_name="fake", dimensions=256, latency=0.0):
+        self.model_name = model_name
+        self.dimensions = dimensions
+        self.latency = latency
+
+    def __call__(self, input):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        vectors = []
+        for text in input:
+            vector = np.zeros(self.dimensions, dtype=np.float32)
+            padded = f"  {str(text).lower()}  "
+            for i in range(len(padded) - 2):
+                digest = hashlib.blake2b(padded[i:i + 3].encode("utf-8"), digest_size=4, person=self.model_name.encode()[:16]).digest()
+                vector[int.from_bytes(digest, "little") % self.dimensions] += 1.0
+            vectors.append(vector)
+        return vectors
+
+    def embed_query(self, input):
+        return self(input)
+
+    @staticmethod
+    def name():
+        return "default"
+
+    def get_config(self):
+        return {}
+
+    def is_legacy(self):
+        return True
+
+
+class FakeResponse:
+    def __init__(self, text, chunks=1, chunk_latency=0.0):
+        self.text = text
+        self.chunks = max(1, chunks)
+        self.chunk_latency = chunk_latency
+
+    def __iter__(self):
+        step = max(1, math.ceil(len(self.text) / self.chunks))
+        for start in range(0, len(self.text), step):
+            if self.chunk_latency > 0:
+                time.sleep(self.chunk_latency)
+            yield FakeResponse(self.text[start:start + step])
+
+
+class FakeChat:
+    """Gemini yerine geçen sahte chatbot: sorgu üretimi, model seçimi ve genel yorum için hazır yanıtlar."""
+
+    def __init__(self, kind, latency, jitter, stream_chunks):
+        self.kind = kind
+        self.latency = latency
+        self.jitter = jitter
+        self.stream_chunks = stream_chunks
+        self._rng = random.Random()
+
+    def send_message(self, content, stream=False, **kwargs):
+        time.sleep(max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter)))
+        if self.kind == "rewrite":
+            words = [word.strip(".,()") for word in content.rsplit(":", 1)[-1].split()]
+            nouns = [word for word in words if word in NOUNS][:4] or ["rüya"]
+            return FakeResponse("\n".join(f"Rüyada {noun} görmek" for noun in nouns))
+        if "Sorgu 1:" in content and "model numarası" in content:
+            count = content.count("\nSorgu ") + (1 if content.lstrip().startswith("Sorgu") else 0)
+            return FakeResponse("\n".join(f"Sorgu {i}: 1" for i in range(1, max(1, count) + 1)))
+        text = "Rüyanız genel olarak hayırlı bir işarettir. " * 15
+        if stream:
+            return FakeResponse(text, chunks=self.stream_chunks, chunk_latency=self.latency / (2 * self.stream_chunks))
+        return FakeResponse(text)
+
+
+def check_similarity_scale(app, samples=5):
+    """Her koleksiyonda birkaç belgeyi kendi vektörünün iki katıyla arar; benzerlik ~1 olmalıdır.
+
+    Benzerlik vektörün ölçeğinden bağımsız olmalıdır. Mesafe uzayı yanlış okunursa (ör. normalize edilmemiş
+    vektörlerde kare L2) benzerlik 0'a kırpılır ve yeniden sıralama tüm sorguları eşiğin altında bırakır.
+    Hatalı (model, benzerlik) çiftlerini döner.
+    """
+    failures = []
+    for model_key, collection in app.chroma_collections.items():
+        if collection is None or not hasattr(collection, 'get'):
+            continue
+        documents = collection.get(limit=samples, include=['documents'])['documents']
+        if not documents:
+            continue
+        vectors = [2.0 * np.asarray(vector) for vector in app.query_embedders[model_key].embed(documents)]
+        results = collection.query(query_embeddings=vectors, n_results=1, include=['distances'])
+        space = app.collection_distance_space(collection)
+        for distances in results['distances']:
+            similarity = app.distance_to_similarity(distances[0], space)
+            if similarity < 0.99:
+                failures.append((model_key, round(similarity, 4)))
+    return failures
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def run_client(flask_app, dreams, results, lock, poll_wait):
+    client = flask_app.test_client()
+    for dream in dreams:
+        started = time.perf_counter()
+        outcome = "done"
+        rejected = 0
+        while True:
+            response = client.post("/submit_dream", json={"ruya": dream})
+            if response.status_code != 503:
+                break
+            rejected += 1
+            time.sleep(min(1.0, float(response.headers.get("Retry-After", 1))))
+        body = response.get_json() or {}
+        if response.status_code not in (200, 202):
+            outcome = f"http_{response.status_code}"
+        elif body.get("status") not in ("done", "failed"):
+            while True:
+                body = client.get(f"/jobs/{body['job_id']}?wait={poll_wait}").get_json() or {}
+                if body.get("status") in ("done", "failed"):
+                    break
+            outcome = body["status"]
+        else:
+            outcome = "cache_hit" if body.get("status") == "done" else body.get("status")
+        with lock:
+            results.append({"latency": time.perf_counter() - started, "outcome": outcome, "rejected": rejected})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sahte Gemini ve sahte embedding ile uçtan uca verim ölçümü.")
+    parser.add_argument("--clients", type=int, default=8, help="Eşzamanlı istemci sayısı")
+    parser.add_argument("--dreams", type=int, default=200, help="Toplam gönderilecek rüya sayısı")
+    parser.add_argument("--unique-ratio", type=float, default=1.0, help="Farklı rüya oranı (<1 tekrarlar ve önbellek isabetleri üretir)")
+    parser.add_argument("--keys", type=int, default=4, help="Sahte API anahtarı (chatbot çifti) sayısı")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Sahte Gemini çağrısı başına ortalama gecikme (sn)")
+    parser.add_argument("--llm-jitter", type=float, default=0.05, help="Gecikmeye eklenen ±rastgele sapma (sn)")
+    parser.add_argument("--stream-chunks", type=int, default=10, help="Genel yorumun akışta kaç parçada geleceği")
+    parser.add_argument("--embed-latency", type=float, default=0.005, help="Sahte embedding batch'i başına gecikme (sn)")
+    parser.add_argument("--corpus-size", type=int, default=2000, help="Sentetik derlemdeki satır sayısı")
+    parser.add_argument("--excel", help="Sentetik derlem yerine kullanılacak Excel dosyası ('Rüya' ve 'Yorum' sütunları)")
+    parser.add_argument("--cache", action="store_true", help="Yorum önbelleğini etkinleştir (varsayılan: kapalı)")
+    parser.add_argument("--json", help="Sonuçların yazılacağı JSON dosyası")
+    parser.add_argument("--max-p95", type=float, help="p95 uçtan uca gecikme bu değeri (sn) aşarsa 1 ile çık")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="ruya_benchmark_")
+    excel_path = args.excel
+    if not excel_path:
+        excel_path = os.path.join(workdir, "corpus.xlsx")
+        build_synthetic_corpus(excel_path, args.corpus_size)
+    # app ve ruya_index yapılandırmayı içe aktarma sırasında okuduğundan ortam önceden hazırlanır.
+    os.environ["EXCEL_FILE_PATH"] = excel_path
+    os.environ["CHROMA_DB_PATH"] = os.path.join(workdir, "chroma")
+    os.environ["INTERPRETATION_CACHE_PATH"] = os.path.join(workdir, "cache.sqlite3") if args.cache else ""
+    os.environ["MODEL_STATS_PATH"] = ""
+    os.environ.setdefault("LLM_RPM_PER_KEY", "1000000")
+    os.environ.setdefault("LLM_BURST_PER_KEY", "1000")
+    for i in range(1, args.keys + 1):
+        os.environ[f"GOOGLE_API_KEY_{i}"] = f"benchmark-{i}"
+
+    import app
+
+    # Rüya başına onlarca satırlık INFO kaydı ölçümü boğmasın.
+    logging.getLogger().setLevel(logging.WARNING)
+
+    app.load_embedding_function = (
+        lambda config, **kwargs: FakeEmbeddingFunction(config['model_name'], latency=args.embed_latency)
+    )
+    app.build_chatbot = lambda system_prompt, api_key: FakeChat(
+        "rewrite" if "sorgu" in system_prompt else "interpretation",
+        args.llm_latency, args.llm_jitter, args.stream_chunks
+    )
+
+    started = time.perf_counter()
+    flask_app = app.create_app()
+    while True:
+        status, _ = app.readiness()
+        if status not in ("warming_up",):
+            break
+        time.sleep(0.2)
+    warmup_seconds = time.perf_counter() - started
+    print(f"Isınma: {warmup_seconds:.1f} sn (durum: {status})")
+    if status == "unhealthy":
+        return 1
+    similarity_failures = check_similarity_scale(app)
+    if similarity_failures:
+        print(f"Belgeler kendi vektörlerinin iki katıyla aranırken benzerlik ~1 çıkmadı: {similarity_failures}")
+        return 1
+
+    dreams = make_dreams(args.dreams, args.unique_ratio)
+    results = []
+    lock = threading.Lock()
+    threads = [
+        threading.Thread(target=run_client, args=(flask_app, dreams[i::args.clients], results, lock, 30), daemon=True)
+        for i in range(args.clients)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    app.stop_workers(timeout=5)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies = [result["latency"] for result in results]
+    outcomes = {}
+    for result in results:
+        outcomes[result["outcome"]] = outcomes.get(result["outcome"], 0) + 1
+    stages = {
+        key[0]: round(total / count, 4)
+        for key, (count, total) in app.STAGE_SECONDS.totals().items() if count
+    }
+    report = {
+        "clients": args.clients,
+        "dreams": len(results),
+        "elapsed_seconds": round(elapsed, 3),
+        "dreams_per_second": round(len(results) / elapsed, 3) if elapsed else 0.0,
+        "latency_seconds": {
+            "p50": round(percentile(latencies, 0.50), 4),
+            "p95": round(percentile(latencies, 0.95), 4),
+            "p99": round(percentile(latencies, 0.99), 4),
+            "max": round(max(latencies, default=0.0), 4),
+        },
+        "outcomes": outcomes,
+        "queue_rejections": sum(result["rejected"] for result in results),
+        "stage_mean_seconds": stages,
+        "warmup_seconds": round(warmup_seconds, 3),
+        "llm_latency": args.llm_latency,
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.max_p95 is not None and report["latency_seconds"]["p95"] > args.max_p95:
+        print(f"p95 ({report['latency_seconds']['p95']} sn) sınırı ({args.max_p95} sn) aşıyor.")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
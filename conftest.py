@@ -0,0 +1 @@
+# Depo kökü sys.path'e eklensin diye (pytest, kökteki conftest.py'nin dizinini içe aktarma yoluna koyar).
@@ -0,0 +1,943 @@
+# -*- coding: utf-8 -*-
+"""Rüya işlerinin (job) durumu ve işlenme kuyruğu.
+
+Üç arka uç aynı arayüzü sunar; open_job_backend(url) (iş_deposu, kuyruk) çifti döner:
+
+    memory                     tek süreç: sözlük + koşul değişkeni (varsayılan)
+    sqlite:///./cache/jobs.sqlite3
+                               aynı makinedeki birden çok süreç (WAL modunda SQLite)
+    redis://localhost:6379/0   birden çok makine (isteğe bağlı 'redis' paketi gerekir)
+
+Paylaşılan arka uçlarda HTTP sunucusu (ör. birkaç gunicorn işçisi) ile rüya işleyen işçi süreçleri
+ayrı ayrı çalıştırılıp ölçeklenebilir. SQLite'ta süreçler arası bildirim olmadığından bekleme işlemleri
+(kuyruktan alma, wait_for_change) poll_interval aralıklarıyla yoklama yapar; boş kuyruk yalnızca okuma
+sorgusuyla yoklanır. Redis'te boş kuyrukta işçiler bir bildirim listesinde bloklanarak bekler.
+
+Kuyruk işi ve kuyruk kaydını submit() ile tek işlemde oluşturur; get() işi aynı işlemde kuyruktan alıp
+çalışıyor olarak işaretler (kiralama). Çalışan süreç heartbeat() ile kirayı yeniler; çöken bir sürecin
+işleri recover_stale() ile yeniden kuyruğa alınır veya deneme hakkı bittiyse başarısız sayılır.
+"""
+import os
+import re
+import json
+import time
+import uuid
+import heapq
+import sqlite3
+import contextlib
+import itertools
+import threading
+import collections
+import unicodedata
+from urllib.parse import urlparse
+
+def normalize_dream_text(text):
+    # Büyük/küçük harf (Türkçe İ/I dahil), noktalama ve boşluk farklarını yok sayan anahtar metni.
+    text = unicodedata.normalize("NFC", text).replace("İ", "i").replace("I", "ı").lower()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+# --- Bellek İçi İş Deposu (tek süreç) ---
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+class JobStore:
+    """Rüya işlerinin durumunu iş kimliğine göre tutar.
+
+    Tüm aramalar sözlük üzerinden O(1)'dir. Biten işler result_ttl saniye sonra bitiş sırasına
+    göre silinir. Normalize metni aynı olan kuyruktaki/çalışan iş metin indeksinden bulunur ve
+    yeni istekler ona bağlanır (single-flight); iş bir kez çalışır, sonucu tüm abonelerle paylaşılır.
+    Her durum değişikliği işin version alanını artırır ve wait_for_change ile bekleyenleri uyandırır.
+    """
+
+    shared = False # Yalnızca bu süreçten görülebilir
+
+    def __init__(self, result_ttl=3600):
+        self.result_ttl = result_ttl
+        self._jobs = {}
+        self._active_by_text = {}
+        self._finished_order = collections.deque() # (bitiş zamanı, iş kimliği)
+        self._lock = threading.Condition()
+
+    @staticmethod
+    def _public(job):
+        return dict(job)
+
+    def _purge_expired(self, now):
+        while self._finished_order and now - self._finished_order[0][0] > self.result_ttl:
+            _, job_id = self._finished_order.popleft()
+            self._jobs.pop(job_id, None)
+
+    def create(self, dream_text, status=JOB_QUEUED, result=None, priority=0):
+        now = time.time()
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "ruya": dream_text,
+            "status": status,
+            "yorum": result,
+            "partial": None,
+            "error": None,
+            "created_at": now,
+            "started_at": None,
+            "finished_at": now if status in (JOB_DONE, JOB_FAILED) else None,
+            "heartbeat_at": None, # Çalışan işin kirasının son yenilendiği an
+            "priority": priority, # Yeniden kuyruğa alınırken korunur
+            "attempts": 0, # İşin kaç kez çalıştırılmaya başlandığı
+            "subscribers": 1, # Bu işe bağlanan istek sayısı
+            "deliveries": 0, # Eski /check_interpretations üzerinden yapılan teslim sayısı
+            "version": 1
+        }
+        with self._lock:
+            self._purge_expired(now)
+            self._jobs[job["job_id"]] = job
+            if status in (JOB_DONE, JOB_FAILED):
+                self._finished_order.append((now, job["job_id"]))
+            else:
+                self._active_by_text[normalize_dream_text(dream_text)] = job["job_id"]
+            return self._public(job)
+
+    def get(self, job_id):
+        with self._lock:
+            self._purge_expired(time.time())
+            job = self._jobs.get(job_id)
+            return self._public(job) if job else None
+
+    def _release_text(self, job):
+        text_key = normalize_dream_text(job["ruya"])
+        if self._active_by_text.get(text_key) == job["job_id"]:
+            del self._active_by_text[text_key]
+
+    def attach(self, dream_text):
+        # Normalize metni aynı olan kuyruktaki/çalışan işe yeni bir abone ekler; böyle bir iş yoksa None döner.
+        with self._lock:
+            job = self._jobs.get(self._active_by_text.get(normalize_dream_text(dream_text)))
+            if job is None:
+                return None
+            job["subscribers"] += 1
+            return self._public(job)
+
+    def attach_or_create(self, dream_text, priority=0, before_create=None):
+        # (iş, yeni_mi): aktif işe abone olur, yoksa yeni iş oluşturur; ikisi tek kilit altında yapılır.
+        # before_create yeni iş oluşturulmadan hemen önce çağrılır (ör. kuyruk kapasitesi) ve hata yükselterek
+        # oluşturmayı engelleyebilir.
+        with self._lock:
+            job = self.attach(dream_text)
+            if job is not None:
+                return job, False
+            if before_create is not None:
+                before_create()
+            return self.create(dream_text, priority=priority), True
+
+    def mark_running(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job["status"] = JOB_RUNNING
+            job["started_at"] = job["heartbeat_at"] = time.time()
+            job["attempts"] += 1
+            job["version"] += 1
+            self._lock.notify_all()
+            return self._public(job)
+
+    def heartbeat(self, job_ids):
+        # Bu sürecin çalıştırdığı işlerin kirasını yeniler; bekleyenleri uyandırmamak için version artmaz.
+        now = time.time()
+        with self._lock:
+            for job_id in job_ids:
+                job = self._jobs.get(job_id)
+                if job is not None and job["status"] == JOB_RUNNING:
+                    job["heartbeat_at"] = now
+
+    def update_partial(self, job_id, partial_text):
+        # Çalışan işin o ana kadar hazır olan kısmi sonucunu yayınlar.
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["status"] != JOB_RUNNING:
+                return None
+            job["partial"] = partial_text
+            job["version"] += 1
+            self._lock.notify_all()
+            return self._public(job)
+
+    def _finish(self, job_id, status, result, error):
+        now = time.time()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job["status"] = status
+            job["yorum"] = result
+            job["error"] = error
+            job["finished_at"] = now
+            self._release_text(job)
+            self._finished_order.append((now, job_id))
+            job["version"] += 1
+            self._lock.notify_all()
+            return self._public(job)
+
+    def wait_for_change(self, job_id, since_version=0, timeout=30.0):
+        # İşin version değeri since_version'dan büyük olana kadar (veya zaman aşımına kadar) bekler.
+        # İş bitmişse hemen döner; iş yoksa None döner.
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while True:
+                job = self._jobs.get(job_id)
+                if job is None or job["version"] > since_version or job["status"] in (JOB_DONE, JOB_FAILED):
+                    return self._public(job) if job else None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return self._public(job)
+                self._lock.wait(remaining)
+
+    def mark_done(self, job_id, result):
+        return self._finish(job_id, JOB_DONE, result, None)
+
+    def mark_failed(self, job_id, error_message):
+        return self._finish(job_id, JOB_FAILED, None, error_message)
+
+    def take_undelivered(self, job_ids):
+        # Eski /check_interpretations uç noktası için: verilen işlerden bitenleri abone sayısı kadar teslim eder;
+        # böylece aynı işe bağlanan ikinci istemcinin sonucu ilkinin yoklamasıyla tükenmez.
+        with self._lock:
+            self._purge_expired(time.time())
+            candidates = [self._jobs[job_id] for job_id in job_ids if job_id in self._jobs]
+            taken = []
+            for job in candidates:
+                if job["status"] in (JOB_DONE, JOB_FAILED) and job["deliveries"] < job["subscribers"]:
+                    job["deliveries"] += 1
+                    taken.append(self._public(job))
+            return taken
+
+    def counts(self):
+        with self._lock:
+            result = collections.Counter(job["status"] for job in self._jobs.values())
+            return {status: result.get(status, 0) for status in (JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED)}
+
+
+# --- Rüya Kuyruğu ---
+class DreamQueueFull(Exception):
+    pass
+
+class DreamQueue:
+    """JobStore işlerini taşıyan öncelikli ve kapasitesi sınırlı üretici/tüketici kuyruğu.
+
+    submit() bekleyen işçileri hemen uyandırır; get() kuyruk boşken koşul değişkeninde bekler.
+    Küçük öncelik değeri önce işlenir, aynı öncelikte ekleme sırası korunur.
+    """
+
+    def __init__(self, store, maxsize=0):
+        self.store = store
+        self.maxsize = maxsize
+        self._heap = []
+        self._seq = itertools.count()
+        self._closed = False
+        self._not_empty = threading.Condition(threading.Lock())
+
+    def submit(self, dream_text, priority=0):
+        # (iş, yeni_mi): aynı metinli aktif işe abone olur ya da yeni işi oluşturup kuyruğa ekler.
+        # Kuyruk doluysa DreamQueueFull yükselir ve geride iş kaydı kalmaz.
+        def check_capacity():
+            if self.maxsize > 0 and len(self._heap) >= self.maxsize:
+                raise DreamQueueFull(f"Kuyruk dolu ({self.maxsize} öğe).")
+
+        with self._not_empty:
+            job, created = self.store.attach_or_create(dream_text, priority=priority, before_create=check_capacity)
+            if created:
+                heapq.heappush(self._heap, (priority, next(self._seq), job["job_id"]))
+                self._not_empty.notify()
+            return job, created
+
+    def get(self, timeout=None):
+        # Sıradaki işi çalışıyor olarak işaretleyip döner; kuyruk kapatılırsa veya zaman aşımı olursa None döner.
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._not_empty:
+                remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+                if not self._not_empty.wait_for(lambda: self._heap or self._closed, timeout=remaining):
+                    return None
+                if not self._heap:
+                    return None
+                _, _, job_id = heapq.heappop(self._heap)
+            job = self.store.mark_running(job_id)
+            if job is not None:
+                return job
+
+    def recover_stale(self, lease_timeout, max_attempts, error_message):
+        # Tek süreçte işçi thread'leri hataları yakaladığından sahipsiz kalan iş olmaz.
+        return [], []
+
+    def close(self):
+        with self._not_empty:
+            self._closed = True
+            self._not_empty.notify_all()
+
+    def __len__(self):
+        with self._not_empty:
+            return len(self._heap)
+
+
+# --- SQLite İş Deposu (aynı makinede birden çok süreç) ---
+SQLITE_JOB_COLUMNS = (
+    "job_id", "ruya", "status", "yorum", "partial", "error",
+    "created_at", "started_at", "finished_at", "heartbeat_at", "priority", "attempts",
+    "subscribers", "deliveries", "version"
+)
+# Eski veritabanlarına açılışta eklenen sütunlar
+SQLITE_ADDED_COLUMNS = {
+    "heartbeat_at": "REAL",
+    "priority": "INTEGER NOT NULL DEFAULT 0",
+    "attempts": "INTEGER NOT NULL DEFAULT 0",
+}
+
+class SQLiteJobStore:
+    """JobStore'un WAL modundaki SQLite üzerinde çalışan, süreçler arası paylaşılabilen sürümü.
+
+    Her thread kendi bağlantısını kullanır; durum değiştiren işlemler BEGIN IMMEDIATE ile
+    sıralanır. Aktif işlerin normalize metni üzerindeki kısmi benzersiz indeks, farklı süreçlerden
+    aynı anda gelen aynı rüyanın iki ayrı iş açmasını engeller. Süreçler arası bildirim
+    olmadığından wait_for_change poll_interval aralıklarıyla yoklar.
+    """
+
+    shared = True
+
+    def __init__(self, path, result_ttl=3600, poll_interval=0.2):
+        self.path = path
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        with self._transaction() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    ruya TEXT NOT NULL,
+                    text_key TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    yorum TEXT,
+                    partial TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    heartbeat_at REAL,
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    subscribers INTEGER NOT NULL DEFAULT 1,
+                    deliveries INTEGER NOT NULL DEFAULT 0,
+                    version INTEGER NOT NULL DEFAULT 1
+                )"""
+            )
+            existing_columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, definition in SQLITE_ADDED_COLUMNS.items():
+                if column not in existing_columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+            conn.execute(
+                f"CREATE UNIQUE INDEX IF NOT EXISTS jobs_active_text ON jobs(text_key) "
+                f"WHERE status IN ('{JOB_QUEUED}', '{JOB_RUNNING}')"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_finished ON jobs(finished_at) WHERE finished_at IS NOT NULL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS queue (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id TEXT NOT NULL,
+                    priority INTEGER NOT NULL DEFAULT 0
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS queue_order ON queue(priority, seq)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @staticmethod
+    def _row_to_job(row):
+        if row is None:
+            return None
+        job = dict(zip(SQLITE_JOB_COLUMNS, row))
+        job["yorum"] = json.loads(job["yorum"]) if job["yorum"] is not None else None
+        return job
+
+    def _select(self, conn, job_id):
+        row = conn.execute(f"SELECT {', '.join(SQLITE_JOB_COLUMNS)} FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row)
+
+    def _purge_expired(self, conn, now):
+        conn.execute("DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (now - self.result_ttl,))
+
+    def _insert(self, conn, dream_text, status, result, now, priority=0):
+        job_id = uuid.uuid4().hex
+        conn.execute(
+            "INSERT INTO jobs (job_id, ruya, text_key, status, yorum, created_at, finished_at, priority) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                job_id, dream_text, normalize_dream_text(dream_text), status,
+                json.dumps(result, ensure_ascii=False) if result is not None else None,
+                now, now if status in (JOB_DONE, JOB_FAILED) else None, priority
+            )
+        )
+        return self._select(conn, job_id)
+
+    def create(self, dream_text, status=JOB_QUEUED, result=None, priority=0):
+        now = time.time()
+        with self._transaction() as conn:
+            self._purge_expired(conn, now)
+            return self._insert(conn, dream_text, status, result, now, priority)
+
+    def get(self, job_id):
+        job = self._select(self._connect(), job_id)
+        if job is not None and job["finished_at"] is not None and time.time() - job["finished_at"] > self.result_ttl:
+            return None # Süresi dolmuş; bir sonraki yazma işleminde silinir
+        return job
+
+    def _attach(self, conn, dream_text):
+        row = conn.execute(
+            f"SELECT job_id FROM jobs WHERE text_key = ? AND status IN ('{JOB_QUEUED}', '{JOB_RUNNING}')",
+            (normalize_dream_text(dream_text),)
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE jobs SET subscribers = subscribers + 1 WHERE job_id = ?", (row[0],))
+        return self._select(conn, row[0])
+
+    def attach(self, dream_text):
+        with self._transaction() as conn:
+            return self._attach(conn, dream_text)
+
+    def _update(self, job_id, assignments, params, condition=""):
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                f"UPDATE jobs SET {assignments}, version = version + 1 WHERE job_id = ?{condition}",
+                (*params, job_id)
+            )
+            return self._select(conn, job_id) if cursor.rowcount else None
+
+    def mark_running(self, job_id):
+        now = time.time()
+        return self._update(job_id, "status = ?, started_at = ?, heartbeat_at = ?, attempts = attempts + 1", (JOB_RUNNING, now, now))
+
+    def heartbeat(self, job_ids):
+        if not job_ids:
+            return
+        with self._transaction() as conn:
+            conn.execute(
+                f"UPDATE jobs SET heartbeat_at = ? WHERE status = '{JOB_RUNNING}' AND job_id IN ({', '.join('?' * len(job_ids))})",
+                (time.time(), *job_ids)
+            )
+
+    def update_partial(self, job_id, partial_text):
+        return self._update(job_id, "partial = ?", (partial_text,), f" AND status = '{JOB_RUNNING}'")
+
+    def _finish(self, job_id, status, result, error):
+        return self._update(
+            job_id, "status = ?, yorum = ?, error = ?, finished_at = ?",
+            (status, json.dumps(result, ensure_ascii=False) if result is not None else None, error, time.time())
+        )
+
+    def mark_done(self, job_id, result):
+        return self._finish(job_id, JOB_DONE, result, None)
+
+    def mark_failed(self, job_id, error_message):
+        return self._finish(job_id, JOB_FAILED, None, error_message)
+
+    def wait_for_change(self, job_id, since_version=0, timeout=30.0):
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job["version"] > since_version or job["status"] in (JOB_DONE, JOB_FAILED):
+                return job
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return job
+            time.sleep(min(self.poll_interval, remaining))
+
+    def take_undelivered(self, job_ids):
+        with self._transaction() as conn:
+            self._purge_expired(conn, time.time())
+            ids = [row[0] for row in conn.execute(
+                f"SELECT job_id FROM jobs WHERE status IN ('{JOB_DONE}', '{JOB_FAILED}') "
+                f"AND deliveries < subscribers AND job_id IN ({', '.join('?' * len(job_ids))}) ORDER BY finished_at",
+                tuple(job_ids),
+            )]
+            taken = []
+            for job_id in ids:
+                conn.execute("UPDATE jobs SET deliveries = deliveries + 1 WHERE job_id = ?", (job_id,))
+                taken.append(self._select(conn, job_id))
+            return taken
+
+    def counts(self):
+        result = dict(self._connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {status: result.get(status, 0) for status in (JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED)}
+
+
+class SQLiteDreamQueue:
+    """DreamQueue'nun SQLiteJobStore ile aynı veritabanındaki tabloyu kullanan sürümü.
+
+    get() en küçük öncelikli (eşitlikte en eski) kaydı silip işi çalışıyor olarak işaretlemeyi tek bir
+    işlemde yapar; böylece farklı süreçlerdeki işçiler aynı işi iki kez alamaz ve kuyruktan alınıp
+    sahipsiz kalan iş olmaz. Kuyruk boşken yazma kilidi alınmaz; yalnızca okuma sorgusuyla yoklanır.
+    Aynı süreçteki submit() bekleyen işçileri hemen uyandırır, diğer süreçlerin işleri poll_interval
+    içinde görülür.
+    """
+
+    def __init__(self, store, maxsize=0):
+        self.store = store
+        self.maxsize = maxsize
+        self._closed = False
+        self._wakeup = threading.Condition()
+
+    def submit(self, dream_text, priority=0):
+        now = time.time()
+        with self.store._transaction() as conn:
+            job = self.store._attach(conn, dream_text)
+            if job is not None:
+                return job, False
+            if self.maxsize > 0 and conn.execute("SELECT COUNT(*) FROM queue").fetchone()[0] >= self.maxsize:
+                raise DreamQueueFull(f"Kuyruk dolu ({self.maxsize} öğe).")
+            self.store._purge_expired(conn, now)
+            job = self.store._insert(conn, dream_text, JOB_QUEUED, None, now, priority)
+            conn.execute("INSERT INTO queue (job_id, priority) VALUES (?, ?)", (job["job_id"], priority))
+        with self._wakeup:
+            self._wakeup.notify()
+        return job, True
+
+    def _pop(self):
+        # Boş kuyrukta BEGIN IMMEDIATE alınmaz; yazma kilidi submit_dream ve diğer işçilerle yarışmasın.
+        if self.store._connect().execute("SELECT 1 FROM queue LIMIT 1").fetchone() is None:
+            return None
+        now = time.time()
+        with self.store._transaction() as conn:
+            while True:
+                row = conn.execute("SELECT seq, job_id FROM queue ORDER BY priority, seq LIMIT 1").fetchone()
+                if row is None:
+                    return None
+                conn.execute("DELETE FROM queue WHERE seq = ?", (row[0],))
+                cursor = conn.execute(
+                    f"UPDATE jobs SET status = ?, started_at = ?, heartbeat_at = ?, attempts = attempts + 1, version = version + 1 "
+                    f"WHERE job_id = ? AND status = '{JOB_QUEUED}'",
+                    (JOB_RUNNING, now, now, row[1])
+                )
+                if cursor.rowcount:
+                    return self.store._select(conn, row[1])
+                # İş silinmiş veya süresi dolmuş; sıradaki kayda geçilir.
+
+    def recover_stale(self, lease_timeout, max_attempts, error_message):
+        """Kirası lease_timeout saniyedir yenilenmeyen çalışan işleri yeniden kuyruğa alır; max_attempts kez
+        başlatılmış olanları başarısız sayar. Kuyruk kaydı olmadan kalmış eski işler de kuyruğa eklenir.
+        (yeniden_kuyruğa_alınan, başarısız_sayılan) iş kimliği listelerini döner."""
+        now = time.time()
+        cutoff = now - lease_timeout
+        requeued, failed = [], []
+        with self.store._transaction() as conn:
+            stale = conn.execute(
+                f"SELECT job_id, priority, attempts FROM jobs WHERE status = '{JOB_RUNNING}' "
+                f"AND COALESCE(heartbeat_at, started_at, created_at) < ?",
+                (cutoff,)
+            ).fetchall()
+            for job_id, priority, attempts in stale:
+                if attempts >= max_attempts:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, error = ?, finished_at = ?, version = version + 1 WHERE job_id = ?",
+                        (JOB_FAILED, error_message, now, job_id)
+                    )
+                    failed.append(job_id)
+                else:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, partial = NULL, heartbeat_at = NULL, version = version + 1 WHERE job_id = ?",
+                        (JOB_QUEUED, job_id)
+                    )
+                    conn.execute("INSERT INTO queue (job_id, priority) VALUES (?, ?)", (job_id, priority))
+                    requeued.append(job_id)
+            orphaned = conn.execute(
+                f"SELECT job_id, priority FROM jobs WHERE status = '{JOB_QUEUED}' AND created_at < ? "
+                f"AND job_id NOT IN (SELECT job_id FROM queue)",
+                (cutoff,)
+            ).fetchall()
+            for job_id, priority in orphaned:
+                conn.execute("INSERT INTO queue (job_id, priority) VALUES (?, ?)", (job_id, priority))
+                requeued.append(job_id)
+        if requeued:
+            with self._wakeup:
+                self._wakeup.notify_all()
+        return requeued, failed
+
+    def get(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._closed:
+            item = self._pop()
+            if item is not None:
+                return item
+            remaining = self.store.poll_interval if deadline is None else deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            with self._wakeup:
+                self._wakeup.wait(min(self.store.poll_interval, remaining))
+        return None
+
+    def close(self):
+        # Yalnızca bu süreçteki bekleyenleri bırakır; kuyruktaki işler diğer işçiler için kalır.
+        with self._wakeup:
+            self._closed = True
+            self._wakeup.notify_all()
+
+    def __len__(self):
+        return self.store._connect().execute("SELECT COUNT(*) FROM queue").fetchone()[0]
+
+
+# --- Redis İş Deposu (birden çok makine) ---
+class RedisJobStore:
+    """JobStore'un Redis (veya uyumlu bir sunucu) üzerinde çalışan sürümü.
+
+    Her iş bir hash'te tutulur (alan değerleri JSON); aktif işlerin normalize metinleri bir hash'te,
+    biten işler bitiş zamanına göre sıralı bir kümede (TTL temizliği için) durur. Koşullu
+    güncellemeler WATCH/MULTI işlemleriyle yapılır.
+    """
+
+    shared = True
+
+    def __init__(self, client, result_ttl=3600, poll_interval=0.2, prefix="ruya"):
+        self.client = client
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self.prefix = prefix
+        self._active_key = f"{prefix}:active"
+        self._finished_key = f"{prefix}:finished"
+
+    def _job_key(self, job_id):
+        return f"{self.prefix}:job:{job_id}"
+
+    def _status_key(self, status):
+        return f"{self.prefix}:status:{status}"
+
+    @staticmethod
+    def _decode(raw):
+        if not raw:
+            return None
+        return {field: json.loads(value) for field, value in raw.items()}
+
+    def _purge_expired(self, now):
+        expired = self.client.zrangebyscore(self._finished_key, "-inf", now - self.result_ttl)
+        if not expired:
+            return
+        pipe = self.client.pipeline()
+        for job_id in expired:
+            pipe.delete(self._job_key(job_id))
+            pipe.srem(self._status_key(JOB_DONE), job_id)
+            pipe.srem(self._status_key(JOB_FAILED), job_id)
+        pipe.zrem(self._finished_key, *expired)
+        pipe.execute()
+
+    def _new_job(self, pipe, dream_text, status, result, now, priority=0):
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "ruya": dream_text,
+            "status": status,
+            "yorum": result,
+            "partial": None,
+            "error": None,
+            "created_at": now,
+            "started_at": None,
+            "finished_at": now if status in (JOB_DONE, JOB_FAILED) else None,
+            "heartbeat_at": None,
+            "priority": priority,
+            "attempts": 0,
+            "subscribers": 1,
+            "deliveries": 0,
+            "version": 1
+        }
+        pipe.hset(self._job_key(job["job_id"]), mapping={field: json.dumps(value, ensure_ascii=False) for field, value in job.items()})
+        pipe.sadd(self._status_key(status), job["job_id"])
+        if status in (JOB_DONE, JOB_FAILED):
+            pipe.zadd(self._finished_key, {job["job_id"]: now})
+        else:
+            pipe.hset(self._active_key, normalize_dream_text(dream_text), job["job_id"])
+        return job
+
+    def create(self, dream_text, status=JOB_QUEUED, result=None, priority=0):
+        now = time.time()
+        self._purge_expired(now)
+        pipe = self.client.pipeline()
+        job = self._new_job(pipe, dream_text, status, result, now, priority)
+        pipe.execute()
+        return job
+
+    def get(self, job_id):
+        return self._decode(self.client.hgetall(self._job_key(job_id)))
+
+    def _attach_or_create(self, dream_text, create=None, watch_keys=()):
+        # Aktif işe abone olur; yoksa ve create verilmişse create(pipe) ile yeni iş aynı MULTI içinde oluşturulur.
+        # create, WATCH altındaki ön kontrolleri (ör. kuyruk kapasitesi) MULTI'den önce yapıp iş kimliğini döner.
+        text_key = normalize_dream_text(dream_text)
+        outcome = {}
+
+        def attach_or_create(pipe):
+            outcome.clear()
+            job_id = pipe.hget(self._active_key, text_key)
+            if job_id and pipe.exists(self._job_key(job_id)):
+                pipe.multi()
+                pipe.hincrby(self._job_key(job_id), "subscribers", 1)
+                outcome["job_id"], outcome["created"] = job_id, False
+            elif create is not None:
+                outcome["job_id"] = create(pipe)
+                outcome["created"] = True
+
+        self.client.transaction(attach_or_create, self._active_key, *watch_keys)
+        if not outcome:
+            return None, False
+        return self.get(outcome["job_id"]), outcome["created"]
+
+    def attach(self, dream_text):
+        return self._attach_or_create(dream_text)[0]
+
+    def _update(self, job_id, changes, required_status=None):
+        key = self._job_key(job_id)
+        updated = {}
+
+        def apply(pipe):
+            updated.clear()
+            job = self._decode(pipe.hgetall(key))
+            if job is None or (required_status is not None and job["status"] != required_status):
+                return
+            text_key = normalize_dream_text(job["ruya"])
+            active_job_id = pipe.hget(self._active_key, text_key)
+            pipe.multi()
+            pipe.hset(key, mapping={field: json.dumps(value, ensure_ascii=False) for field, value in changes.items()})
+            pipe.hincrby(key, "version", 1)
+            new_status = changes.get("status", job["status"])
+            if new_status != job["status"]:
+                pipe.smove(self._status_key(job["status"]), self._status_key(new_status), job_id)
+            if new_status in (JOB_DONE, JOB_FAILED):
+                pipe.zadd(self._finished_key, {job_id: changes["finished_at"]})
+                if active_job_id == job_id:
+                    pipe.hdel(self._active_key, text_key)
+            updated["ok"] = True
+
+        self.client.transaction(apply, key, self._active_key)
+        return self.get(job_id) if updated else None
+
+    def heartbeat(self, job_ids):
+        if not job_ids:
+            return
+        now = json.dumps(time.time())
+        pipe = self.client.pipeline()
+        for job_id in job_ids:
+            pipe.hset(self._job_key(job_id), "heartbeat_at", now)
+        pipe.execute()
+
+    def update_partial(self, job_id, partial_text):
+        return self._update(job_id, {"partial": partial_text}, required_status=JOB_RUNNING)
+
+    def mark_done(self, job_id, result):
+        return self._update(job_id, {"status": JOB_DONE, "yorum": result, "error": None, "finished_at": time.time()})
+
+    def mark_failed(self, job_id, error_message):
+        return self._update(job_id, {"status": JOB_FAILED, "yorum": None, "error": error_message, "finished_at": time.time()})
+
+    def wait_for_change(self, job_id, since_version=0, timeout=30.0):
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job["version"] > since_version or job["status"] in (JOB_DONE, JOB_FAILED):
+                return job
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return job
+            time.sleep(min(self.poll_interval, remaining))
+
+    def take_undelivered(self, job_ids):
+        self._purge_expired(time.time())
+        taken = []
+        for job_id in job_ids:
+            key = self._job_key(job_id)
+
+            def deliver(pipe):
+                job = self._decode(pipe.hgetall(key))
+                if job is None or job["status"] not in (JOB_DONE, JOB_FAILED) or job["deliveries"] >= job["subscribers"]:
+                    return None
+                pipe.multi()
+                pipe.hincrby(key, "deliveries", 1)
+                job["deliveries"] += 1
+                return job
+
+            job = self.client.transaction(deliver, key, value_from_callable=True)
+            if job is not None:
+                taken.append(job)
+        return taken
+
+    def counts(self):
+        pipe = self.client.pipeline()
+        statuses = (JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED)
+        for status in statuses:
+            pipe.scard(self._status_key(status))
+        return dict(zip(statuses, pipe.execute()))
+
+
+# Kuyruğun başındaki işi alıp aynı anda çalışıyor olarak işaretler (iş hash'indeki değerler JSON'dur).
+REDIS_CLAIM_SCRIPT = """
+local popped = redis.call('ZPOPMIN', KEYS[1])
+if #popped == 0 then
+    return false
+end
+local job_id = popped[1]
+local key = ARGV[1] .. job_id
+if redis.call('HGET', key, 'status') ~= ARGV[2] then
+    return {job_id, 0}
+end
+redis.call('HSET', key, 'status', ARGV[3], 'started_at', ARGV[4], 'heartbeat_at', ARGV[4])
+redis.call('HINCRBY', key, 'attempts', 1)
+redis.call('HINCRBY', key, 'version', 1)
+redis.call('SMOVE', KEYS[2], KEYS[3], job_id)
+return {job_id, 1}
+"""
+
+REDIS_NOTIFY_MAX_TOKENS = 1000
+REDIS_BLOCK_SECONDS = 1.0
+
+class RedisDreamQueue:
+    """DreamQueue'nun Redis sıralı kümesi üzerindeki sürümü.
+
+    Puan öncelik * 1e12 + sıra numarasıdır; küçük öncelik önce, eşitlikte ekleme sırası korunur.
+    İş kuyruktan bir Lua betiğiyle alınıp aynı adımda çalışıyor olarak işaretlenir. Kuyruğa eklenen her
+    iş bildirim listesine bir işaret bırakır; boş kuyrukta işçiler bu listede BLPOP ile bekler (BZPOPMIN
+    işi çalışıyor olarak işaretlemeden kuyruktan alacağından, çöken işçi işi kaybettirirdi).
+    """
+
+    def __init__(self, store, maxsize=0):
+        self.store = store
+        self.client = store.client
+        self.maxsize = maxsize
+        self._key = f"{store.prefix}:queue"
+        self._seq_key = f"{store.prefix}:queue_seq"
+        self._notify_key = f"{store.prefix}:queue_notify"
+        self._claim = self.client.register_script(REDIS_CLAIM_SCRIPT)
+        self._closed = False
+
+    def _score(self, priority):
+        return priority * 1e12 + self.client.incr(self._seq_key)
+
+    def _notify(self, pipe):
+        # Bekleyen bir işçiyi uyandırır; kimse beklemiyorsa işaretler birikir, liste sınırlı tutulur.
+        pipe.lpush(self._notify_key, 1)
+        pipe.ltrim(self._notify_key, 0, REDIS_NOTIFY_MAX_TOKENS - 1)
+
+    def submit(self, dream_text, priority=0):
+        self.store._purge_expired(time.time())
+        score = self._score(priority)
+
+        def create(pipe):
+            if self.maxsize > 0 and pipe.zcard(self._key) >= self.maxsize:
+                raise DreamQueueFull(f"Kuyruk dolu ({self.maxsize} öğe).")
+            pipe.multi()
+            job = self.store._new_job(pipe, dream_text, JOB_QUEUED, None, time.time(), priority)
+            pipe.zadd(self._key, {job["job_id"]: score})
+            self._notify(pipe)
+            return job["job_id"]
+
+        return self.store._attach_or_create(dream_text, create, watch_keys=(self._key,))
+
+    def get(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._closed:
+            claimed = self._claim(
+                keys=[self._key, self.store._status_key(JOB_QUEUED), self.store._status_key(JOB_RUNNING)],
+                args=[self.store._job_key(""), json.dumps(JOB_QUEUED), json.dumps(JOB_RUNNING), json.dumps(time.time())]
+            )
+            if claimed:
+                if int(claimed[1]):
+                    return self.store.get(claimed[0])
+                continue # İş silinmiş veya süresi dolmuş; sıradakine geçilir
+            remaining = REDIS_BLOCK_SECONDS if deadline is None else deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            # Yeni iş eklenene kadar sunucu tarafında beklenir; close() en geç REDIS_BLOCK_SECONDS içinde fark edilir.
+            self.client.blpop([self._notify_key], timeout=min(REDIS_BLOCK_SECONDS, remaining))
+        return None
+
+    def recover_stale(self, lease_timeout, max_attempts, error_message):
+        # SQLiteDreamQueue.recover_stale ile aynı; her iş kendi WATCH/MULTI işlemiyle yeniden kuyruğa alınır.
+        now = time.time()
+        cutoff = now - lease_timeout
+        requeued, failed = [], []
+        for job_id in self.client.smembers(self.store._status_key(JOB_RUNNING)):
+            key = self.store._job_key(job_id)
+            seq = self.client.incr(self._seq_key)
+
+            def requeue(pipe):
+                job = self.store._decode(pipe.hgetall(key))
+                if job is None or job["status"] != JOB_RUNNING:
+                    return None
+                # Yükseltmeden önce oluşturulmuş işlerde kira alanları yoktur.
+                if (job.get("heartbeat_at") or job["started_at"] or job["created_at"]) >= cutoff:
+                    return None
+                if job.get("attempts", 0) >= max_attempts:
+                    return JOB_FAILED
+                pipe.multi()
+                pipe.hset(key, mapping={"status": json.dumps(JOB_QUEUED), "partial": "null", "heartbeat_at": "null"})
+                pipe.hincrby(key, "version", 1)
+                pipe.smove(self.store._status_key(JOB_RUNNING), self.store._status_key(JOB_QUEUED), job_id)
+                pipe.zadd(self._key, {job_id: job.get("priority", 0) * 1e12 + seq})
+                self._notify(pipe)
+                return JOB_QUEUED
+
+            outcome = self.client.transaction(requeue, key, value_from_callable=True)
+            if outcome == JOB_QUEUED:
+                requeued.append(job_id)
+            elif outcome == JOB_FAILED and self.store.mark_failed(job_id, error_message) is not None:
+                failed.append(job_id)
+        for job_id in self.client.smembers(self.store._status_key(JOB_QUEUED)):
+            job = self.store.get(job_id)
+            if job is not None and job["status"] == JOB_QUEUED and job["created_at"] < cutoff \
+                    and self.client.zscore(self._key, job_id) is None:
+                pipe = self.client.pipeline()
+                pipe.zadd(self._key, {job_id: self._score(job.get("priority", 0))}, nx=True)
+                self._notify(pipe)
+                pipe.execute()
+                requeued.append(job_id)
+        return requeued, failed
+
+    def close(self):
+        self._closed = True
+
+    def __len__(self):
+        return self.client.zcard(self._key)
+
+
+def open_job_backend(url="memory", result_ttl=3600, maxsize=0, poll_interval=0.2):
+    """url'ye göre (iş_deposu, kuyruk) çiftini oluşturur: 'memory', 'sqlite:///yol' veya 'redis://...'."""
+    if not url or url == "memory":
+        store = JobStore(result_ttl=result_ttl)
+        return store, DreamQueue(store, maxsize=maxsize)
+    scheme = urlparse(url).scheme
+    if scheme == "sqlite":
+        path = url[len("sqlite:///"):]
+        if not path:
+            raise ValueError(f"SQLite iş deposu için dosya yolu gerekli: {url}")
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        store = SQLiteJobStore(path, result_ttl=result_ttl, poll_interval=poll_interval)
+        return store, SQLiteDreamQueue(store, maxsize=maxsize)
+    if scheme in ("redis", "rediss"):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("Redis iş deposu için 'redis' paketi gerekli (pip install redis).") from e
+        store = RedisJobStore(redis.Redis.from_url(url, decode_responses=True), result_ttl=result_ttl, poll_interval=poll_interval)
+        return store, RedisDreamQueue(store, maxsize=maxsize)
+    raise ValueError(f"Bilinmeyen iş deposu adresi: {url}")
@@ -0,0 +1,1145 @@
+# -*- coding: utf-8 -*-
+"""Rüya tabiri koleksiyonlarının (ChromaDB) oluşturulması ve güncellenmesi.
+
+Sunucu (app.py) bu modüldeki artımlı yükleme fonksiyonlarını kullanır. Modül ayrıca sunucudan
+bağımsız, çevrimdışı bir toplu indeks oluşturucu olarak çalıştırılabilir:
+
+    python ruya_index.py                      # tüm MODEL_CONFIG koleksiyonlarını paralel günceller
+    python ruya_index.py --models GIST DistilUSE --workers 2 --encode-batch-size 512
+    python ruya_index.py --full               # koleksiyonları sıfırdan oluşturur
+    python ruya_index.py --compare-layouts    # per_model ve shared Chroma düzenlerini karşılaştırır
+    python ruya_index.py --export-numpy       # koleksiyonları gömülü NumPy indeksine aktarır
+    python ruya_index.py --migrate-space      # eski (l2) koleksiyonları kosinüs uzayına taşır
+"""
+import os
+import sys
+import time
+import json
+import hashlib
+import math
+import re
+import unicodedata
+import logging
+import threading
+import argparse
+import importlib.util
+import concurrent.futures
+import multiprocessing
+import mmap
+import shutil
+import random
+
+import numpy as np
+
+from chromadb.config import DEFAULT_TENANT, DEFAULT_DATABASE, Settings
+from chromadb import PersistentClient
+from chromadb.utils import embedding_functions
+from openpyxl import load_workbook
+
+CHROMA_DB_BASE_PATH = os.getenv('CHROMA_DB_PATH', './chroma_db_data')
+EXCEL_FILE_PATH = os.getenv('EXCEL_FILE_PATH', './data/son_guncellenmis_dosya.xlsx')
+
+MODEL_CONFIG = {
+    "DistilUSE": {
+        "model_name": "distiluse-base-multilingual-cased-v1",
+        "collection_name": "RuyaTabirleri_distiluse"
+    },
+    "BERT-Turkish": {
+        "model_name": "emrecan/bert-base-turkish-cased-mean-nli-stsb-tr",
+        "collection_name": "RuyaTabirleri_bert_turkish"
+    },
+    "PubMedBERT": {
+        "model_name": "NeuML/pubmedbert-base-embeddings",
+        "collection_name": "RuyaTabirleri_pubmed"
+    },
+    "GIST": {
+        "model_name": "avsolatorio/GIST-small-Embedding-v0",
+        "collection_name": "RuyaTabirleri_gist"
+    }
+}
+
+# "per_model": her koleksiyon kendi dizininde ayrı bir PersistentClient ile açılır (eski düzen).
+# "shared": tüm koleksiyonlar tek bir dizinde, tek bir istemci ve veritabanı üzerinden açılır.
+CHROMA_LAYOUT = os.getenv('CHROMA_LAYOUT', 'per_model').lower()
+SHARED_DB_DIRNAME = "shared"
+
+# HNSW parametreleri; ortam değişkeni verilmezse Chroma varsayılanları kullanılır.
+# Koleksiyon bazında MODEL_CONFIG[...]["hnsw"] ile ezilebilir. ef_search mevcut koleksiyonlara açılışta uygulanır;
+# M ve ef_construction ise yalnızca koleksiyon oluşturulurken (örn. --full ile) uygulanabilir.
+HNSW_DEFAULTS = {
+    "M": os.getenv('CHROMA_HNSW_M'),
+    "ef_construction": os.getenv('CHROMA_HNSW_EF_CONSTRUCTION'),
+    "ef_search": os.getenv('CHROMA_HNSW_EF_SEARCH'),
+}
+HNSW_METADATA_KEYS = {"M": "hnsw:M", "ef_construction": "hnsw:construction_ef", "ef_search": "hnsw:search_ef"}
+# Metadata anahtarlarının Chroma 1.x koleksiyon yapılandırmasındaki (configuration_json["hnsw"]) karşılıkları
+HNSW_CONFIGURATION_KEYS = {"hnsw:M": "max_neighbors", "hnsw:construction_ef": "ef_construction", "hnsw:search_ef": "ef_search"}
+# Belge vektörleri normalize edilmeden saklandığından koleksiyonlar kosinüs uzayında tutulur; Chroma'nın varsayılanı
+# olan kare L2 mesafesi modeller arasında karşılaştırılabilir bir benzerliğe çevrilemez.
+CHROMA_DISTANCE_SPACE = "cosine"
+
+# Embedding modellerinin CPU çalışma zamanı: "torch" (FP32, varsayılan), "torch-int8" (PyTorch dinamik int8),
+# "onnx" (ONNX Runtime FP32) veya "onnx-int8" (ONNX Runtime dinamik int8). Koleksiyonlardaki belge vektörleri
+# değişmez; yalnızca sorgu embedding'leri seçilen çalışma zamanıyla hesaplanır.
+EMBEDDING_BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'torch').lower()
+EMBEDDING_THREADS = int(os.getenv('EMBEDDING_THREADS', '0')) # 0 = çalışma zamanının varsayılanı
+EMBEDDING_ONNX_PATH = os.getenv('EMBEDDING_ONNX_PATH', './cache/onnx')
+EMBEDDING_ONNX_QUANTIZATION = os.getenv('EMBEDDING_ONNX_QUANTIZATION', 'avx2') # arm64, avx2, avx512 veya avx512_vnni
+# requirements.txt dışında kalan, çalışma zamanına özgü paketler (requirements-onnx.txt).
+EMBEDDING_BACKEND_MODULES = {"onnx": ("onnxruntime", "optimum"), "onnx-int8": ("onnxruntime", "optimum")}
+
+_chroma_clients = {}
+_chroma_clients_lock = threading.Lock()
+
+def collection_db_path(config, layout=None):
+    if (layout or CHROMA_LAYOUT) == "shared":
+        return os.path.join(CHROMA_DB_BASE_PATH, SHARED_DB_DIRNAME)
+    return os.path.join(CHROMA_DB_BASE_PATH, config['collection_name'])
+
+def hnsw_metadata(config):
+    params = {key: value for key, value in HNSW_DEFAULTS.items() if value}
+    params.update(config.get("hnsw", {}))
+    metadata = {HNSW_METADATA_KEYS[key]: int(value) for key, value in params.items()}
+    metadata["hnsw:space"] = CHROMA_DISTANCE_SPACE
+    return metadata
+
+def collection_distance_space(chroma_collection):
+    # Chroma 1.x uzayı koleksiyon yapılandırmasında tutar (metadata yalnızca oluştururken verilenleri içerir);
+    # yapılandırması olmayan nesneler (NumpyIndex) için metadata'ya bakılır.
+    configuration = getattr(chroma_collection, 'configuration_json', None) or {}
+    for index_type in ("hnsw", "spann"):
+        space = (configuration.get(index_type) or {}).get("space")
+        if space:
+            return space
+    return (getattr(chroma_collection, 'metadata', None) or {}).get('hnsw:space', 'l2')
+
+def apply_hnsw_settings(chroma_collection, collection_metadata):
+    # Chroma metadata'daki HNSW ayarlarını yalnızca koleksiyon oluşturulurken okur. ef_search sonradan
+    # değiştirilebildiğinden açılışta yapılandırmaya yazılır; M ve ef_construction için yalnızca uyarılır.
+    hnsw = (getattr(chroma_collection, 'configuration_json', None) or {}).get("hnsw")
+    if not hnsw or not collection_metadata:
+        return
+    for metadata_key, configuration_key in HNSW_CONFIGURATION_KEYS.items():
+        wanted = collection_metadata.get(metadata_key)
+        current = hnsw.get(configuration_key)
+        if wanted is None or current is None or int(wanted) == int(current):
+            continue
+        if configuration_key == "ef_search":
+            chroma_collection.modify(configuration={"hnsw": {"ef_search": int(wanted)}})
+            logging.info(f"'{chroma_collection.name}' koleksiyonunun ef_search değeri {current} -> {wanted} olarak güncellendi.")
+        else:
+            logging.warning(
+                f"'{chroma_collection.name}' koleksiyonunun {configuration_key} değeri {current}; istenen {wanted} yalnızca "
+                "koleksiyon yeniden oluşturulduğunda (ruya_index.py --full) uygulanır."
+            )
+
+def migrate_distance_space(chroma_client, name, embedding_function, collection_metadata=None, page_size=5000):
+    """Koleksiyonu vektörleri yeniden embed etmeden CHROMA_DISTANCE_SPACE uzayına taşır (ruya_index.py --migrate-space).
+
+    Mesafe uzayı koleksiyon oluşturulduktan sonra değiştirilemediğinden vektörler yeni bir koleksiyona kopyalanır.
+    Adımlar: kopyala -> eskiyi kenara al (yeniden adlandır) -> kopyayı asıl ada taşı -> eskiyi sil. Her adımda asıl
+    veri en az bir koleksiyonda durur; yarıda kalan taşıma komut yeniden çalıştırıldığında kaldığı yerden sürer.
+    Taşınan koleksiyonu döner.
+    """
+    existing = {collection.name: collection for collection in chroma_client.list_collections()}
+    old_names = [n for n in existing if n.startswith(f"{name}__") and n.endswith("_old")]
+    copy_name = f"{name}__{CHROMA_DISTANCE_SPACE}"
+    if name not in existing:
+        if copy_name not in existing or not old_names:
+            raise RuntimeError(f"'{name}' koleksiyonu bulunamadı; taşınacak veri yok.")
+        # Eski koleksiyon kenara alındıktan sonra kesilmiş: kopya eksiksizdir, yalnızca yerine konması kalmış.
+        logging.info(f"'{name}' için yarım kalmış taşıma sürdürülüyor.")
+        chroma_client.get_collection(copy_name, embedding_function=None).modify(name=name)
+    else:
+        chroma_collection = chroma_client.get_collection(name, embedding_function=embedding_function)
+        space = collection_distance_space(chroma_collection)
+        if space != CHROMA_DISTANCE_SPACE:
+            old_name = f"{name}__{space}_old"
+            total = chroma_collection.count()
+            logging.info(f"'{name}' koleksiyonu '{space}' uzayından '{CHROMA_DISTANCE_SPACE}' uzayına taşınıyor ({total} öğe)...")
+            started = time.perf_counter()
+            if copy_name in existing:
+                chroma_client.delete_collection(copy_name) # Kopyalama sırasında kesilmiş önceki taşımadan
+            target = chroma_client.create_collection(name=copy_name, embedding_function=embedding_function, metadata=collection_metadata)
+            for offset in range(0, total, page_size):
+                page = chroma_collection.get(limit=page_size, offset=offset, include=['embeddings', 'documents', 'metadatas'])
+                target.add(ids=page['ids'], embeddings=page['embeddings'], documents=page['documents'], metadatas=page['metadatas'])
+            chroma_collection.modify(name=old_name)
+            target.modify(name=name)
+            old_names.append(old_name)
+            logging.info(f"'{name}' koleksiyonu {time.perf_counter() - started:.1f} sn'de '{CHROMA_DISTANCE_SPACE}' uzayına taşındı.")
+    for old_name in old_names:
+        chroma_client.delete_collection(old_name)
+    return chroma_client.get_collection(name, embedding_function=embedding_function)
+
+def get_chroma_client(chroma_db_path):
+    # Aynı dizin için tek bir PersistentClient paylaşılır (paylaşımlı düzende dört koleksiyon tek istemci kullanır).
+    with _chroma_clients_lock:
+        chroma_client = _chroma_clients.get(chroma_db_path)
+        if chroma_client is None:
+            chroma_client = PersistentClient(
+                path=chroma_db_path,
+                settings=Settings(),
+                tenant=DEFAULT_TENANT,
+                database=DEFAULT_DATABASE
+            )
+            _chroma_clients[chroma_db_path] = chroma_client
+        return chroma_client
+
+def create_chroma_client(collection_name, embedding_function, chroma_db_path, collection_metadata=None):
+    chroma_client = get_chroma_client(chroma_db_path)
+    collection_metadata = collection_metadata or {"hnsw:space": CHROMA_DISTANCE_SPACE}
+    full_collection_name = f"{collection_name}"
+    existing = [collection.name for collection in chroma_client.list_collections()]
+    if full_collection_name not in existing and f"{full_collection_name}__{CHROMA_DISTANCE_SPACE}" in existing:
+        # Boş bir koleksiyon oluşturulursa tüm derlem baştan embed edilirdi; taşıma tamamlanmalı.
+        raise RuntimeError(
+            f"'{full_collection_name}' koleksiyonunun mesafe uzayı taşıması yarıda kalmış; "
+            "'python ruya_index.py --migrate-space' ile tamamlayın."
+        )
+    chroma_collection = chroma_client.get_or_create_collection(
+        name=full_collection_name,
+        embedding_function=embedding_function,
+        metadata=collection_metadata
+    )
+    space = collection_distance_space(chroma_collection)
+    if space != CHROMA_DISTANCE_SPACE:
+        logging.warning(
+            f"'{full_collection_name}' koleksiyonu '{space}' uzayında; modeller arası benzerlikler karşılaştırılamaz. "
+            f"'{CHROMA_DISTANCE_SPACE}' uzayına taşımak için: python ruya_index.py --migrate-space"
+        )
+    apply_hnsw_settings(chroma_collection, collection_metadata)
+    logging.info(f"ChromaDB istemcisi ve koleksiyon '{full_collection_name}' hazırlandı/yüklendi. Path: {chroma_db_path}")
+    return chroma_client, chroma_collection
+
+def row_content_id(ruya, yorum):
+    # Satırın içeriğinden türetilen kararlı kimlik; satır sırası değişse de aynı kalır.
+    return hashlib.sha1(f"{ruya}\x1f{yorum}".encode("utf-8")).hexdigest()
+
+def file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def manifest_path_for(collection_name, chroma_db_path):
+    return os.path.join(chroma_db_path, f"{collection_name}.manifest.json")
+
+def read_manifest(collection_name, chroma_db_path):
+    try:
+        with open(manifest_path_for(collection_name, chroma_db_path), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def write_manifest(collection_name, chroma_db_path, source_sha256, ids):
+    path = manifest_path_for(collection_name, chroma_db_path)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"source_sha256": source_sha256, "ids": sorted(ids), "updated_at": time.time()}, f)
+    os.replace(tmp_path, path)
+
+def iter_excel_rows(file_path):
+    # Excel dosyasını salt okunur modda satır satır okur; tüm tabloyu belleğe almaz.
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(cell).strip() if cell is not None else "" for cell in next(rows, ())]
+        if 'Rüya' not in header or 'Yorum' not in header:
+            raise ValueError("Excel dosyasında 'Rüya' ve 'Yorum' sütunları olmalı.")
+        ruya_index, yorum_index = header.index('Rüya'), header.index('Yorum')
+        for row in rows:
+            ruya = row[ruya_index] if ruya_index < len(row) else None
+            yorum = row[yorum_index] if yorum_index < len(row) else None
+            if ruya is None or not str(ruya).strip():
+                continue
+            yield str(ruya), "" if yorum is None else str(yorum)
+    finally:
+        workbook.close()
+
+def read_excel_rows(file_path):
+    # { içerik_kimliği: (rüya, yorum) } döner; boş rüyalar atlanır, birebir aynı satırlar tek kayda iner.
+    return {row_content_id(ruya, yorum): (ruya, yorum) for ruya, yorum in iter_excel_rows(file_path)}
+
+def plan_index_sync(chroma_collection, collection_name, chroma_db_path, rows):
+    # Manifest ile Excel satırlarını karşılaştırıp (eklenecek, silinecek) kimlik listelerini döner.
+    manifest = read_manifest(collection_name, chroma_db_path)
+    if manifest and len(manifest.get("ids", [])) == chroma_collection.count():
+        indexed_ids = set(manifest["ids"])
+    else:
+        # Manifest yoksa/tutarsızsa koleksiyondaki kimlikler esas alınır (eski konumsal kimlikler de böylece temizlenir).
+        indexed_ids = set(chroma_collection.get(include=[])['ids'])
+    ids_to_add = [row_id for row_id in rows if row_id not in indexed_ids]
+    ids_to_delete = [row_id for row_id in indexed_ids if row_id not in rows]
+    return ids_to_add, ids_to_delete
+
+def is_index_current(chroma_collection, collection_name, chroma_db_path, source_sha256):
+    manifest = read_manifest(collection_name, chroma_db_path)
+    return bool(manifest) and manifest.get("source_sha256") == source_sha256 \
+        and len(manifest.get("ids", [])) == chroma_collection.count()
+
+def load_excel_to_chromadb(collection_name, sentence_transformer_model, chroma_db_path, file_path, batch_size=4000, embedding_function=None, collection_metadata=None):
+    # Artımlı yükleme: yalnızca yeni/değişen satırlar embed edilir, Excel'den silinen satırlar koleksiyondan kaldırılır.
+    logging.info(f"Excel dosyasından '{file_path}' ChromaDB'ye '{collection_name}' yükleniyor (batch_size={batch_size})....")
+    try:
+        if embedding_function is None:
+            embedding_function = SentenceEmbeddingFunction(sentence_transformer_model)
+        chroma_client, chroma_collection = create_chroma_client(
+            collection_name, embedding_function, chroma_db_path, collection_metadata
+        )
+
+        source_sha256 = file_sha256(file_path)
+        if is_index_current(chroma_collection, collection_name, chroma_db_path, source_sha256):
+            logging.info(f"'{collection_name}' koleksiyonu zaten güncel ({chroma_collection.count()} öğe), Excel değişmemiş.")
+            return chroma_client, chroma_collection
+
+        rows = read_excel_rows(file_path)
+        ids_to_add, ids_to_delete = plan_index_sync(chroma_collection, collection_name, chroma_db_path, rows)
+        logging.info(f"'{collection_name}': {len(rows)} satır, {len(ids_to_add)} yeni/değişen, {len(ids_to_delete)} silinecek.")
+
+        for i in range(0, len(ids_to_delete), batch_size):
+            chroma_collection.delete(ids=ids_to_delete[i:i + batch_size])
+
+        # Sorgular nicemlenmiş bir çalışma zamanıyla hesaplansa da belgeler FP32 modelle embed edilir.
+        document_function = embedding_function.document_function() if hasattr(embedding_function, "document_function") else embedding_function
+        for i in range(0, len(ids_to_add), batch_size):
+            batch_ids = ids_to_add[i:i + batch_size]
+            logging.info(f"  Batch {i // batch_size + 1}: {len(batch_ids)} öğe ekleniyor...")
+            documents = [rows[row_id][0] for row_id in batch_ids]
+            chroma_collection.upsert(
+                ids=batch_ids,
+                embeddings=document_function(documents),
+                documents=documents,
+                metadatas=[{'yorum': rows[row_id][1]} for row_id in batch_ids]
+            )
+            logging.info(f"  Batch {i // batch_size + 1} tamamlandı.")
+
+        write_manifest(collection_name, chroma_db_path, source_sha256, rows.keys())
+        final_count = chroma_collection.count()
+        logging.info(f"'{collection_name}' koleksiyonunda toplam {final_count} öğe var.")
+        if final_count != len(rows):
+            logging.warning(f"DİKKAT: Koleksiyondaki öğe sayısı ({final_count}) Excel'deki benzersiz satır sayısıyla ({len(rows)}) eşleşmiyor!")
+        return chroma_client, chroma_collection
+    except FileNotFoundError:
+        logging.error(f"Excel dosyası bulunamadı: {file_path}")
+        raise
+    except Exception as e:
+        logging.error(f"Excel yüklenirken hata oluştu: {e}")
+        raise
+
+def load_existing_chromadb(collection_name, sentence_transformer_model, chroma_db_path, embedding_function=None, collection_metadata=None):
+    logging.info(f"Mevcut ChromaDB koleksiyonu '{collection_name}' yükleniyor...")
+    if embedding_function is None:
+        embedding_function = SentenceEmbeddingFunction(sentence_transformer_model)
+    chroma_client, chroma_collection = create_chroma_client(
+        collection_name, embedding_function, chroma_db_path, collection_metadata
+    )
+    count = chroma_collection.count()
+    if count == 0:
+        logging.warning(f"UYARI: Koleksiyon '{collection_name}' boş! Excel yüklemesi denenmeli.")
+    logging.info(f"Mevcut koleksiyon '{collection_name}' yüklendi: {count} öğe.")
+    return chroma_client, chroma_collection
+
+# --- Embedding Çalışma Zamanları (FP32 / int8 / ONNX) ---
+class SentenceEmbeddingFunction(embedding_functions.SentenceTransformerEmbeddingFunction):
+    """Bir SentenceTransformer modelini Chroma embedding fonksiyonu olarak sarar.
+
+    Chroma'nın sınıf düzeyindeki önbelleği modelleri yalnızca ada göre tuttuğundan aynı modelin FP32 ve
+    nicemlenmiş sürümleri yan yana yüklenemez; bu sınıf modeli o önbelleğe koymaz (boşaltılan modeller de
+    böylece bellekte kalmaz). Koleksiyon yapılandırmasıyla çakışmaması için adı 'sentence_transformer'dır.
+
+    Chroma koleksiyonu açarken ve is_legacy() içinde fonksiyonu build_from_config ile yeniden kurar. Sınıf bu
+    adla kaydedildiğinden o kopyalar model yüklemez; model verilmemişse ilk çağrıda FP32 olarak yüklenir.
+    get_config() her zaman belge vektörlerini üreten FP32 modeli tarif eder.
+    """
+
+    def __init__(self, model_name, model=None, backend="torch", normalize_embeddings=False):
+        self.model_name = model_name
+        self.device = "cpu"
+        self.normalize_embeddings = normalize_embeddings
+        self.kwargs = {}
+        self.backend = backend
+        self._model = model
+        self._model_lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+                    self._model = SentenceTransformer(self.model_name, device=self.device)
+        return self._model
+
+    def __call__(self, input):
+        embeddings = self.model.encode(list(input), convert_to_numpy=True, normalize_embeddings=self.normalize_embeddings)
+        return [np.array(embedding, dtype=np.float32) for embedding in embeddings]
+
+    def is_legacy(self):
+        return False
+
+    @staticmethod
+    def build_from_config(config):
+        return SentenceEmbeddingFunction(config["model_name"], normalize_embeddings=config.get("normalize_embeddings", False))
+
+    def release(self):
+        # Model bırakılır; Chroma'nın sınıf önbelleğinde aynı adla bir kopya kaldıysa o da atılır ki bellek gerçekten boşalsın.
+        with self._model_lock:
+            self._model = None
+        embedding_functions.SentenceTransformerEmbeddingFunction.models.pop(self.model_name, None)
+
+    def document_function(self):
+        # Belge vektörleri her zaman FP32 modelle üretilir; nicemlenmiş/ONNX çalışma zamanları yalnızca sorgular içindir.
+        if self.backend == "torch":
+            return self
+        return SentenceEmbeddingFunction(self.model_name, normalize_embeddings=self.normalize_embeddings)
+
+# Chroma kayıtlı 'sentence_transformer' yapılandırmalarını bu sınıfla kurar; üst sınıf modeli açılışta yüklerdi.
+embedding_functions.register_embedding_function(SentenceEmbeddingFunction)
+
+def onnx_model_dir(config):
+    return os.path.join(EMBEDDING_ONNX_PATH, config['model_name'].replace("/", "__"))
+
+def export_onnx_model(config, quantization=None):
+    """Modeli ONNX'e aktarıp EMBEDDING_ONNX_PATH altına kaydeder; quantization verilirse dinamik int8 sürümünü
+    de üretir. Dosyalar zaten varsa yeniden aktarılmaz. (model_dizini, onnx_dosya_adı) döner."""
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+    model_dir = onnx_model_dir(config)
+    file_name = f"onnx/model_qint8_{quantization}.onnx" if quantization else "onnx/model.onnx"
+    if os.path.exists(os.path.join(model_dir, file_name)):
+        return model_dir, file_name
+    started = time.perf_counter()
+    if not os.path.exists(os.path.join(model_dir, "onnx", "model.onnx")):
+        logging.info(f"'{config['model_name']}' ONNX'e aktarılıyor: {model_dir}")
+        SentenceTransformer(config['model_name'], device="cpu", backend="onnx").save_pretrained(model_dir)
+        if os.path.exists(os.path.join(model_dir, "model.onnx")):
+            os.makedirs(os.path.join(model_dir, "onnx"), exist_ok=True)
+            os.replace(os.path.join(model_dir, "model.onnx"), os.path.join(model_dir, "onnx", "model.onnx"))
+    if quantization:
+        logging.info(f"'{config['model_name']}' için dinamik int8 ({quantization}) ONNX modeli üretiliyor...")
+        model = SentenceTransformer(model_dir, device="cpu", backend="onnx", model_kwargs={"file_name": "onnx/model.onnx"})
+        export_dynamic_quantized_onnx_model(model, quantization, model_dir)
+    logging.info(f"'{config['model_name']}' ONNX aktarımı {time.perf_counter() - started:.1f} sn'de tamamlandı ({file_name}).")
+    return model_dir, file_name
+
+def check_embedding_backend(backend=None):
+    """Embedding çalışma zamanı geçersizse ya da gerektirdiği isteğe bağlı paketler kurulu değilse, modeller
+    yüklenmeye başlamadan açık bir hatayla durur."""
+    backend = (backend or EMBEDDING_BACKEND).lower()
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Bilinmeyen embedding çalışma zamanı: {backend} ({', '.join(EMBEDDING_BACKENDS)} olmalı).")
+    missing = [module for module in EMBEDDING_BACKEND_MODULES.get(backend, ()) if importlib.util.find_spec(module) is None]
+    if missing:
+        raise RuntimeError(
+            f"EMBEDDING_BACKEND={backend} için {', '.join(missing)} paketleri kurulu değil: "
+            f"pip install -r requirements-onnx.txt"
+        )
+    return backend
+
+def load_embedding_function(config, backend=None, threads=None):
+    """config modelini istenen CPU çalışma zamanında yükleyip bir Chroma embedding fonksiyonu döner.
+
+    threads > 0 ise PyTorch için süreç genelindeki, ONNX Runtime için oturum başına thread sayısı ayarlanır.
+    """
+    from sentence_transformers import SentenceTransformer
+    backend = check_embedding_backend(backend)
+    threads = EMBEDDING_THREADS if threads is None else threads
+    if backend.startswith("torch"):
+        import torch
+        if threads > 0:
+            torch.set_num_threads(threads)
+        model = SentenceTransformer(config['model_name'], device="cpu")
+        if backend == "torch-int8":
+            # Linear katmanların ağırlıkları int8'e çevrilir; aktivasyonlar çalışma anında nicemlenir.
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    else:
+        import onnxruntime
+        model_dir, file_name = export_onnx_model(config, EMBEDDING_ONNX_QUANTIZATION if backend == "onnx-int8" else None)
+        session_options = onnxruntime.SessionOptions()
+        if threads > 0:
+            session_options.intra_op_num_threads = threads
+            session_options.inter_op_num_threads = 1
+        model = SentenceTransformer(
+            model_dir, device="cpu", backend="onnx",
+            model_kwargs={"file_name": file_name, "provider": "CPUExecutionProvider", "session_options": session_options}
+        )
+    return SentenceEmbeddingFunction(config['model_name'], model, backend)
+
+
+# --- Gömülü NumPy İndeksi ---
+# Chroma'ya alternatif, süreç içi arama arka ucu. Normalize edilmiş vektörler .npy matrisi olarak, belgeler ve
+# yorumlar ise UTF-8 blob + ofset dizisi olarak saklanır; hepsi bellek eşlemeli (mmap) açıldığından birden fazla
+# işçi süreci aynı disk indeksini sayfa önbelleği üzerinden kopyasız paylaşır.
+NUMPY_INDEX_BASE_PATH = os.getenv('NUMPY_INDEX_PATH', os.path.join(CHROMA_DB_BASE_PATH, 'numpy'))
+
+def numpy_index_path(config):
+    return os.path.join(NUMPY_INDEX_BASE_PATH, config['collection_name'])
+
+def _write_string_store(directory, name, values):
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    with open(os.path.join(directory, f"{name}.bin"), "wb") as f:
+        for i, value in enumerate(values):
+            data = value.encode("utf-8")
+            f.write(data)
+            offsets[i + 1] = offsets[i] + len(data)
+    np.save(os.path.join(directory, f"{name}.offsets.npy"), offsets)
+
+class StringStore:
+    """Ofset dizisiyle indekslenen, bellek eşlemeli UTF-8 metin deposu."""
+
+    def __init__(self, directory, name):
+        self._offsets = np.load(os.path.join(directory, f"{name}.offsets.npy"), mmap_mode="r")
+        self._file = open(os.path.join(directory, f"{name}.bin"), "rb")
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self._offsets[-1] > 0 else b""
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        return self._data[int(self._offsets[i]):int(self._offsets[i + 1])].decode("utf-8")
+
+def export_numpy_index(chroma_collection, config, source_sha256=None, dtype="float16", page_size=5000):
+    # Chroma koleksiyonundaki embedding'leri, belgeleri ve yorumları gömülü indeks biçimine yazar.
+    directory = numpy_index_path(config)
+    tmp_directory = f"{directory}.tmp"
+    os.makedirs(tmp_directory, exist_ok=True)
+    total = chroma_collection.count()
+    vectors = None
+    documents, yorumlar = [], []
+    for offset in range(0, total, page_size):
+        page = chroma_collection.get(limit=page_size, offset=offset, include=['embeddings', 'documents', 'metadatas'])
+        page_vectors = np.asarray(page['embeddings'], dtype=np.float32)
+        if vectors is None:
+            vectors = np.lib.format.open_memmap(
+                os.path.join(tmp_directory, "vectors.npy"), mode="w+", dtype=dtype, shape=(total, page_vectors.shape[1])
+            )
+        norms = np.linalg.norm(page_vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        vectors[offset:offset + len(page_vectors)] = page_vectors / norms
+        documents.extend(page['documents'])
+        yorumlar.extend((metadata or {}).get('yorum', 'Yorum bulunamadı.') for metadata in page['metadatas'])
+    if vectors is not None:
+        vectors.flush()
+        del vectors
+    else:
+        np.save(os.path.join(tmp_directory, "vectors.npy"), np.zeros((0, 0), dtype=dtype))
+    _write_string_store(tmp_directory, "documents", documents)
+    _write_string_store(tmp_directory, "yorum", yorumlar)
+    with open(os.path.join(tmp_directory, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"count": len(documents), "dtype": dtype, "source_sha256": source_sha256, "created_at": time.time()}, f)
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.replace(tmp_directory, directory)
+    logging.info(f"'{config['collection_name']}' gömülü NumPy indeksine aktarıldı ({len(documents)} öğe, {dtype}). Path: {directory}")
+    return directory
+
+def read_numpy_index_meta(config):
+    try:
+        with open(os.path.join(numpy_index_path(config), "meta.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def load_numpy_index(config, chroma_collection, embedding_function=None, dtype="float16"):
+    # Gömülü indeks yoksa veya Chroma koleksiyonundan eskiyse yeniden aktarılır, ardından mmap ile açılır.
+    manifest = read_manifest(config['collection_name'], collection_db_path(config)) or {}
+    meta = read_numpy_index_meta(config)
+    if meta is None or meta.get("source_sha256") != manifest.get("source_sha256") or meta.get("count") != chroma_collection.count():
+        export_numpy_index(chroma_collection, config, manifest.get("source_sha256"), dtype=dtype)
+    return NumpyIndex(numpy_index_path(config), embedding_function)
+
+class NumpyIndex:
+    """Bellek eşlemeli vektör matrisi üzerinde tam (brute-force) top-k arama yapan gömülü indeks.
+
+    Chroma koleksiyonunun query()/count() arayüzünü taklit eder; böylece retrieve_docs_batch
+    değişmeden kullanılabilir. Mesafeler kosinüs mesafesidir (1 - benzerlik).
+    """
+
+    def __init__(self, directory, embedding_function=None, chunk_size=65536):
+        self.directory = directory
+        self.embedding_function = embedding_function
+        self.chunk_size = chunk_size
+        self.metadata = {"hnsw:space": "cosine"}
+        self.vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+        self.documents = StringStore(directory, "documents")
+        self.yorumlar = StringStore(directory, "yorum")
+
+    def count(self):
+        return self.vectors.shape[0]
+
+    def _scores(self, queries):
+        # float16 matrislerde BLAS kullanılabilmesi için parça parça float32'ye çevrilir.
+        if self.vectors.dtype == np.float32:
+            return queries @ self.vectors.T
+        scores = np.empty((queries.shape[0], self.vectors.shape[0]), dtype=np.float32)
+        for start in range(0, self.vectors.shape[0], self.chunk_size):
+            chunk = np.asarray(self.vectors[start:start + self.chunk_size], dtype=np.float32)
+            scores[:, start:start + len(chunk)] = queries @ chunk.T
+        return scores
+
+    def query(self, query_texts=None, query_embeddings=None, n_results=5, include=None):
+        if query_embeddings is None:
+            query_embeddings = self.embedding_function(list(query_texts))
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        queries = queries / norms
+        results = {'ids': [], 'documents': [], 'metadatas': [], 'distances': []}
+        total = self.count()
+        if total == 0:
+            for _ in range(len(queries)):
+                for key in results:
+                    results[key].append([])
+            return results
+        k = min(n_results, total)
+        scores = self._scores(queries)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        for row, candidates in enumerate(top):
+            order = candidates[np.argsort(-scores[row, candidates])]
+            results['ids'].append([str(int(i)) for i in order])
+            results['documents'].append([self.documents[i] for i in order])
+            results['metadatas'].append([{'yorum': self.yorumlar[i]} for i in order])
+            results['distances'].append([float(1.0 - scores[row, i]) for i in order])
+        return results
+
+
+# --- Sözcüksel (BM25) İndeks ---
+TURKISH_CASEFOLD = str.maketrans({"İ": "i", "I": "ı", "â": "a", "Â": "a", "î": "i", "Î": "i", "û": "u", "Û": "u"})
+# Başlıkların hemen hepsinde geçen, eşleşmeye katkısı olmayan kelimeler.
+LEXICAL_STOPWORDS = {
+    "rüyada", "rüya", "rüyası", "rüyasında", "rüyamda", "rüyam", "ve", "veya", "ile", "bir", "bu", "şu", "o",
+    "da", "de", "ki", "için", "gibi", "çok", "sonra", "önce", "ben", "bana", "beni", "benim", "biz", "sen",
+}
+# Çekim ve yapım ekleri; uzun olanlar önce denenir. Tek başına a/e ve ma/me/mak/mek ek sayılmaz:
+# isim köklerinin sonunu da yiyerek farklı kelimeleri birleştirir (para/parmak -> par, elma -> el).
+TURKISH_SUFFIXES = sorted({
+    "lar", "ler", "ları", "leri", "ların", "lerin", "lara", "lere", "larda", "lerde", "lardan", "lerden",
+    "nın", "nin", "nun", "nün", "ın", "in", "un", "ün", "yı", "yi", "yu", "yü", "ı", "i", "u", "ü",
+    "ya", "ye", "da", "de", "ta", "te", "dan", "den", "tan", "ten", "la", "le", "yla", "yle",
+    "sı", "si", "su", "sü", "ım", "im", "um", "üm", "ması", "mesi", "dığı", "diği",
+    "duğu", "düğü", "tığı", "tiği", "tuğu", "tüğü", "ken", "lık", "lik", "luk", "lük", "m",
+}, key=len, reverse=True)
+LEXICAL_MIN_STEM = 2
+# Yapım ekleri (balık -> ba gibi) yanlış budamayı önlemek için daha uzun bir kök gerektirir.
+TURKISH_DERIVATIONAL_SUFFIXES = {"lık", "lik", "luk", "lük"}
+# Ek atıldıktan sonra yumuşamış son ünsüz sertleştirilir (ağacı -> ağaç, balığı -> balık).
+TURKISH_DEVOICING = {"ğ": "k", "b": "p", "c": "ç", "d": "t"}
+
+def turkish_casefold(text):
+    # Türkçe büyük/küçük harf dönüşümü: İ -> i, I -> ı; düzeltme işaretleri kaldırılır.
+    return unicodedata.normalize("NFC", str(text)).translate(TURKISH_CASEFOLD).lower()
+
+def turkish_stem(word):
+    # Hafif ek budama: en fazla üç ek atılır; amaç dilbilgisel doğruluk değil, sorgu ile başlıkta aynı kökü üretmektir.
+    stripped = False
+    for _ in range(3):
+        for suffix in TURKISH_SUFFIXES:
+            min_stem = LEXICAL_MIN_STEM + 1 if suffix in TURKISH_DERIVATIONAL_SUFFIXES else LEXICAL_MIN_STEM
+            if word.endswith(suffix) and len(word) - len(suffix) >= min_stem:
+                word = word[:-len(suffix)]
+                stripped = True
+                break
+        else:
+            break
+    if stripped and word[-1] in TURKISH_DEVOICING:
+        word = word[:-1] + TURKISH_DEVOICING[word[-1]]
+    return word
+
+def lexical_surface_terms(text):
+    # Budanmamış, küçük harfe çevrilmiş kelimeler; birebir başlık eşleşmesi yalnızca bunlarla yapılır.
+    words = re.findall(r"\w+", turkish_casefold(text))
+    return [word for word in words if word not in LEXICAL_STOPWORDS and not word.isdigit()]
+
+def lexical_terms(text):
+    return [turkish_stem(word) for word in lexical_surface_terms(text)]
+
+class LexicalIndex:
+    """'Rüya' başlıkları üzerinde Türkçe normalizasyonlu ters indeks ve BM25 puanlaması.
+
+    Tüm embedding modelleri aynı derlemi kullandığından tek bir örnek paylaşılır. Kelimeleri (ek budamadan
+    önce) birebir aynı olan başlıklar exact_titles üzerinden doğrudan bulunur; yalnızca kökleri tutan
+    başlıklar birebir sayılmaz.
+    """
+
+    def __init__(self, rows, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.documents = []
+        self.yorumlar = []
+        self.postings = {}
+        self.exact_titles = {}
+        doc_lengths = []
+        for ruya, yorum in rows:
+            terms = lexical_terms(ruya)
+            doc_id = len(self.documents)
+            self.documents.append(ruya)
+            self.yorumlar.append(yorum)
+            doc_lengths.append(len(terms))
+            self.exact_titles.setdefault(tuple(lexical_surface_terms(ruya)), doc_id)
+            for term in set(terms):
+                self.postings.setdefault(term, []).append((doc_id, terms.count(term)))
+        self.doc_lengths = doc_lengths
+        self.avg_doc_length = (sum(doc_lengths) / len(doc_lengths)) if doc_lengths else 0.0
+        total = len(self.documents)
+        self.idf = {
+            term: math.log(1 + (total - len(posting) + 0.5) / (len(posting) + 0.5))
+            for term, posting in self.postings.items()
+        }
+        # Derlemde hiç geçmeyen sorgu terimleri en nadir terim kadar ağırlık taşır.
+        self.unknown_idf = math.log(1 + (total + 0.5) / 0.5)
+
+    @classmethod
+    def from_excel(cls, file_path):
+        return cls(iter_excel_rows(file_path))
+
+    @classmethod
+    def from_collection(cls, chroma_collection, page_size=5000):
+        # Excel yokken derlem mevcut koleksiyondan sayfa sayfa okunur.
+        rows = []
+        offset = 0
+        while True:
+            page = chroma_collection.get(limit=page_size, offset=offset, include=['documents', 'metadatas'])
+            if not page['ids']:
+                break
+            rows.extend(
+                (document, (metadata or {}).get('yorum', 'Yorum bulunamadı.'))
+                for document, metadata in zip(page['documents'], page['metadatas'])
+            )
+            offset += len(page['ids'])
+        return cls(rows)
+
+    def __len__(self):
+        return len(self.documents)
+
+    def extract_queries(self, text, max_queries=6, max_document_ratio=0.05):
+        """Rüya metnindeki anahtar kelimeler için 'Rüyada [Nesne] [Eylem]' biçimli sorgular üretir (LLM'siz).
+
+        Başlıklarda geçen ama çok yaygın olmayan (belge oranı max_document_ratio altında; 'görmek' gibi
+        fiiller elenir) her terim için, metindeki diğer terimleri en çok kapsayan, eşitlikte en genel
+        başlık sorgu olarak seçilir. Sorgular terimlerin metindeki sırasıyla döner.
+        """
+        terms = lexical_terms(text)
+        if not terms or not self.documents:
+            return []
+        term_set = set(terms)
+        max_documents = max(1, int(len(self.documents) * max_document_ratio))
+        queries = []
+        seen_keywords = set()
+        for term in terms:
+            posting = self.postings.get(term)
+            if term in seen_keywords or not posting or len(posting) > max_documents:
+                continue
+            seen_keywords.add(term)
+            best_id = min(
+                (doc_id for doc_id, _ in posting),
+                key=lambda doc_id: self._title_fit(doc_id, term_set)
+            )
+            title = self.documents[best_id]
+            if title not in queries:
+                queries.append(title)
+            if len(queries) >= max_queries:
+                break
+        return queries
+
+    def _title_fit(self, doc_id, term_set):
+        # Küçük değer daha iyi: metni daha çok kapsayan, kalan terimleri daha genel (düşük IDF) olan kısa başlık.
+        title_terms = lexical_terms(self.documents[doc_id])
+        covered = sum(1 for term in title_terms if term in term_set)
+        extra_weight = sum(self.idf.get(term, self.unknown_idf) for term in title_terms if term not in term_set)
+        return (-covered / (len(title_terms) or 1), extra_weight, len(self.documents[doc_id]))
+
+    def search(self, query, n_results=5):
+        """En iyi n_results başlığı [{ruya, yorum, score, match, exact}] olarak döner.
+
+        match, sorgu terimlerinin IDF ağırlıklı kapsanma oranı ile başlık terimlerinin kapsanma
+        oranının küçüğüdür (0-1); 1.0 sorgu ve başlığın aynı köklerden oluştuğu anlamına gelir. exact
+        yalnızca sorgu ile başlığın kelimeleri ek budamadan önce de aynıysa True olur.
+        """
+        terms = lexical_terms(query)
+        if not terms or not self.documents:
+            return []
+        exact_id = self.exact_titles.get(tuple(lexical_surface_terms(query)))
+        unique_terms = set(terms)
+        query_weight = sum(self.idf.get(term, self.unknown_idf) for term in unique_terms)
+        scores = {}
+        matched_weight = {}
+        matched_count = {}
+        for term in unique_terms:
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_id, tf in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / (self.avg_doc_length or 1.0))
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+                matched_weight[doc_id] = matched_weight.get(doc_id, 0.0) + idf
+                matched_count[doc_id] = matched_count.get(doc_id, 0) + tf
+        if exact_id is not None:
+            scores.setdefault(exact_id, 0.0)
+        best = sorted(scores, key=lambda doc_id: (doc_id != exact_id, -scores[doc_id]))[:n_results]
+        hits = []
+        for doc_id in best:
+            query_coverage = matched_weight.get(doc_id, 0.0) / query_weight if query_weight else 0.0
+            title_coverage = matched_count.get(doc_id, 0) / self.doc_lengths[doc_id] if self.doc_lengths[doc_id] else 0.0
+            hits.append({
+                "ruya": self.documents[doc_id],
+                "yorum": self.yorumlar[doc_id],
+                "score": scores[doc_id],
+                "match": 1.0 if doc_id == exact_id else min(query_coverage, title_coverage),
+                "exact": doc_id == exact_id,
+            })
+        return hits
+
+
+# --- Çevrimdışı Toplu İndeks Oluşturucu ---
+def _init_build_worker():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - [%(processName)s] %(message)s')
+
+def build_collection(model_key, file_path, encode_batch_size=256, write_batch_size=4000, full=False):
+    """Tek bir MODEL_CONFIG koleksiyonunu önceden hesaplanmış embedding'lerle günceller (ayrı süreçte çalışır).
+
+    Aynı 'Rüya' metni birden fazla satırda geçse bile yalnızca bir kez encode edilir.
+    """
+    config = MODEL_CONFIG[model_key]
+    chroma_db_path = collection_db_path(config)
+    os.makedirs(chroma_db_path, exist_ok=True)
+    started = time.perf_counter()
+
+    embedding_function = SentenceEmbeddingFunction(config['model_name'])
+    collection_metadata = hnsw_metadata(config)
+    chroma_client, chroma_collection = create_chroma_client(config['collection_name'], embedding_function, chroma_db_path, collection_metadata)
+    if full:
+        logging.info(f"'{config['collection_name']}' sıfırdan oluşturuluyor...")
+        chroma_client.delete_collection(config['collection_name'])
+        manifest_path = manifest_path_for(config['collection_name'], chroma_db_path)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        chroma_client, chroma_collection = create_chroma_client(config['collection_name'], embedding_function, chroma_db_path, collection_metadata)
+
+    source_sha256 = file_sha256(file_path)
+    stats = {"model": model_key, "rows": 0, "added": 0, "deleted": 0, "encoded_texts": 0, "encode_seconds": 0.0, "rows_per_sec": 0.0}
+    if is_index_current(chroma_collection, config['collection_name'], chroma_db_path, source_sha256):
+        stats["rows"] = chroma_collection.count()
+        stats["total_seconds"] = time.perf_counter() - started
+        logging.info(f"'{config['collection_name']}' zaten güncel ({stats['rows']} öğe).")
+        return stats
+
+    rows = read_excel_rows(file_path)
+    ids_to_add, ids_to_delete = plan_index_sync(chroma_collection, config['collection_name'], chroma_db_path, rows)
+    stats.update(rows=len(rows), added=len(ids_to_add), deleted=len(ids_to_delete))
+
+    for i in range(0, len(ids_to_delete), write_batch_size):
+        chroma_collection.delete(ids=ids_to_delete[i:i + write_batch_size])
+
+    unique_texts = list(dict.fromkeys(rows[row_id][0] for row_id in ids_to_add))
+    if unique_texts:
+        encode_started = time.perf_counter()
+        # Chroma sorgularıyla aynı vektörleri üretmek için embedding fonksiyonunun yüklediği model kullanılır.
+        vectors = embedding_function.model.encode(
+            unique_texts,
+            batch_size=encode_batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=embedding_function.normalize_embeddings,
+            show_progress_bar=False
+        )
+        stats["encode_seconds"] = time.perf_counter() - encode_started
+        stats["encoded_texts"] = len(unique_texts)
+        vector_by_text = dict(zip(unique_texts, vectors))
+
+        for i in range(0, len(ids_to_add), write_batch_size):
+            batch_ids = ids_to_add[i:i + write_batch_size]
+            chroma_collection.upsert(
+                ids=batch_ids,
+                embeddings=[vector_by_text[rows[row_id][0]] for row_id in batch_ids],
+                documents=[rows[row_id][0] for row_id in batch_ids],
+                metadatas=[{'yorum': rows[row_id][1]} for row_id in batch_ids]
+            )
+
+    write_manifest(config['collection_name'], chroma_db_path, source_sha256, rows.keys())
+    stats["total_seconds"] = time.perf_counter() - started
+    stats["rows_per_sec"] = stats["added"] / stats["total_seconds"] if stats["total_seconds"] > 0 else 0.0
+    logging.info(
+        f"'{config['collection_name']}': {stats['added']} eklendi, {stats['deleted']} silindi, "
+        f"{stats['encoded_texts']} benzersiz metin {stats['encode_seconds']:.1f} sn'de encode edildi, "
+        f"{stats['rows_per_sec']:.1f} satır/sn."
+    )
+    return stats
+
+def build_all(model_keys, file_path, workers=None, encode_batch_size=256, write_batch_size=4000, full=False):
+    # Her model ayrı bir süreçte işlenir; torch ile güvenli çalışması için 'spawn' kullanılır.
+    workers = workers or len(model_keys)
+    if CHROMA_LAYOUT == "shared" and workers > 1:
+        # Tek bir Chroma veritabanına birden fazla süreç aynı anda yazamaz.
+        logging.info("Paylaşımlı Chroma düzeninde koleksiyonlar tek süreçte sırayla oluşturulur.")
+        workers = 1
+    context = multiprocessing.get_context("spawn")
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_build_worker) as executor:
+        futures = {
+            executor.submit(build_collection, model_key, file_path, encode_batch_size, write_batch_size, full): model_key
+            for model_key in model_keys
+        }
+        for future in concurrent.futures.as_completed(futures):
+            model_key = futures[future]
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logging.error(f"{model_key} koleksiyonu oluşturulurken hata: {e}")
+                results.append({"model": model_key, "error": str(e)})
+    return results
+
+# --- Düzen Karşılaştırması (per_model / shared) ---
+def _process_memory():
+    # Linux'ta anlık RSS (/proc), diğer sistemlerde tepe RSS (resource) değeri MB olarak döner.
+    try:
+        with open("/proc/self/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def _open_file_count():
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return None
+
+def measure_layout(layout, model_keys, n_queries=50, n_results=5):
+    """Bir Chroma düzenini ayrı bir süreçte açıp bellek kullanımını ve sorgu gecikmesini ölçer.
+
+    Sorgular koleksiyonda saklı embedding'lerle yapılır; böylece embedding modeli yüklenmez ve yalnızca
+    Chroma tarafının maliyeti ölçülür.
+    """
+    rss_before = _process_memory()
+    threads_before = threading.active_count()
+    started = time.perf_counter()
+    collections = {}
+    for model_key in model_keys:
+        config = MODEL_CONFIG[model_key]
+        chroma_client = get_chroma_client(collection_db_path(config, layout))
+        collections[model_key] = chroma_client.get_collection(config['collection_name'], embedding_function=None)
+    open_seconds = time.perf_counter() - started
+    rss_open = _process_memory()
+
+    latencies = []
+    for model_key, chroma_collection in collections.items():
+        sample = chroma_collection.get(limit=n_queries, include=['embeddings'])
+        for vector in sample['embeddings']:
+            query_started = time.perf_counter()
+            chroma_collection.query(query_embeddings=[vector], n_results=n_results, include=['distances'])
+            latencies.append((time.perf_counter() - query_started) * 1000.0)
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] if latencies else 0.0
+
+    return {
+        "layout": layout,
+        "clients": len(_chroma_clients),
+        "open_seconds": open_seconds,
+        "rss_open_mb": rss_open - rss_before,
+        "rss_total_mb": _process_memory() - rss_before,
+        "threads": threading.active_count() - threads_before,
+        "open_files": _open_file_count(),
+        "queries": len(latencies),
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+    }
+
+def compare_layouts(model_keys, n_queries=50):
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for layout in ("per_model", "shared"):
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=_init_build_worker) as executor:
+            try:
+                results.append(executor.submit(measure_layout, layout, model_keys, n_queries).result())
+            except Exception as e:
+                logging.error(f"'{layout}' düzeni ölçülemedi (önce 'CHROMA_LAYOUT={layout} python ruya_index.py' ile oluşturun): {e}")
+    return results
+
+# --- Embedding Çalışma Zamanı Karşılaştırması (FP32 / int8 / ONNX) ---
+def measure_embedding_backend(model_key, backend, queries, threads=0):
+    """Bir embedding çalışma zamanını ayrı bir süreçte yükleyip bellek kullanımını, yükleme süresini ve sorgu
+    gecikmesini ölçer. Recall karşılaştırması için sorgu vektörlerini de döner."""
+    rss_before = _process_memory()
+    started = time.perf_counter()
+    embedding_function = load_embedding_function(MODEL_CONFIG[model_key], backend, threads)
+    load_seconds = time.perf_counter() - started
+    rss_loaded = _process_memory() - rss_before
+    embedding_function(queries[:1]) # İlk çağrıdaki tek seferlik hazırlık ölçüme katılmasın
+
+    latencies = []
+    for query in queries:
+        query_started = time.perf_counter()
+        embedding_function([query])
+        latencies.append((time.perf_counter() - query_started) * 1000.0)
+    latencies.sort()
+    batch_started = time.perf_counter()
+    vectors = np.asarray(embedding_function(queries), dtype=np.float32)
+    batch_seconds = time.perf_counter() - batch_started
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] if latencies else 0.0
+
+    return {
+        "backend": backend,
+        "load_seconds": load_seconds,
+        "rss_mb": rss_loaded,
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "batch_qps": len(queries) / batch_seconds if batch_seconds > 0 else 0.0,
+        "vectors": vectors,
+    }
+
+def sample_queries(chroma_collection, n_queries, seed=0):
+    # Koleksiyondaki rüya başlıklarından tekrarsız, sabit tohumlu bir örnek.
+    documents = list(dict.fromkeys(chroma_collection.get(include=['documents'])['documents']))
+    return random.Random(seed).sample(documents, min(n_queries, len(documents)))
+
+def compare_embedding_backends(model_key, backends, n_queries=200, k=10, threads=0, queries=None):
+    """FP32 (torch) sorgu embedding'leriyle diğer çalışma zamanlarını aynı koleksiyon üzerinde karşılaştırır.
+
+    recall@k, nicemlenmiş sorgu vektörüyle bulunan ilk k belgenin FP32 sorgu vektörüyle bulunanlarla örtüşme
+    oranıdır; koleksiyondaki belge vektörleri her iki durumda da aynıdır. Her çalışma zamanı bellek ölçümünün
+    karışmaması için ayrı bir süreçte yüklenir.
+    """
+    config = MODEL_CONFIG[model_key]
+    chroma_collection = get_chroma_client(collection_db_path(config)).get_collection(config['collection_name'], embedding_function=None)
+    queries = list(queries) if queries else sample_queries(chroma_collection, n_queries)
+    context = multiprocessing.get_context("spawn")
+    backends = ["torch"] + [backend for backend in backends if backend != "torch"]
+    results = []
+    for backend in backends:
+        if backend.startswith("onnx"):
+            # Tek seferlik ONNX aktarımı ölçülen süreçten önce ayrı bir süreçte yapılır.
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=_init_build_worker) as executor:
+                executor.submit(export_onnx_model, config, EMBEDDING_ONNX_QUANTIZATION if backend == "onnx-int8" else None).result()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=_init_build_worker) as executor:
+            try:
+                results.append(executor.submit(measure_embedding_backend, model_key, backend, queries, threads).result())
+            except Exception as e:
+                logging.error(f"{model_key} için '{backend}' çalışma zamanı ölçülemedi: {e}")
+                if backend == "torch":
+                    return []
+
+    baseline = results[0]["vectors"]
+    baseline_ids = chroma_collection.query(query_embeddings=baseline, n_results=k, include=[])['ids']
+    for result in results:
+        vectors = result.pop("vectors")
+        ids = baseline_ids if vectors is baseline else chroma_collection.query(query_embeddings=vectors, n_results=k, include=[])['ids']
+        overlaps = [len(set(found) & set(expected)) / max(1, len(expected)) for found, expected in zip(ids, baseline_ids)]
+        norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(baseline, axis=1)
+        result.update(
+            model=model_key,
+            queries=len(queries),
+            recall_at_k=sum(overlaps) / len(overlaps) if overlaps else 0.0,
+            cosine_to_fp32=float(np.mean(np.sum(vectors * baseline, axis=1) / np.maximum(norms, 1e-12))),
+        )
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rüya tabiri koleksiyonlarını çevrimdışı ve paralel olarak oluşturur/günceller.")
+    parser.add_argument("--excel", default=EXCEL_FILE_PATH, help="Kaynak Excel dosyası")
+    parser.add_argument("--models", nargs="+", choices=list(MODEL_CONFIG.keys()), default=list(MODEL_CONFIG.keys()))
+    parser.add_argument("--workers", type=int, default=0, help="Paralel süreç sayısı (0 = model sayısı)")
+    parser.add_argument("--encode-batch-size", type=int, default=256)
+    parser.add_argument("--write-batch-size", type=int, default=4000)
+    parser.add_argument("--full", action="store_true", help="Koleksiyonları silip sıfırdan oluştur")
+    parser.add_argument("--compare-layouts", action="store_true",
+                        help="per_model ve shared Chroma düzenlerinin bellek kullanımını ve sorgu gecikmesini karşılaştır")
+    parser.add_argument("--queries", type=int, default=None,
+                        help="Model başına sorgu sayısı (--compare-layouts için varsayılan 50, --compare-embeddings için 200)")
+    parser.add_argument("--migrate-space", action="store_true",
+                        help=f"Başka uzaydaki (örn. l2) koleksiyonları yeniden embed etmeden '{CHROMA_DISTANCE_SPACE}' uzayına taşı")
+    parser.add_argument("--export-numpy", action="store_true",
+                        help="Mevcut Chroma koleksiyonlarını gömülü NumPy indeksine (RETRIEVAL_BACKEND=numpy) aktar")
+    parser.add_argument("--numpy-dtype", choices=["float16", "float32"], default="float16")
+    parser.add_argument("--compare-embeddings", action="store_true",
+                        help="Nicemlenmiş/ONNX çalışma zamanlarını FP32'ye karşı recall@k, bellek ve gecikme açısından karşılaştır")
+    parser.add_argument("--export-onnx", action="store_true",
+                        help="Modelleri EMBEDDING_ONNX_PATH altına ONNX (ve int8 ONNX) olarak önceden aktar")
+    parser.add_argument("--backends", nargs="+", choices=list(EMBEDDING_BACKENDS), default=["torch-int8", "onnx", "onnx-int8"],
+                        help="--compare-embeddings için FP32 ile karşılaştırılacak çalışma zamanları")
+    parser.add_argument("--k", type=int, default=10, help="--compare-embeddings için recall@k değeri")
+    parser.add_argument("--threads", type=int, default=EMBEDDING_THREADS, help="Embedding thread sayısı (0 = varsayılan)")
+    parser.add_argument("--queries-file", help="--compare-embeddings için satır başına bir sorgu içeren dosya (varsayılan: koleksiyondan örnek)")
+    parser.add_argument("--min-recall", type=float, default=0.0, help="recall@k bu değerin altındaysa çıkış kodu 1 olur")
+    args = parser.parse_args(argv)
+
+    _init_build_worker()
+    if args.migrate_space:
+        failed = False
+        for model_key in args.models:
+            config = MODEL_CONFIG[model_key]
+            try:
+                # Belge vektörleri kopyalandığından model yüklenmez; fonksiyon yalnızca koleksiyon yapılandırmasına yazılır.
+                migrate_distance_space(
+                    get_chroma_client(collection_db_path(config)), config['collection_name'],
+                    SentenceEmbeddingFunction(config['model_name']), hnsw_metadata(config)
+                )
+            except Exception as e:
+                logging.error(f"{model_key} koleksiyonu taşınamadı: {e}")
+                failed = True
+        return 1 if failed else 0
+    if args.export_numpy:
+        for model_key in args.models:
+            config = MODEL_CONFIG[model_key]
+            chroma_db_path = collection_db_path(config)
+            chroma_collection = get_chroma_client(chroma_db_path).get_collection(config['collection_name'], embedding_function=None)
+            manifest = read_manifest(config['collection_name'], chroma_db_path) or {}
+            export_numpy_index(chroma_collection, config, manifest.get("source_sha256"), dtype=args.numpy_dtype)
+        return 0
+    if args.export_onnx:
+        for model_key in args.models:
+            export_onnx_model(MODEL_CONFIG[model_key])
+            export_onnx_model(MODEL_CONFIG[model_key], EMBEDDING_ONNX_QUANTIZATION)
+        return 0
+    if args.compare_embeddings:
+        queries = None
+        if args.queries_file:
+            with open(args.queries_file, encoding="utf-8") as f:
+                queries = [line.strip() for line in f if line.strip()]
+        all_results = []
+        for model_key in args.models:
+            try:
+                all_results.extend(compare_embedding_backends(model_key, args.backends, args.queries or 200, args.k, args.threads, queries))
+            except Exception as e:
+                logging.error(f"{model_key} için karşılaştırma yapılamadı (koleksiyon oluşturulmuş olmalı): {e}")
+        print(f"\n{'Model':<14} {'Çalışma zamanı':<15} {'Yükleme (sn)':>13} {'RSS (MB)':>9} {'p50 (ms)':>9} {'p95 (ms)':>9} "
+              f"{'Toplu sorgu/sn':>15} {'Kosinüs':>8} {f'Recall@{args.k}':>10}")
+        for r in all_results:
+            print(f"{r['model']:<14} {r['backend']:<15} {r['load_seconds']:>13.1f} {r['rss_mb']:>9.0f} {r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} "
+                  f"{r['batch_qps']:>15.1f} {r['cosine_to_fp32']:>8.4f} {r['recall_at_k']:>10.3f}")
+        if not all_results:
+            return 1
+        return 0 if all(r['recall_at_k'] >= args.min_recall for r in all_results) else 1
+    if args.compare_layouts:
+        results = compare_layouts(args.models, args.queries or 50)
+        print(f"\n{'Düzen':<10} {'İstemci':>8} {'Açılış (sn)':>12} {'RSS açılış (MB)':>16} {'RSS toplam (MB)':>16} "
+              f"{'Thread':>7} {'Dosya':>6} {'p50 (ms)':>9} {'p95 (ms)':>9}")
+        for r in results:
+            print(f"{r['layout']:<10} {r['clients']:>8} {r['open_seconds']:>12.2f} {r['rss_open_mb']:>16.1f} {r['rss_total_mb']:>16.1f} "
+                  f"{r['threads']:>7} {str(r['open_files']):>6} {r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f}")
+        return 0 if len(results) == 2 else 1
+
+    if not os.path.exists(args.excel):
+        logging.error(f"Excel dosyası bulunamadı: {args.excel}")
+        return 1
+    started = time.perf_counter()
+    results = build_all(args.models, args.excel, args.workers or None, args.encode_batch_size, args.write_batch_size, args.full)
+    print(f"\n{'Model':<14} {'Satır':>8} {'Eklenen':>8} {'Silinen':>8} {'Encode (sn)':>12} {'Satır/sn':>10}")
+    for stats in sorted(results, key=lambda r: r["model"]):
+        if "error" in stats:
+            print(f"{stats['model']:<14} HATA: {stats['error']}")
+            continue
+        print(f"{stats['model']:<14} {stats['rows']:>8} {stats['added']:>8} {stats['deleted']:>8} "
+              f"{stats['encode_seconds']:>12.1f} {stats['rows_per_sec']:>10.1f}")
+    print(f"Toplam süre: {time.perf_counter() - started:.1f} sn")
+    return 0 if all("error" not in stats for stats in results) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
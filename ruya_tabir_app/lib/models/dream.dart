@@ -5,6 +5,7 @@ class Dream {
   final DateTime date;
   final String status;
   final bool isSynced; 
+  final String? jobId; // Sunucunun /submit_dream yanıtında döndüğü iş kimliği
 
   Dream({
     required this.id,
@@ -13,6 +14,7 @@ class Dream {
     required this.date,
     required this.status,
     required this.isSynced,
+    this.jobId,
   });
 
   // JSON'dan Dream nesnesi oluşturma
@@ -24,6 +26,7 @@ class Dream {
       date: DateTime.parse(json['date'] as String),
       status: json['status'] as String? ?? 'bekleniyor',
       isSynced: json['isSynced'] as bool? ?? true, // Eski kayıtlar için varsayılan değer
+      jobId: json['jobId'] as String?,
     );
   }
 
@@ -36,6 +39,7 @@ class Dream {
       'date': date.toIso8601String(),
       'status': status,
       'isSynced': isSynced,
+      'jobId': jobId,
     };
   }
 
@@ -47,6 +51,7 @@ class Dream {
     DateTime? date,
     String? status,
     bool? isSynced,
+    String? jobId,
   }) {
     return Dream(
       id: id ?? this.id,
@@ -55,6 +60,7 @@ class Dream {
       date: date ?? this.date,
       status: status ?? this.status,
       isSynced: isSynced ?? this.isSynced,
+      jobId: jobId ?? this.jobId,
     );
   }
 } 
\ No newline at end of file
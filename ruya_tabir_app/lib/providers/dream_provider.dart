@@ -121,7 +121,7 @@ class DreamProvider with ChangeNotifier {
   }
 
   // Yeni Fonksiyon: API'ye başarıyla gönderilmiş bir rüyayı kaydeder
-  Future<void> recordSubmittedDream(String text, {required String dreamIdFromServer}) async {
+  Future<void> recordSubmittedDream(String text, {required String dreamIdFromServer, String? jobId}) async {
     await _lock.synchronized(() async {
       // Eğer aynı ID ile bir taslak varsa, onu güncelle; yoksa yeni oluştur.
       final existingDraftIndex = _dreams.indexWhere((d) => d.id == dreamIdFromServer && d.status == 'taslak');
@@ -130,6 +130,7 @@ class DreamProvider with ChangeNotifier {
           status: 'bekleniyor',
           isSynced: true,
           interpretation: "Yorumunuz hazırlanıyor...",
+          jobId: jobId,
         );
          debugPrint("Mevcut taslak (ID: $dreamIdFromServer) gönderildi olarak güncellendi.");
       } else {
@@ -146,6 +147,7 @@ class DreamProvider with ChangeNotifier {
             date: DateTime.now(),
             status: 'bekleniyor',
             isSynced: true,
+            jobId: jobId,
           );
           _dreams.add(newDream);
           debugPrint("Yeni gönderilmiş rüya (ID: $dreamIdFromServer) kaydedildi.");
@@ -154,7 +156,7 @@ class DreamProvider with ChangeNotifier {
            // Veya isSynced false durumdaki bir 'bekleniyor'u true yapabiliriz.
            final existingUnsyncedIndex = _dreams.indexWhere((d) => d.id == dreamIdFromServer && d.status == 'bekleniyor' && !d.isSynced);
            if (existingUnsyncedIndex != -1) {
-             _dreams[existingUnsyncedIndex] = _dreams[existingUnsyncedIndex].copyWith(isSynced: true);
+             _dreams[existingUnsyncedIndex] = _dreams[existingUnsyncedIndex].copyWith(isSynced: true, jobId: jobId);
              debugPrint("Daha önce senkronize olamamış rüya (ID: $dreamIdFromServer) şimdi senkronize edildi.");
            } else {
              debugPrint("Rüya (ID: $dreamIdFromServer) zaten farklı bir durumda kayıtlı, tekrar eklenmedi/güncellenmedi.");
@@ -195,6 +197,7 @@ class DreamProvider with ChangeNotifier {
                 status: 'bekleniyor', // Durumu 'bekleniyor' yap
                 isSynced: true,     // Senkronize edildi olarak işaretle
                 interpretation: "Bu rüya daha önce işlenmiş. Sonuçları kontrol edebilirsiniz.", // Özel mesaj
+                jobId: _apiService.lastJobId,
               );
               await _saveDreams();
             }
@@ -212,6 +215,7 @@ class DreamProvider with ChangeNotifier {
               status: 'bekleniyor',
               isSynced: true,
               interpretation: "Yorumunuz hazırlanıyor...",
+              jobId: _apiService.lastJobId,
             );
             await _saveDreams();
           }
@@ -232,12 +236,14 @@ class DreamProvider with ChangeNotifier {
 
   // Senkronize edilmemiş tüm rüyaları API'ye göndermeye çalışır
   // Bu fonksiyon artık sadece 'bekleniyor' durumunda olup 'isSynced = false' olanları hedefler.
+  // İş kimliği olmadan kaydedilmiş eski bekleyen rüyalar da yeniden gönderilir; sunucu aynı metni
+  // mevcut işe bağlar ve yorumlar ancak iş kimliğiyle sorgulanabilir.
   // 'taslak' rüyalar manuel olarak SavedDreamsScreen'den gönderilir.
   Future<void> syncUnsyncedDreams() async {
     List<Dream> dreamsToSync = [];
     await _lock.synchronized(() {
       // Sadece 'bekleniyor' durumunda olup senkronize olmamışları al
-      dreamsToSync = List.from(_dreams.where((dream) => dream.status == 'bekleniyor' && !dream.isSynced));
+      dreamsToSync = List.from(_dreams.where((dream) => dream.status == 'bekleniyor' && (!dream.isSynced || dream.jobId == null)));
     });
     
     if (dreamsToSync.isEmpty) {
@@ -255,7 +261,7 @@ class DreamProvider with ChangeNotifier {
           await _lock.synchronized(() async {
             final index = _dreams.indexWhere((d) => d.id == dream.id);
             if (index >= 0) {
-              _dreams[index] = _dreams[index].copyWith(isSynced: true);
+              _dreams[index] = _dreams[index].copyWith(isSynced: true, jobId: _apiService.lastJobId);
               anyDreamSyncedInThisRun = true;
               debugPrint("Rüya senkronize edildi: ${dream.text}");
             }
@@ -292,7 +298,9 @@ class DreamProvider with ChangeNotifier {
     _pollingTimer = Timer.periodic(const Duration(seconds: 60), (timer) async {
       debugPrint("Yeni yorumlar için sunucu kontrol ediliyor...");
       try {
-        List<Map<String, dynamic>> newInterpretations = await _apiService.checkForNewInterpretations();
+        // Sunucu yalnızca iş kimliğiyle sorgulanan sonuçları döner (en fazla 50 kimlik)
+        final jobIds = pendingDreams.map((dream) => dream.jobId).whereType<String>().take(50).toList();
+        List<Map<String, dynamic>> newInterpretations = await _apiService.checkForNewInterpretations(jobIds);
 
         if (newInterpretations.isNotEmpty) {
           debugPrint("${newInterpretations.length} adet yeni yorum geldi.");
@@ -320,11 +328,16 @@ class DreamProvider with ChangeNotifier {
     await _lock.synchronized(() async {
       debugPrint("${newInterpretations.length} adet yeni yorum geldi. _updateInterpretations içinde.");
       for (var interpretationData in newInterpretations) {
+        String? jobId = interpretationData['job_id'];
         String? dreamText = interpretationData['ruya'];
         String? yorum = interpretationData['yorum'];
 
         if (dreamText != null && yorum != null) {
-          final dreamIndex = _dreams.indexWhere((d) => d.text == dreamText && d.status == 'bekleniyor' && d.isSynced);
+          // Önce iş kimliğiyle eşleştir; aynı metinli birden çok rüya olabilir
+          var dreamIndex = jobId == null ? -1 : _dreams.indexWhere((d) => d.jobId == jobId && d.status == 'bekleniyor' && d.isSynced);
+          if (dreamIndex == -1) {
+            dreamIndex = _dreams.indexWhere((d) => d.text == dreamText && d.status == 'bekleniyor' && d.isSynced);
+          }
           if (dreamIndex != -1) {
             _dreams[dreamIndex] = _dreams[dreamIndex].copyWith(
               interpretation: yorum,
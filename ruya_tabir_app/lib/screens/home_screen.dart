@@ -184,7 +184,7 @@ class _HomeScreenState extends State<HomeScreen> {
       bool apiSuccess = await _apiService.submitDream(dreamText);
 
       if (apiSuccess) {
-        await dreamProvider.recordSubmittedDream(dreamText, dreamIdFromServer: localDreamId);
+        await dreamProvider.recordSubmittedDream(dreamText, dreamIdFromServer: localDreamId, jobId: _apiService.lastJobId);
         if (mounted) {
           final newRemainingDreams = await dreamProvider.getRemainingDreamsToday();
           ScaffoldMessenger.of(context).showSnackBar(
@@ -11,12 +11,16 @@ class ApiService {
   final Duration _healthCheckTimeout = const Duration(seconds: 10); // Sağlık kontrolü timeout süresini artırdım
   final Connectivity _connectivity = Connectivity();
   http.Response? _lastResponse; // Son API yanıtını saklamak için
+  String? _lastJobId; // Son başarılı gönderimde sunucunun döndüğü iş kimliği
 
   // Son API yanıtını almak için getter
   Future<http.Response?> getLastResponse() async {
     return _lastResponse;
   }
 
+  // Son gönderilen rüyanın iş kimliği; yorumlar bu kimlikle sorgulanır
+  String? get lastJobId => _lastJobId;
+
   // İnternet bağlantısını kontrol et
   Future<bool> _checkConnectivity() async {
     try {
@@ -30,6 +34,7 @@ class ApiService {
 
   // Yeni metot: Rüyayı sunucuya gönderir
   Future<bool> submitDream(String dreamText) async {
+    _lastJobId = null;
     // Önce bağlantı kontrolü yap
     bool isConnected = await _checkConnectivity();
     if (!isConnected) {
@@ -80,7 +85,8 @@ class ApiService {
           if (_lastResponse!.statusCode == 208) {
             debugPrint('Rüya daha önce işlenmiş, kullanıcıya bilgi veriliyor');
           }
-          
+
+          _lastJobId = jsonResponse['job_id'] as String?;
           return true;
         } catch (e) {
           debugPrint('API yanıtı JSON parse edilemedi: $e');
@@ -159,8 +165,12 @@ class ApiService {
     }
   }
   
-  // Yeni metot: Yeni yorumları kontrol eder
-  Future<List<Map<String, dynamic>>> checkForNewInterpretations() async {
+  // Yeni metot: Verilen işlerin yeni yorumlarını kontrol eder
+  Future<List<Map<String, dynamic>>> checkForNewInterpretations(List<String> jobIds) async {
+    if (jobIds.isEmpty) {
+      return [];
+    }
+
     // Önce bağlantı kontrolü yap
     bool isConnected = await _checkConnectivity();
     if (!isConnected) {
@@ -168,7 +178,7 @@ class ApiService {
       return [];
     }
 
-    final Uri url = Uri.parse('$_baseUrl/check_interpretations');
+    final Uri url = Uri.parse('$_baseUrl/check_interpretations').replace(queryParameters: {'job_id': jobIds});
     debugPrint('Yeni yorumları kontrol etme isteği gönderiliyor: $url');
 
     try {
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""jobs.py iş deposu ve kuyruk arka uçları (memory, SQLite) için eşzamanlılık ve kira testleri."""
+import threading
+import time
+
+import pytest
+
+import jobs
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    url = "memory" if request.param == "memory" else f"sqlite:///{tmp_path / 'jobs.sqlite3'}"
+    store, queue = jobs.open_job_backend(url, result_ttl=3600, maxsize=0, poll_interval=0.01)
+    yield store, queue
+    queue.close()
+
+
+def run_concurrently(count, target):
+    barrier = threading.Barrier(count)
+    results = [None] * count
+    errors = []
+
+    def run(index):
+        try:
+            barrier.wait()
+            results[index] = target(index)
+        except Exception as e: # Hata ana thread'de raporlanır
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert not errors
+    return results
+
+
+def test_concurrent_submits_of_same_text_create_one_job(backend):
+    store, queue = backend
+    variants = ["Rüyamda yılan gördüm.", "rüyamda  yılan gördüm", "RÜYAMDA YILAN GÖRDÜM!"]
+    results = run_concurrently(12, lambda i: queue.submit(variants[i % len(variants)]))
+
+    job_ids = {job["job_id"] for job, _ in results}
+    assert len(job_ids) == 1
+    assert sum(1 for _, created in results if created) == 1
+    assert store.get(job_ids.pop())["subscribers"] == 12
+    assert len(queue) == 1
+
+
+def test_claimers_never_get_the_same_job(backend):
+    store, queue = backend
+    submitted = {queue.submit(f"rüya {i}")[0]["job_id"] for i in range(40)}
+
+    def drain(_):
+        claimed = []
+        while True:
+            job = queue.get(timeout=0.2)
+            if job is None:
+                return claimed
+            assert job["status"] == jobs.JOB_RUNNING
+            claimed.append(job["job_id"])
+
+    claimed = [job_id for batch in run_concurrently(4, drain) for job_id in batch]
+    assert len(claimed) == len(set(claimed))
+    assert set(claimed) == submitted
+    assert store.get(claimed[0])["attempts"] == 1
+
+
+def test_priority_orders_claims(backend):
+    _, queue = backend
+    low = queue.submit("düşük öncelik", priority=5)[0]["job_id"]
+    high = queue.submit("yüksek öncelik", priority=1)[0]["job_id"]
+    assert [queue.get(timeout=1)["job_id"], queue.get(timeout=1)["job_id"]] == [high, low]
+
+
+def test_full_queue_leaves_no_job_behind(tmp_path):
+    for url in ("memory", f"sqlite:///{tmp_path / 'full.sqlite3'}"):
+        store, queue = jobs.open_job_backend(url, maxsize=1, poll_interval=0.01)
+        queue.submit("ilk rüya")
+        with pytest.raises(jobs.DreamQueueFull):
+            queue.submit("ikinci rüya")
+        assert store.counts()[jobs.JOB_QUEUED] == 1
+        # Aynı metin dolu kuyrukta da mevcut işe bağlanabilir.
+        assert queue.submit("İlk rüya.")[1] is False
+
+
+def test_get_wakes_up_on_submit(backend):
+    _, queue = backend
+    claimed = []
+    waiter = threading.Thread(target=lambda: claimed.append(queue.get(timeout=5)))
+    waiter.start()
+    time.sleep(0.05)
+    job, _ = queue.submit("bekleyen işçi")
+    waiter.join(5)
+    assert claimed and claimed[0]["job_id"] == job["job_id"]
+
+
+def test_stale_lease_is_requeued_then_failed_after_max_attempts(tmp_path):
+    store, queue = jobs.open_job_backend(f"sqlite:///{tmp_path / 'lease.sqlite3'}", poll_interval=0.01)
+    job, _ = queue.submit("yarıda kalan rüya")
+
+    assert queue.get(timeout=1)["job_id"] == job["job_id"]
+    time.sleep(0.01)
+    assert queue.recover_stale(lease_timeout=0, max_attempts=2, error_message="zaman aşımı") == ([job["job_id"]], [])
+    requeued = store.get(job["job_id"])
+    assert requeued["status"] == jobs.JOB_QUEUED and requeued["attempts"] == 1
+
+    assert queue.get(timeout=1)["job_id"] == job["job_id"]
+    time.sleep(0.01)
+    assert queue.recover_stale(lease_timeout=0, max_attempts=2, error_message="zaman aşımı") == ([], [job["job_id"]])
+    failed = store.get(job["job_id"])
+    assert failed["status"] == jobs.JOB_FAILED and failed["error"] == "zaman aşımı" and failed["attempts"] == 2
+    assert queue.get(timeout=0.05) is None
+
+
+def test_heartbeat_keeps_lease(tmp_path):
+    store, queue = jobs.open_job_backend(f"sqlite:///{tmp_path / 'heartbeat.sqlite3'}", poll_interval=0.01)
+    job, _ = queue.submit("uzun süren rüya")
+    queue.get(timeout=1)
+    time.sleep(0.2)
+    store.heartbeat([job["job_id"]])
+    assert queue.recover_stale(lease_timeout=0.1, max_attempts=3, error_message="zaman aşımı") == ([], [])
+    assert store.get(job["job_id"])["status"] == jobs.JOB_RUNNING
+
+
+def test_memory_queue_has_no_stale_leases():
+    _, queue = jobs.open_job_backend("memory")
+    queue.submit("rüya")
+    queue.get(timeout=1)
+    assert queue.recover_stale(lease_timeout=0, max_attempts=1, error_message="x") == ([], [])
+
+
+def test_deliveries_match_subscribers(backend):
+    store, queue = backend
+    job_id = None
+    for _ in range(3):
+        job_id = queue.submit("paylaşılan rüya")[0]["job_id"]
+    queue.get(timeout=1)
+    assert store.take_undelivered([job_id]) == [] # Henüz bitmedi
+    store.mark_done(job_id, "yorum")
+
+    delivered = [store.take_undelivered([job_id]) for _ in range(5)]
+    assert [len(batch) for batch in delivered] == [1, 1, 1, 0, 0]
+    assert delivered[0][0]["yorum"] == "yorum"
+    assert store.get(job_id)["deliveries"] == 3
+
+
+def test_finished_job_releases_text(backend):
+    store, queue = backend
+    first, _ = queue.submit("tekrar eden rüya")
+    queue.get(timeout=1)
+    store.mark_done(first["job_id"], "yorum")
+    second, created = queue.submit("tekrar eden rüya")
+    assert created and second["job_id"] != first["job_id"]